@@ -1,7 +1,12 @@
+# Imported first, the startup profile measures from here
+from lib import startup_profile
+
+import os
 import sys
+import argparse
 import struct
+import time
 import logging
-import datetime
 import subprocess
 
 from PyQt5 import QtWidgets, QtGui, QtCore
@@ -9,13 +14,41 @@ from pyqtgraph.dockarea import *
 
 from lib import QtLogger
 from lib import QtSensor
-from lib import QtVicon
-from lib.serial_interface import list_available_ports
+from lib import metrics
+from lib import backends
+from lib import async_writer
+from lib.QtMetrics import QtMetricsBox
+from lib.QtPortWatcher import QtPortWatcher
 
 # Initialize logger
 logging.getLogger().setLevel(logging.INFO)
 
 
+# Default number of sensor boxes and the number of boxes per row
+NUM_SENSORS = 4
+SENSORS_PER_ROW = 4
+
+# How the devices are run
+#  - thread: one worker thread per device
+#  - engine: all devices on one acquisition engine (event loop)
+#  - process: one OS process per device
+BACKEND = {
+    'thread': 0,
+    'engine': 1,
+    'process': 2
+}
+
+# Options of the Vicon box, resolved to the ViconInterface constants once the Vicon backend is loaded
+VICON_STREAM_MODES = ['server_push', 'client_pull', 'client_pull_prefetch']
+VICON_MARKER_STREAMS = ['markers', 'unlabeled_markers']
+
+# Number of samples each sensor can be ahead of the plotter
+PLOTTER_RING_CAPACITY = 4096
+
+# Default options of the live plotter (see python QtPlotter.py --help), extended by the --plot-* command line options
+PLOTTER_OPTIONS = []
+
+
 def load_style(filename):
     # Add the stylesheet to the application
     try:
@@ -28,10 +61,12 @@ def load_style(filename):
 
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, app_instance, *args):
+    def __init__(self, app_instance, num_sensors=NUM_SENSORS, backend=BACKEND['thread'], vicon_stream='server_push',
+                 vicon_markers=(), plotter_options=(), *args):
         super().__init__(*args)
 
         self.app_instance = app_instance
+        self.plotter_options = PLOTTER_OPTIONS + list(plotter_options)
 
         ''' WINDOW CONFIGURATION '''
         self.experiment_name = "Experiment 0"
@@ -47,8 +82,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.style_menu_classic.setStatusTip('Set to light mode')
         self.style_menu_classic.triggered.connect(lambda: self.change_style('classic'))
 
-        main_menu = self.menuBar()
-        main_menu = main_menu.addMenu('Window')
+        self.export_menu_log = QtWidgets.QAction("Export text logs", self)
+        self.export_menu_log.setStatusTip('Export the current recordings to output/*.log')
+        self.export_menu_log.triggered.connect(self.export_logs)
+
+        menu_bar = self.menuBar()
+        file_menu = menu_bar.addMenu('File')
+        file_menu.addAction(self.export_menu_log)
+
+        main_menu = menu_bar.addMenu('Window')
         main_menu.addAction(self.style_menu_dark)
         main_menu.addAction(self.style_menu_classic)
 
@@ -98,21 +140,37 @@ class MainWindow(QtWidgets.QMainWindow):
         self.config_layout.addWidget(self.mode_select_8)
         self.config_layout.addWidget(self.mode_select_32)
 
-        # Vicon instance
-        self.vicon_box = QtVicon.QtVicon("Vicon", self.experiment_name)
+        # Device backend [BACKEND], only the selected one is imported. The thread workers are created by the boxes
+        # themselves
+        self.backend = backend
+        self.engine = None
+        if self.backend == BACKEND['engine']:
+            from lib.QtEngine import QtAcquisitionEngine
+            self.engine = QtAcquisitionEngine(self)
+        self.process_workers = []
+
+        # Vicon instance (None if the Vicon SDK is not available, a placeholder box is shown instead)
+        self.vicon_box = None
+        self.vicon_widget = self.create_vicon_box(vicon_stream, vicon_markers)
 
         # Sensors
-        self.sensor_box_1 = QtSensor.QtSensor("Sensor 1", self.experiment_name, int(self.mode_select_32.isChecked()), self)
-        self.sensor_box_2 = QtSensor.QtSensor("Sensor 2", self.experiment_name, int(self.mode_select_32.isChecked()), self)
-        self.sensor_box_3 = QtSensor.QtSensor("Sensor 3", self.experiment_name, int(self.mode_select_32.isChecked()), self)
-        self.sensor_box_4 = QtSensor.QtSensor("Sensor 4", self.experiment_name, int(self.mode_select_32.isChecked()), self)
-
-        # Sensor horizontal layout
-        self.sensor_layout = QtWidgets.QHBoxLayout()
-        self.sensor_layout.addWidget(self.sensor_box_1)
-        self.sensor_layout.addWidget(self.sensor_box_2)
-        self.sensor_layout.addWidget(self.sensor_box_3)
-        self.sensor_layout.addWidget(self.sensor_box_4)
+        op_mode = int(self.mode_select_32.isChecked())
+        self.sensor_boxes = []
+        for i in range(num_sensors):
+            title = "Sensor {}".format(i + 1)
+            worker = self.create_worker(title, 'tmos', op_mode)
+            self.sensor_boxes.append(QtSensor.QtSensor(title, self.experiment_name, op_mode, self, worker=worker))
+
+            # The live plotter is launched when the first sensor starts
+            self.sensor_boxes[-1].start_button.clicked.connect(self.start_plotter)
+
+        if self.engine is not None:
+            self.engine.start()
+
+        # Sensor grid layout
+        self.sensor_layout = QtWidgets.QGridLayout()
+        for i, box in enumerate(self.sensor_boxes):
+            self.sensor_layout.addWidget(box, i // SENSORS_PER_ROW, i % SENSORS_PER_ROW)
 
         # Start button
         self.start_all_button = QtWidgets.QPushButton(self)
@@ -145,7 +203,7 @@ class MainWindow(QtWidgets.QMainWindow):
         # Main vertical Layout
         root_layout = QtWidgets.QVBoxLayout()
         root_layout.addWidget(self.config_box)
-        root_layout.addWidget(self.vicon_box)
+        root_layout.addWidget(self.vicon_widget)
         root_layout.addLayout(self.sensor_layout)
         root_layout.addLayout(start_stop_layout)
         root_layout.addWidget(self.log_text_box)
@@ -168,8 +226,14 @@ class MainWindow(QtWidgets.QMainWindow):
         self.main_dock = Dock("Main configuration")
         self.main_dock.addWidget(self.scroll)
 
+        # Dock with the live acquisition metrics
+        self.metrics_box = QtMetricsBox(parent=self)
+        self.metrics_dock = Dock("Metrics")
+        self.metrics_dock.addWidget(self.metrics_box)
+
         # Add docks to dock area
         self.dock_area.addDock(self.main_dock)
+        self.dock_area.addDock(self.metrics_dock, 'bottom', self.main_dock)
 
         # Set dock area as main window central widget
         self.setCentralWidget(self.dock_area)
@@ -177,26 +241,153 @@ class MainWindow(QtWidgets.QMainWindow):
         # Set dark theme as default
         self.change_style('dark')
 
-        # Update COM ports after initialization
-        self.update_com_ports()
+        # The metrics are also written to output/metrics_*.jsonl periodically
+        self.metrics_reporter = metrics.MetricsReporter(metrics.get_registry())
+        self.metrics_reporter.start()
+
+        # Scan the COM ports in the background and follow plugged/unplugged boards
+        self.port_watcher = QtPortWatcher(parent=self)
+        self.port_watcher.ports_changed.connect(self.com_ports_changed)
+        self.port_watcher.start()
+
+        # Live plotter, every sensor publishes its samples into its own shared memory ring. The rings and the
+        # plotter process (a second Qt application) are only created once a sensor starts, see start_plotter
+        self.plotter_rings = dict()
+        self.plotter_args = []
+        self.plotter_process = None
+
+    def closeEvent(self, event):
+        self.port_watcher.stop()
+        if self.plotter_process is not None:
+            self.plotter_process.terminate()
+
+        for box in self.sensor_boxes:
+            box.set_plotter_ring(None)
+
+        for ring in self.plotter_rings.values():
+            ring.close()
+
+        if self.engine is not None:
+            self.engine.stop()
+
+        for worker in self.process_workers:
+            worker.stop()
+        if self.process_workers:
+            from lib import device_process
+            device_process.stop_start_manager()
+
+        # Write the queued samples and close all recordings
+        async_writer.stop_shared_writer()
+
+        # Last metrics snapshot, after everything was written
+        self.metrics_reporter.stop()
+
+        super().closeEvent(event)
+
+    def create_vicon_box(self, stream_name, marker_streams):
+        """ Vicon box (self.vicon_box), the Vicon backend is loaded here
+
+            :param stream_name:
+                Stream mode [VICON_STREAM_MODES]
+            :param marker_streams:
+                Marker streams to record [VICON_MARKER_STREAMS]
+
+            :returns:
+                The widget to show: the Vicon box, or a disabled placeholder if the Vicon SDK is not available
+        """
 
-        self.log_process = subprocess.Popen("python QtPlotter.py", stdin=subprocess.PIPE, stdout=None, encoding='utf-8')
-        self.sensor_box_1.set_logger_process(self.log_process)
-        # self.sensor_box_2.set_logger_process(self.log_process)
-        # self.sensor_box_3.set_logger_process(self.log_process)
-        # self.sensor_box_4.set_logger_process(self.log_process)
+        reason = backends.get_unavailable_reason('vicon')
+        if reason is None:
+            try:
+                from lib import QtVicon
+
+                ViconInterface = backends.get_interface_class('vicon')
+                stream_mode = ViconInterface.STREAM_MODE[stream_name]
+                profile = ViconInterface.DATA_STREAM['segments']
+                for name in marker_streams:
+                    profile |= ViconInterface.DATA_STREAM[name]
+
+                # The interface is created with the profile, the box only sends later changes
+                vicon_worker = self.create_worker("Vicon", 'vicon', stream_mode, dict({"profile": profile}))
+                self.vicon_box = QtVicon.QtVicon("Vicon", self.experiment_name, worker=vicon_worker,
+                                                 stream_mode=stream_mode, profile=profile)
+                return self.vicon_box
+            except backends.BackendUnavailable as e:
+                reason = str(e)
+
+        logging.warning("Vicon disabled: " + reason)
+
+        placeholder = QtWidgets.QGroupBox(self)
+        placeholder.setTitle("Vicon")
+        placeholder.setEnabled(False)
+        placeholder_layout = QtWidgets.QVBoxLayout()
+        placeholder_layout.addWidget(QtWidgets.QLabel("Not available: " + reason))
+        placeholder.setLayout(placeholder_layout)
+
+        return placeholder
+
+    def start_plotter(self):
+        """ Launch the live plotter if it isn't running (first start of a sensor, or after it was closed)
+        """
+
+        if self.plotter_process is not None and self.plotter_process.poll() is None:
+            return
+
+        if not backends.is_available('plotter'):
+            logging.warning("Live plotter not available: " + backends.get_unavailable_reason('plotter'))
+            return
+
+        if not self.plotter_rings:
+            self.create_plotter_rings()
+
+        self.plotter_process = subprocess.Popen([sys.executable, "QtPlotter.py"] + self.plotter_args + self.plotter_options)
+
+    def create_plotter_rings(self):
+        from lib.shm_ring import SharedRingBuffer
+        from lib.recorder import SAMPLE_DTYPES
+
+        for i, box in enumerate(self.sensor_boxes):
+            ring = SharedRingBuffer.create("tmos_{}_{}".format(os.getpid(), i + 1), SAMPLE_DTYPES['tmos'],
+                                           PLOTTER_RING_CAPACITY)
+            self.plotter_rings[box.title()] = ring
+            box.set_plotter_ring(ring)
+            self.plotter_args += ["--ring", "{}={}".format(box.title(), ring.get_name())]
 
     def update_com_ports(self):
-        available_ports = list_available_ports()
-        self.sensor_box_1.update_com_port_list(available_ports)
-        self.sensor_box_2.update_com_port_list(available_ports)
-        self.sensor_box_3.update_com_port_list(available_ports)
-        self.sensor_box_4.update_com_port_list(available_ports)
+        self.port_watcher.refresh()
+
+    def com_ports_changed(self, available_ports):
+        for box in self.sensor_boxes:
+            box.update_com_port_list(available_ports)
 
     def adjust_widget_size(self):
         self.main_central_widget.adjustSize()
         self.resize(self.main_central_widget.sizeHint())
 
+    def create_worker(self, title, kind, mode=0, options=None):
+        """ Worker of a device for the engine or process backend, options are further arguments of the interface
+
+            :returns:
+                The worker or None for the thread backend
+        """
+
+        if self.backend == BACKEND['engine']:
+            if kind == 'vicon':
+                return self.engine.add_vicon_device(title, self.experiment_name, mode, options)
+            return self.engine.add_serial_device(title, self.experiment_name, mode)
+
+        if self.backend == BACKEND['process']:
+            from lib.QtDeviceProcess import QtProcessWorker
+
+            worker = QtProcessWorker(title, self.experiment_name, kind, mode, options, parent=self)
+            self.process_workers.append(worker)
+            return worker
+
+        return None
+
+    def get_device_boxes(self):
+        return self.sensor_boxes + ([self.vicon_box] if self.vicon_box is not None else [])
+
     def set_title(self):
         self.setWindowTitle("TMOS App - " + self.experiment_name)
 
@@ -220,31 +411,39 @@ class MainWindow(QtWidgets.QMainWindow):
     def start_all_button_clicked(self):
         logging.info("Starting all connected devices")
 
-        t0 = datetime.datetime.now()
-
-        self.sensor_box_1.start_button.click()
-        self.sensor_box_1.set_reference_time(t0)
-
-        self.sensor_box_2.start_button.click()
-        self.sensor_box_2.set_reference_time(t0)
+        t0 = time.monotonic_ns()
+        boxes = [box for box in self.get_device_boxes() if box.start_button.isEnabled()]
+        if not boxes:
+            return
 
-        self.sensor_box_3.start_button.click()
-        self.sensor_box_3.set_reference_time(t0)
+        for box in boxes:
+            box.set_reference_time(t0)
 
-        self.sensor_box_4.start_button.click()
-        self.sensor_box_4.set_reference_time(t0)
+        if any(box in self.sensor_boxes for box in boxes):
+            self.start_plotter()
 
-        self.vicon_box.start_button.click()
-        self.vicon_box.set_reference_time(t0)
+        # All devices are prepared in parallel and then send their start command at the same time. The device
+        # processes share the coordinator through a manager process
+        if self.backend == BACKEND['process']:
+            from lib import device_process
+            coordinator = device_process.create_start_coordinator(len(boxes), t0)
+        else:
+            from lib.start_sync import StartCoordinator
+            coordinator = StartCoordinator(len(boxes), t0=t0)
+        for box in boxes:
+            box.start_synchronized(coordinator)
 
     def stop_all_button_clicked(self):
         logging.info("Stopping all connected devices")
 
-        self.sensor_box_1.stop_button.click()
-        self.sensor_box_2.stop_button.click()
-        self.sensor_box_3.stop_button.click()
-        self.sensor_box_4.stop_button.click()
-        self.vicon_box.stop_button.click()
+        for box in self.get_device_boxes():
+            box.stop_button.click()
+
+    def export_logs(self):
+        logging.info("Exporting recordings to text logs")
+
+        for box in self.get_device_boxes():
+            box.export_log()
 
     def save_config(self):
         msg = QtWidgets.QMessageBox()
@@ -264,33 +463,70 @@ class MainWindow(QtWidgets.QMainWindow):
             # Change file handlers
             self.experiment_name = self.experiment_name_line.text()
             self.set_title()
-            self.sensor_box_1.change_file_handler(self.experiment_name)
-            self.sensor_box_2.change_file_handler(self.experiment_name)
-            self.sensor_box_3.change_file_handler(self.experiment_name)
-            self.sensor_box_4.change_file_handler(self.experiment_name)
-            self.vicon_box.change_file_handler(self.experiment_name)
+            for box in self.get_device_boxes():
+                box.change_file_handler(self.experiment_name)
 
             # Change operation mode
             op_mode = int(self.mode_select_32.isChecked())
-            self.sensor_box_1.change_mode(op_mode)
-            self.sensor_box_2.change_mode(op_mode)
-            self.sensor_box_3.change_mode(op_mode)
-            self.sensor_box_4.change_mode(op_mode)
-            self.vicon_box.change_mode(op_mode)
+            for box in self.get_device_boxes():
+                box.change_mode(op_mode)
 
             logging.info("Configuration successfully saved!")
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="TMOS App")
+    parser.add_argument("--sensors", type=int, default=NUM_SENSORS, help="Number of sensor boxes")
+    backend_group = parser.add_mutually_exclusive_group()
+    backend_group.add_argument("--engine", action="store_true",
+                               help="Run all devices on one acquisition engine (event loop) instead of one thread each")
+    backend_group.add_argument("--processes", action="store_true",
+                               help="Run every device in its own process")
+    parser.add_argument("--vicon-stream", choices=VICON_STREAM_MODES, default='server_push',
+                        help="Vicon stream mode (default: server_push, buffered and lossless)")
+    parser.add_argument("--vicon-markers", nargs='+', choices=VICON_MARKER_STREAMS, default=[],
+                        help="Also record the labeled and/or unlabeled Vicon markers")
+    parser.add_argument("--plot-channels", metavar="CHANNELS",
+                        help="Comma separated channels shown by the live plotter (or all, default: dist_raw)")
+    parser.add_argument("--plot-points", type=int, metavar="N", help="Number of samples shown per sensor")
+    parser.add_argument("--plot-history", action="store_true",
+                        help="Keep the whole session in the live plotter instead of the last samples")
+    args, qt_args = parser.parse_known_args()
+    startup_profile.mark("imports")
+
+    if args.engine:
+        backend = BACKEND['engine']
+    elif args.processes:
+        backend = BACKEND['process']
+    else:
+        backend = BACKEND['thread']
+
+    plotter_options = []
+    if args.plot_channels:
+        plotter_options += ["--channels", args.plot_channels]
+    if args.plot_points:
+        plotter_options += ["--points", str(args.plot_points)]
+    if args.plot_history:
+        plotter_options.append("--history")
+
     # Main application
-    app = QtWidgets.QApplication(sys.argv)
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     QtCore.QThread.currentThread().setObjectName('main')
+    startup_profile.mark("application")
 
     # Main window
-    main_window = MainWindow(app)
+    main_window = MainWindow(app, args.sensors, backend, args.vicon_stream, args.vicon_markers, plotter_options)
+    startup_profile.mark("main window")
 
     # Start
     main_window.show()
     main_window.adjust_widget_size()
 
+    # Report once the event loop runs (the window is shown)
+    def startup_done():
+        startup_profile.mark("show")
+        startup_profile.log_report()
+
+    QtCore.QTimer.singleShot(0, startup_done)
+
     app.exec_()
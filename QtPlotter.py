@@ -1,12 +1,17 @@
 import sys
+import time
 import queue
-import numpy as np
+import argparse
 
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import pyqtSlot
 
 import pyqtgraph as pg
 
+from lib.shm_ring import SharedRingBuffer
+from lib.recorder import SAMPLE_DTYPES, parse_rows
+from lib.plot_buffers import CircularBuffer, HistoryStore
+
 
 class QThread1(QtCore.QThread):
     def __init__(self, data_queue, parent=None):
@@ -20,7 +25,7 @@ class QThread1(QtCore.QThread):
 
             data = line.split('\t')
             if len(data) > 2:
-                self.data_queue.put(dict({"id": data[0], "type": data[1], "data": data[2]}))
+                self.data_queue.put(dict({"id": data[0], "type": data[1], "data": data[2].rstrip('\n')}))
 
 
 class QtLivePlotter(QtWidgets.QMainWindow):
@@ -39,41 +44,74 @@ class QtLivePlotter(QtWidgets.QMainWindow):
         'dist_filt': {"pos": 5, "title": "Filtered value"},
         'vel': {"pos": 6, "title": "Velocity"},
         'bin_1': {"pos": 7, "title": "Presence bit"},
-        'bin_2': {"pos": 8, "title": "Movement bit"}
+        'bin_2': {"pos": 8, "title": "Movement bit"},
+        'rx_time': {"pos": 9, "title": "PC receive time"}
     }
 
+    # Channels which are plotted with --channels all
+    PLOT_CHANNELS = ['dist_raw', 'temp', 'dist_filt', 'vel', 'bin_1', 'bin_2']
+
     NUM_DATA_POINTS = 100
 
+    # Minimum number of points drawn per curve in history mode (otherwise twice the plot width in pixels)
+    MIN_HISTORY_POINTS = 500
+
     data_plot_queue = queue.Queue()
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, rings=None, num_points=None, channels=None, history=False, *args, **kwargs):
         super(QtLivePlotter, self).__init__(*args, **kwargs)
 
+        if num_points is not None:
+            self.NUM_DATA_POINTS = num_points
+
+        # History mode keeps the whole session and draws it through min/max pyramids
+        self.history = history
+        self.history_dirty = False
+
         self.setWindowTitle("TMOS Logger")
 
         self.main_widget = QtWidgets.QWidget()
         self.main_layout = QtWidgets.QVBoxLayout()
 
         self.label = QtWidgets.QLabel()
-        self.label.setText(sys.stdin.encoding)
         self.main_layout.addWidget(self.label)
 
         # Graphs
-        # self.graphs = {"dist_raw": dict(), "dist_filt": dict(), "vel": dict(), "temp": dict()}
-        self.graphs = {"dist_raw": dict()}
-        for gr in self.graphs:
+        self.graphs = dict()
+        for gr in (channels or ["dist_raw"]):
             self.graphs[gr] = dict({"widget": pg.PlotWidget(title=self.TMOS_DATA_BIT_POS[gr]["title"]), "plots": dict()})
             self.graphs[gr]["widget"].getPlotItem().addLegend()
             self.graphs[gr]["widget"].getPlotItem().setLabel(axis="left", text=self.TMOS_DATA_BIT_POS[gr]["title"])
             self.graphs[gr]["widget"].getPlotItem().setLabel(axis="bottom", text="time")
 
+            # All graphs share the time axis
+            first_graph = next(iter(self.graphs.values()))
+            if first_graph is not self.graphs[gr]:
+                self.graphs[gr]["widget"].setXLink(first_graph["widget"])
+
+            if self.history:
+                self.graphs[gr]["widget"].getPlotItem().getViewBox().sigXRangeChanged.connect(self.history_range_changed)
+
             self.main_layout.addWidget(self.graphs[gr]["widget"])
 
         self.main_widget.setLayout(self.main_layout)
         self.setCentralWidget(self.main_widget)
 
-        self.read_thread = QThread1(self.data_plot_queue)
-        self.read_thread.start()
+        # Sample buffers of every sensor (time + plotted channels)
+        self.buffers = dict()
+
+        # Shared memory rings (one per sensor) or text lines on stdin
+        self.rings = dict()
+        for ring_id, ring_name in (rings or dict()).items():
+            self.rings[ring_id] = dict({"ring": SharedRingBuffer.attach(ring_name, SAMPLE_DTYPES['tmos']), "seq": 0,
+                                        "lost": 0})
+
+        if self.rings:
+            self.label.setText("Shared memory: " + ", ".join(self.rings.keys()))
+        else:
+            self.label.setText(sys.stdin.encoding)
+            self.read_thread = QThread1(self.data_plot_queue)
+            self.read_thread.start()
 
         self.timer = QtCore.QTimer()
         self.timer.setInterval(10)
@@ -82,58 +120,130 @@ class QtLivePlotter(QtWidgets.QMainWindow):
 
     @pyqtSlot()
     def update_plot(self):
-        try:
-            # Get all queued points
-            while not self.data_plot_queue.empty():
-                record = self.data_plot_queue.get(block=False)
-                # self.label.setText(record)
-                # continue
-                # if record["type"] != self.DATA_TYPES['tmos']:
-                #     continue
+        # Collect everything received since the last tick, per sensor
+        batches = dict()
+        for ring_id, obj in self.rings.items():
+            records, obj["seq"], lost = obj["ring"].read(obj["seq"])
+            obj["ring"].acknowledge(obj["seq"], time.monotonic_ns())
+            obj["lost"] += lost
 
-                for graph_id, obj in self.graphs.items():
-                    # If plot does not exist, create it
-                    if record["id"] not in self.graphs[graph_id]["plots"]:
-                        self.create_graph(graph_id, record["id"])
+            if len(records):
+                batches.setdefault(ring_id, []).append(records)
 
-                    self.update_graph(graph_id, self.graphs[graph_id]["plots"][record["id"]], record)
+        rows = dict()
+        try:
+            while True:
+                record = self.data_plot_queue.get(block=False)
+                rows.setdefault(record["id"], []).append(record["data"])
         except queue.Empty:
             pass
 
+        for sensor_id, sensor_rows in rows.items():
+            batches.setdefault(sensor_id, []).append(parse_rows(sensor_rows, SAMPLE_DTYPES['tmos']))
+
+        # Append the batches and redraw every curve once
+        for sensor_id, blocks in batches.items():
+            if sensor_id not in self.buffers:
+                self.buffers[sensor_id] = self.create_buffer()
+
+            for block in blocks:
+                self.buffers[sensor_id].append(block)
+
+            if not self.history_dirty:
+                self.update_graphs(sensor_id)
+
+        # Zoomed or panned in history mode: redraw all sensors at the new resolution
+        if self.history_dirty:
+            self.history_dirty = False
+            for sensor_id in self.buffers:
+                self.update_graphs(sensor_id)
+
+    @pyqtSlot()
+    def history_range_changed(self):
+        self.history_dirty = True
+
+    def create_buffer(self):
+        if self.history:
+            return HistoryStore(list(self.graphs.keys()))
+
+        return CircularBuffer(self.NUM_DATA_POINTS, ["time"] + list(self.graphs.keys()))
+
     def create_graph(self, graph_id, plot_name):
         self.graphs[graph_id]["plots"][plot_name] = dict()
         cur_plot = self.graphs[graph_id]["plots"][plot_name]
-        cur_plot["x"] = np.array(self.NUM_DATA_POINTS * [0])
-        cur_plot["y"] = np.array(self.NUM_DATA_POINTS * [0])
-        cur_plot["line"] = self.graphs[graph_id]["widget"].plot(cur_plot["x"], cur_plot["y"],
-                                                                pen=pg.intColor(len(self.graphs[graph_id]["plots"])),
+        cur_plot["line"] = self.graphs[graph_id]["widget"].plot(pen=pg.intColor(len(self.graphs[graph_id]["plots"])),
                                                                 name=plot_name)
 
-    def update_graph(self, graph_id, cur_plot, new_data):
-        cur_plot["x"][:-1] = cur_plot["x"][1:]
-        cur_plot["x"][-1] = float(new_data['data'].split(',')[self.TMOS_DATA_BIT_POS["time"]["pos"]])
-        cur_plot["y"][:-1] = cur_plot["y"][1:]
-        cur_plot["y"][-1] = float(new_data['data'].split(',')[self.TMOS_DATA_BIT_POS[graph_id]["pos"]])
-        cur_plot["line"].setData(cur_plot["x"], cur_plot["y"])
+    def update_graphs(self, sensor_id):
+        buffer = self.buffers[sensor_id]
+
+        for graph_id in self.graphs:
+            # If plot does not exist, create it
+            if sensor_id not in self.graphs[graph_id]["plots"]:
+                self.create_graph(graph_id, sensor_id)
+
+            if self.history:
+                x, y = self.render_history(graph_id, buffer)
+            else:
+                x, y = buffer.view("time"), buffer.view(graph_id)
+
+            self.graphs[graph_id]["plots"][sensor_id]["line"].setData(x, y)
+
+    def render_history(self, graph_id, buffer):
+        view_box = self.graphs[graph_id]["widget"].getPlotItem().getViewBox()
+
+        # Follow the whole session unless the user zoomed in
+        if view_box.autoRangeEnabled()[0]:
+            x0, x1 = buffer.x_range()
+        else:
+            x0, x1 = view_box.viewRange()[0]
+
+        max_points = max(2 * int(view_box.width()), self.MIN_HISTORY_POINTS)
+        return buffer.render(graph_id, x0, x1, max_points)
 
     def reset_graphs(self):
+        for buffer in self.buffers.values():
+            buffer.reset()
+
         for _, obj in self.graphs.items():
-            # If plot does not exist, create it
             for _, sensor_plot in obj["plots"].items():
-                sensor_plot["x"] = np.array(self.NUM_DATA_POINTS * [0])
-                sensor_plot["y"] = np.array(self.NUM_DATA_POINTS * [0])
-                sensor_plot["line"].setData(sensor_plot["x"], sensor_plot["y"])
+                sensor_plot["line"].setData([], [])
+
+
+def parse_rings(ring_args):
+    rings = dict()
+    for arg in ring_args:
+        ring_id, _, ring_name = arg.rpartition('=')
+        rings[ring_id] = ring_name
+
+    return rings
 
 
 if __name__ == '__main__':
     # sys.stdin = open("output/ALL_TEMP_SENSOR_1.log")
 
+    parser = argparse.ArgumentParser(description="TMOS live plotter")
+    parser.add_argument("--ring", action="append", default=[],
+                        help="Shared memory ring of a sensor as NAME=SHM_NAME (repeatable). Reads stdin if omitted")
+    parser.add_argument("--points", type=int, default=QtLivePlotter.NUM_DATA_POINTS,
+                        help="Number of samples shown per sensor")
+    parser.add_argument("--channels", default="dist_raw",
+                        help="Comma separated channels to plot ({} or all)".format(",".join(QtLivePlotter.PLOT_CHANNELS)))
+    parser.add_argument("--history", action="store_true",
+                        help="Keep the whole session (zoom out to see it) instead of the last --points samples")
+    args, qt_args = parser.parse_known_args()
+
+    if args.channels == "all":
+        plot_channels = QtLivePlotter.PLOT_CHANNELS
+    else:
+        plot_channels = [c for c in args.channels.split(',') if c in QtLivePlotter.TMOS_DATA_BIT_POS and c != 'time']
+
     # Main application
-    app = QtWidgets.QApplication(sys.argv)
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
     QtCore.QThread.currentThread().setObjectName('main')
 
     # Main window
-    main_window = QtLivePlotter()
+    main_window = QtLivePlotter(parse_rings(args.ring), args.points, plot_channels, args.history)
 
     # Show windows
     main_window.show()
@@ -0,0 +1,80 @@
+from PyQt5 import QtCore
+from PyQt5.QtCore import pyqtSlot
+
+from lib.device_process import DeviceProcess
+
+
+class RemoteInterface:
+    """ Parent side stand-in of an interface which lives in a device process. Only keeps the settings of the GUI
+    """
+
+    def __init__(self, port=None):
+        self._port = port
+
+    def get_port(self):
+        return self._port
+
+    def set_port(self, port):
+        self._port = port
+
+    def get_version(self):
+        return "(device process)"
+
+
+class QtProcessWorker(QtCore.QObject):
+    """ Worker of a device which runs in its own process
+
+        Offers the signals of QtGlobalWorker, so the sensor and Vicon boxes work the same with all backends. The
+        responses of the process are polled from its status ring
+    """
+
+    _worker_response = QtCore.pyqtSignal(int, bool, str)
+    _worker_command = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, title, exp_name, kind, mode=0, options=None, poll_interval=20, parent=None):
+        super().__init__(parent)
+
+        self._title = title
+        self._process = DeviceProcess(title, exp_name, kind, mode, options)
+        self._interface = RemoteInterface("192.168.10.1" if kind == 'vicon' else None)
+
+        self._worker_command.connect(self.received_command)
+
+        self._poll_timer = QtCore.QTimer(self)
+        self._poll_timer.setInterval(poll_interval)
+        self._poll_timer.timeout.connect(self.poll_responses)
+        self._poll_timer.start()
+
+    @pyqtSlot(int, str)
+    def received_command(self, command, arg):
+        self._process.send_command(command, arg)
+
+    @pyqtSlot()
+    def poll_responses(self):
+        for resp, success, extra in self._process.read_responses():
+            self._worker_response.emit(resp, success, extra)
+
+    def start_synchronized(self, coordinator):
+        self._process.start_synchronized(coordinator)
+
+    def set_reference_time(self, t0):
+        self._process.set_reference_time(t0)
+
+    def set_plotter_ring(self, ring):
+        self._process.set_plotter_ring(ring)
+
+    def stop(self):
+        self._poll_timer.stop()
+        self._process.stop()
+
+    def get_title(self):
+        return self._title
+
+    def get_worker_command_signal(self):
+        return self._worker_command
+
+    def get_worker_response_signal(self):
+        return self._worker_response
+
+    def get_instance(self):
+        return self._interface
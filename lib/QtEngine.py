@@ -0,0 +1,94 @@
+from PyQt5 import QtCore
+from PyQt5.QtCore import pyqtSlot
+
+from lib import backends
+from lib.acquisition_engine import AcquisitionEngine
+from lib.template import GlobalProtocol
+
+
+class QtEngineWorker(QtCore.QObject):
+    """ Worker of a device which runs on the acquisition engine
+
+        Offers the signals of QtGlobalWorker, so the sensor and Vicon boxes work the same with both backends
+    """
+
+    _worker_response = QtCore.pyqtSignal(int, bool, str)
+    _worker_command = QtCore.pyqtSignal(int, str)
+
+    def __init__(self, engine, title, parent=None):
+        super().__init__(parent)
+
+        self._engine = engine
+        self._title = title
+
+        self._worker_command.connect(self.received_command)
+
+    @pyqtSlot(int, str)
+    def received_command(self, command, arg):
+        self._engine.send_command(self._title, command, arg)
+
+    def start_synchronized(self, coordinator):
+        self._engine.start_synchronized(self._title, coordinator)
+
+    def set_reference_time(self, t0):
+        self._engine.set_reference_time(self._title, t0)
+
+    def set_plotter_ring(self, ring):
+        self._engine.set_plotter_ring(self._title, ring)
+
+    def get_title(self):
+        return self._title
+
+    def get_worker_command_signal(self):
+        return self._worker_command
+
+    def get_worker_response_signal(self):
+        return self._worker_response
+
+    def get_instance(self):
+        return self._engine.get_interface(self._title)
+
+
+class QtAcquisitionEngine(QtCore.QObject):
+    """ Qt front end of the acquisition engine. The responses are delivered in the GUI thread
+    """
+
+    _engine_response = QtCore.pyqtSignal(str, int, bool, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        self._workers = dict()
+
+        # Emitted from the engine thread, queued to this object's thread
+        self._engine = AcquisitionEngine(self._engine_response.emit)
+        self._engine_response.connect(self.dispatch_response)
+
+    def add_serial_device(self, title, exp_name, mode=0):
+        return self.add_device(title, exp_name, backends.create_interface('tmos', mode),
+                               GlobalProtocol.DATA_TYPES['tmos'])
+
+    def add_vicon_device(self, title, exp_name, stream_mode=0, options=None):
+        return self.add_device(title, exp_name, backends.create_interface('vicon', stream_mode, **(options or dict())),
+                               GlobalProtocol.DATA_TYPES['vicon'])
+
+    def add_device(self, title, exp_name, interface, data_type):
+        """ :returns:
+                QtEngineWorker of the device
+        """
+
+        self._engine.add_device(title, exp_name, interface, data_type)
+        self._workers[title] = QtEngineWorker(self._engine, title, self)
+
+        return self._workers[title]
+
+    def start(self):
+        self._engine.start()
+
+    def stop(self):
+        self._engine.stop()
+
+    @pyqtSlot(str, int, bool, str)
+    def dispatch_response(self, title, resp, success, extra):
+        if title in self._workers:
+            self._workers[title].get_worker_response_signal().emit(resp, success, extra)
@@ -1,17 +1,96 @@
-from PyQt5 import QtWidgets, QtCore
+from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtCore import pyqtSlot
+import html
+import time
 import logging
 import queue
 
 class QLoggingHandler(logging.Handler):
-    def __init__(self, log_queue):
+    """ Passes the records to the log box (called from any thread)
+
+        Records below WARNING are rate limited per logger (token bucket). The number of suppressed records is reported
+        with the next record of the logger which passes, or once the logger went quiet. The queue is bounded, records
+        which don't fit are dropped and counted
+    """
+
+    def __init__(self, log_queue, rate=50, burst=200):
+        """
+            :param rate:
+                Records per second and logger which pass once the burst is used up
+            :param burst:
+                Records a logger may emit at once
+        """
+
         super().__init__()
 
         self.setFormatter(logging.Formatter('[%(name)s] [%(levelname)s] %(message)s'))
         self.log_queue = log_queue
 
+        self._rate = rate
+        self._burst = burst
+
+        # logger name -> [tokens, time of the last update]
+        self._buckets = dict()
+
+        # logger name -> [suppressed records, time of the last suppressed record]
+        self._suppressed = dict()
+
+        self._dropped = 0
+
     def emit(self, record):
-        self.log_queue.put(record)
+        # Called with the handler lock held
+        if record.levelno < logging.WARNING and not self._take_token(record.name):
+            entry = self._suppressed.setdefault(record.name, [0, 0.0])
+            entry[0] += 1
+            entry[1] = time.monotonic()
+            return
+
+        entry = self._suppressed.pop(record.name, None)
+        record.suppressed = entry[0] if entry is not None else 0
+
+        try:
+            self.log_queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+            if entry is not None:
+                self._suppressed[record.name] = entry
+
+    def _take_token(self, name):
+        now = time.monotonic()
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets[name] = [self._burst, now]
+
+        bucket[0] = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+        bucket[1] = now
+
+        if bucket[0] < 1:
+            return False
+
+        bucket[0] -= 1
+        return True
+
+    def pop_suppressed(self, idle=1.0):
+        """ Suppressed records of the loggers which didn't log for idle seconds (thread safe)
+
+            :returns:
+                Dictionary of logger name -> number of suppressed records
+        """
+
+        now = time.monotonic()
+        with self.lock:
+            names = [name for name, entry in self._suppressed.items() if now - entry[1] >= idle]
+            return dict({name: self._suppressed.pop(name)[0] for name in names})
+
+    def pop_dropped(self):
+        """ Records dropped because the queue was full since the last call (thread safe)
+        """
+
+        with self.lock:
+            dropped = self._dropped
+            self._dropped = 0
+
+        return dropped
 
 
 class QLoggerBox(QtWidgets.QGroupBox):
@@ -24,6 +103,15 @@ class QLoggerBox(QtWidgets.QGroupBox):
         'ERROR': "red"
     }
 
+    # Lines kept in the console (the oldest are removed)
+    MAX_LINES = 5000
+
+    # Records queued for the console, further records are dropped
+    QUEUE_SIZE = 10000
+
+    # Records rendered per timer tick (the rest follows with the next tick)
+    MAX_RECORDS_PER_TICK = 1000
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -32,14 +120,14 @@ class QLoggerBox(QtWidgets.QGroupBox):
         self.logger.setLevel(logging.DEBUG)
 
         # Create and add handler
-        self.log_queue = queue.Queue()
+        self.log_queue = queue.Queue(self.QUEUE_SIZE)
         self.log_handler = QLoggingHandler(self.log_queue)
         self.logger.addHandler(self.log_handler)
         # logging.getLogger().addHandler(self) # Bind root logger
 
-        # Polling timer
+        # Polling timer (all pending records are rendered at once)
         self.timer = QtCore.QTimer()
-        self.timer.setInterval(5)
+        self.timer.setInterval(50)
         self.timer.timeout.connect(self.add_record)
         self.timer.start()
 
@@ -52,18 +140,81 @@ class QLoggerBox(QtWidgets.QGroupBox):
 
         self.log_widget = QtWidgets.QPlainTextEdit()
         self.log_widget.setReadOnly(True)
+        self.log_widget.setMaximumBlockCount(self.MAX_LINES)
 
         self.vbox.addWidget(self.log_widget)
 
     @pyqtSlot()
     def add_record(self):
-        try:
-            record = self.log_queue.get(block=False)
-        except queue.Empty:
-            pass
-        else:
+        lines = list()
+
+        # Consecutive identical records are shown once with a repeat count
+        last_key = None
+        last_line = None
+        repeated = 0
+
+        for _ in range(self.MAX_RECORDS_PER_TICK):
+            try:
+                record = self.log_queue.get(block=False)
+            except queue.Empty:
+                break
+
             msg = self.log_handler.format(record)
-            self.log_widget.appendHtml("<font color=" + self.COLORS[record.levelname] + ">" + msg + "</font>")
+            key = (record.levelname, msg)
+            if key == last_key and not record.suppressed:
+                repeated += 1
+                continue
+
+            if last_line is not None:
+                lines.append(self.format_line(last_key[0], last_line, repeated))
+
+            if record.suppressed:
+                lines.append(self.format_line('WARNING', "[{}] {} lines suppressed".format(record.name,
+                                                                                          record.suppressed)))
+
+            last_key = key
+            last_line = msg
+            repeated = 0
+
+        if last_line is not None:
+            lines.append(self.format_line(last_key[0], last_line, repeated))
+
+        for name, count in self.log_handler.pop_suppressed().items():
+            lines.append(self.format_line('WARNING', "[{}] {} lines suppressed".format(name, count)))
+
+        dropped = self.log_handler.pop_dropped()
+        if dropped:
+            lines.append(self.format_line('WARNING', "{} log records dropped (console too slow)".format(dropped)))
+
+        if lines:
+            self.append_lines(lines)
+
+    def format_line(self, levelname, msg, repeated=0):
+        if repeated:
+            msg += " (x{})".format(repeated + 1)
+
+        return "<font color=" + self.COLORS[levelname] + ">" + html.escape(msg) + "</font>"
+
+    def append_lines(self, lines):
+        """ Append the lines (one block each) in a single edit, so the console is laid out and repainted only once
+        """
+
+        scroll_bar = self.log_widget.verticalScrollBar()
+        at_bottom = scroll_bar.value() == scroll_bar.maximum()
+
+        document = self.log_widget.document()
+        cursor = QtGui.QTextCursor(document)
+        cursor.movePosition(QtGui.QTextCursor.End)
+
+        cursor.beginEditBlock()
+        for line in lines:
+            if not document.isEmpty():
+                cursor.insertBlock()
+            cursor.insertHtml(line)
+        cursor.endEditBlock()
+
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
 
     def adapt_colors_to_mode(self, mode):
         if mode == "dark":
@@ -0,0 +1,75 @@
+from PyQt5 import QtWidgets, QtCore
+from PyQt5.QtCore import pyqtSlot
+
+from lib import metrics
+
+
+class QtMetricsBox(QtWidgets.QGroupBox):
+    """ Live acquisition metrics of all devices (one row per device)
+    """
+
+    # Column title -> function of (device snapshot, device rates)
+    COLUMNS = [
+        ("Samples/s", lambda d, r: "{:.1f}".format(r.get("samples", 0))),
+        ("Samples", lambda d, r: str(d["counters"].get("samples", 0))),
+        ("Reads/s", lambda d, r: "{:.0f}".format(r.get("reads", 0))),
+        ("Lost", lambda d, r: str(metrics.count_losses(d))),
+        ("Write queue", lambda d, r: "{} (max {})".format(d["gauges"].get("writer_queue", 0),
+                                                          d["gauges"].get("writer_high_water", 0))),
+        ("Plot backlog", lambda d, r: str(d["gauges"].get("plot_backlog", 0))),
+        ("Read > parse p99", lambda d, r: QtMetricsBox.format_latency(d, "read_to_parse")),
+        ("Parse > disk p99", lambda d, r: QtMetricsBox.format_latency(d, "parse_to_disk")),
+        ("Parse > plot p99", lambda d, r: QtMetricsBox.format_latency(d, "parse_to_plot")),
+    ]
+
+    def __init__(self, registry=None, interval=1000, parent=None):
+        super().__init__(parent)
+
+        self._registry = registry or metrics.get_registry()
+        self._previous = None
+
+        self.setTitle("Acquisition metrics")
+        self.setCheckable(False)
+
+        self.vbox = QtWidgets.QVBoxLayout()
+        self.setLayout(self.vbox)
+
+        self.table = QtWidgets.QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels([title for title, _ in self.COLUMNS])
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+
+        self.vbox.addWidget(self.table)
+
+        # Refresh timer
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start()
+
+    @pyqtSlot()
+    def refresh(self):
+        snapshot = self._registry.snapshot()
+        rates = metrics.compute_rates(self._previous, snapshot)
+        self._previous = snapshot
+
+        titles = sorted(snapshot["devices"].keys())
+        self.table.setRowCount(len(titles))
+        self.table.setVerticalHeaderLabels(titles)
+
+        for row, title in enumerate(titles):
+            device = snapshot["devices"][title]
+            for column, (_, value) in enumerate(self.COLUMNS):
+                item = self.table.item(row, column)
+                if item is None:
+                    item = QtWidgets.QTableWidgetItem()
+                    self.table.setItem(row, column, item)
+                item.setText(value(device, rates.get(title, dict())))
+
+    @staticmethod
+    def format_latency(device, name):
+        histogram = device["histograms"].get(name)
+        if histogram is None or histogram["count"] == 0:
+            return "-"
+
+        return "{:.2f} ms".format(histogram["p99"] / 1000)
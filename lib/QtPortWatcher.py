@@ -0,0 +1,36 @@
+from PyQt5 import QtCore
+
+from lib.port_discovery import HotplugWatcher, get_shared_discovery
+
+
+class QtPortWatcher(QtCore.QObject):
+    """ Scans the serial ports in the background and reports changes in the GUI thread
+    """
+
+    # Emitted with the list of available ports (queued to the GUI thread)
+    ports_changed = QtCore.pyqtSignal(list)
+
+    def __init__(self, interval=1.0, parent=None):
+        super().__init__(parent)
+
+        self._watcher = HotplugWatcher(get_shared_discovery(), self.ports_changed.emit, interval)
+
+    def start(self):
+        self._watcher.start()
+
+    def stop(self):
+        self._watcher.stop()
+
+    def refresh(self):
+        self._watcher.refresh()
+
+    @staticmethod
+    def acquire(port):
+        """ A box connected to the port (it is not probed or offered to the other boxes meanwhile)
+        """
+
+        get_shared_discovery().acquire(port)
+
+    @staticmethod
+    def release(port):
+        get_shared_discovery().release(port)
@@ -1,18 +1,19 @@
+import time
 import logging
-import datetime
 
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtCore import pyqtSlot
 
+from lib.QtPortWatcher import QtPortWatcher
 from lib.QtSerialThread import QtSerialWorker
 from lib.template.GlobalThread import QtGlobalWorker
 
 
 class QtSensor(QtWidgets.QGroupBox):
-    def __init__(self, title, exp_name, mode=0, parent=None):
+    def __init__(self, title, exp_name, mode=0, parent=None, worker=None):
         super(QtSensor, self).__init__(parent)
 
-        self.time_zero = datetime.datetime.now()
+        self.time_zero = time.monotonic_ns()
 
         # Start own module logger
         self.logger = logging.getLogger('PC.' + title.replace(" ", "_").upper())
@@ -33,6 +34,9 @@ class QtSensor(QtWidgets.QGroupBox):
         self.com_port_list = QtWidgets.QComboBox()
         self.com_port_list.currentIndexChanged.connect(self.port_selection_change)
 
+        # Port used from the connect until the disconnect, the port watcher doesn't probe it meanwhile
+        self.held_port = None
+
         ''' CONNECT AND DISCONNECT BUTTONS '''
         self.hbox_connect_disconnect_buttons = QtWidgets.QHBoxLayout()
 
@@ -82,19 +86,26 @@ class QtSensor(QtWidgets.QGroupBox):
         self.root_layout.addWidget(self.console_log_check)
 
         ''' SERIAL WORKER (THREAD) '''
-        # Worker
-        self.serial_worker = QtSerialWorker(title, exp_name, mode)
+        self.serial_thread = None
+
+        if worker is not None:
+            # Worker of the acquisition engine (no thread of its own)
+            self.serial_worker = worker
+        else:
+            # Worker
+            self.serial_worker = QtSerialWorker(title, exp_name, mode)
 
-        # Thread
-        self.serial_thread = QtCore.QThread(self)
-        self.serial_thread.setObjectName(title.replace(" ", "_").upper())
-        self.serial_worker.moveToThread(self.serial_thread)
+            # Thread
+            self.serial_thread = QtCore.QThread(self)
+            self.serial_thread.setObjectName(title.replace(" ", "_").upper())
+            self.serial_worker.moveToThread(self.serial_thread)
 
         # Signals
         self.serial_worker.get_worker_response_signal().connect(self.serial_response_received)
 
         # Start serial thread
-        self.serial_thread.start()
+        if self.serial_thread is not None:
+            self.serial_thread.start()
 
     @pyqtSlot(int)
     def console_log_changed(self, checked):
@@ -113,8 +124,20 @@ class QtSensor(QtWidgets.QGroupBox):
             return
 
         self.logger.info('Connecting...')
+        self.hold_port(self.com_port_list.currentText())
         self.send_command('connect', self.com_port_list.currentText())
 
+    def hold_port(self, port):
+        self.release_port()
+
+        self.held_port = port
+        QtPortWatcher.acquire(port)
+
+    def release_port(self):
+        if self.held_port is not None:
+            QtPortWatcher.release(self.held_port)
+            self.held_port = None
+
     @pyqtSlot()
     def disconnect_button_clicked(self):
         self.logger.warning('Disconnecting...')
@@ -125,6 +148,13 @@ class QtSensor(QtWidgets.QGroupBox):
         self.logger.info('Starting...')
         self.send_command('start')
 
+    def start_synchronized(self, coordinator):
+        """ Start together with the other devices (START ALL, see lib/start_sync.py)
+        """
+
+        self.logger.info('Starting (synchronized)...')
+        self.serial_worker.start_synchronized(coordinator)
+
     @pyqtSlot()
     def stop_button_clicked(self):
         self.logger.info('Stopping...')
@@ -136,18 +166,31 @@ class QtSensor(QtWidgets.QGroupBox):
     def change_file_handler(self, name):
         self.send_command('handler', str(name))
 
+    def export_log(self):
+        self.send_command('export')
+
     def set_reference_time(self, t0):
         self.serial_worker.set_reference_time(t0)
 
     def update_com_port_list(self, ports):
+        """ Add the new ports and remove the vanished ones. The selected port stays selected
+        """
+
         if self.is_connected():
             return
 
-        self.com_port_list.clear()
-        self.com_port_list.addItems(ports)
+        current = [self.com_port_list.itemText(i) for i in range(self.com_port_list.count())]
+
+        for i in reversed(range(len(current))):
+            if current[i] not in ports:
+                self.com_port_list.removeItem(i)
+
+        for port in ports:
+            if port not in current:
+                self.com_port_list.addItem(port)
 
-    def set_logger_process(self, p):
-        self.serial_worker.set_logger_process(p)
+    def set_plotter_ring(self, ring):
+        self.serial_worker.set_plotter_ring(ring)
 
     def send_command(self, comm_id, comm_arg=''):
         self.serial_worker.get_worker_command_signal().emit(QtGlobalWorker.WORKER_COMMAND[comm_id], comm_arg)
@@ -157,11 +200,11 @@ class QtSensor(QtWidgets.QGroupBox):
         # print("[%s] Received response" % QtCore.QThread.currentThread().objectName())
 
         if resp == QtGlobalWorker.WORKER_RESPONSE['connected']:
-            self.serial_connected(success)
+            self.serial_connected(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['disconnected']:
             self.serial_disconnected(success)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['started']:
-            self.serial_started(success)
+            self.serial_started(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['stopped']:
             self.serial_stopped(success)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['mode_changed']:
@@ -170,10 +213,17 @@ class QtSensor(QtWidgets.QGroupBox):
             self.handler_changed(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['log_data']:
             self.log_data(extra)
+        elif resp == QtGlobalWorker.WORKER_RESPONSE['exported']:
+            self.log_exported(success, extra)
+        elif resp == QtGlobalWorker.WORKER_RESPONSE['warning']:
+            self.log_warning(extra)
         else:
             self.serial_error_signal()
 
-    def serial_connected(self, success):
+    def serial_connected(self, success, timings=""):
+        if timings:
+            self.logger.info("Handshake: " + timings)
+
         if success:
             self.logger.info("Successfully connected!")
 
@@ -184,6 +234,7 @@ class QtSensor(QtWidgets.QGroupBox):
             self.com_port_list.setEnabled(False)
         else:
             self.logger.error("Could not connect!")
+            self.release_port()
 
             self.connect_button.setEnabled(True)
             self.disconnect_button.setEnabled(False)
@@ -195,6 +246,7 @@ class QtSensor(QtWidgets.QGroupBox):
             self.logger.info("Successfully disconnected!")
         else:
             self.logger.error("Could not connect!")
+        self.release_port()
 
         self.connect_button.setEnabled(True)
         self.disconnect_button.setEnabled(False)
@@ -202,7 +254,10 @@ class QtSensor(QtWidgets.QGroupBox):
         self.stop_button.setEnabled(False)
         self.com_port_list.setEnabled(True)
 
-    def serial_started(self, success):
+    def serial_started(self, success, timings=""):
+        if timings:
+            self.logger.info("Handshake: " + timings)
+
         if success:
             self.logger.info('Successfully started!')
 
@@ -235,9 +290,18 @@ class QtSensor(QtWidgets.QGroupBox):
         else:
             self.logger.debug("Log file not updated! " + extra)
 
+    def log_exported(self, success, extra):
+        if success:
+            self.logger.info("Successfully exported text log " + extra)
+        else:
+            self.logger.error("Could not export text log! " + extra)
+
     def log_data(self, data):
         self.logger.info(data)
 
+    def log_warning(self, msg):
+        self.logger.warning(msg)
+
     def is_connected(self):
         return self.disconnect_button.isEnabled()
 
@@ -246,6 +310,7 @@ class QtSensor(QtWidgets.QGroupBox):
 
     def serial_error_signal(self):
         self.logger.error("Serial error! Resetting...")
+        self.release_port()
 
         self.connect_button.setEnabled(True)
         self.disconnect_button.setEnabled(False)
@@ -1,4 +1,4 @@
-from lib.serial_interface import SerialInterface
+from lib import backends
 from lib.template.GlobalThread import QtGlobalWorker
 
 
@@ -7,7 +7,11 @@ class QtSerialWorker(QtGlobalWorker):
     """
 
     def __init__(self, title, exp_name, mode=0):
-        # Initialize with an interval of 0 => Read sensor as soon/fast as possible
+        # Initialize with an interval of 0 => Read sensor as soon/fast as possible. The interface blocks until data
+        # arrives (select on the port), so the thread does not spin while the sensor is idle
         super().__init__(title, exp_name, 0, QtGlobalWorker.DATA_TYPES['tmos'])
 
-        self._interface = SerialInterface(mode)
+        self.set_interface(backends.create_interface('tmos', mode))
+
+        # Woken by the port (socket notifier on the fd, or a blocking read where the port has no fd)
+        self.set_scheduler(QtGlobalWorker.SCHEDULER_MODE['event'])
@@ -1,18 +1,20 @@
+import time
 import logging
-import datetime
 
 from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtCore import pyqtSlot
 
 from lib.QtViconThread import QtViconWorker
+from lib.vicon_interface import ViconInterface
 from lib.template.GlobalThread import QtGlobalWorker
 
 
 class QtVicon(QtWidgets.QGroupBox):
-    def __init__(self, title, exp_name, parent=None):
+    def __init__(self, title, exp_name, parent=None, worker=None, stream_mode=0,
+                 profile=ViconInterface.DATA_STREAM['segments']):
         super(QtVicon, self).__init__(parent)
 
-        self.time_zero = datetime.datetime.now()
+        self.time_zero = time.monotonic_ns()
 
         # Start own module logger
         self.logger = logging.getLogger('VICON')
@@ -58,6 +60,35 @@ class QtVicon(QtWidgets.QGroupBox):
         self.config_hbox.addWidget(self.IP_address_edit, 30)
         self.config_hbox.addWidget(self.IP_address_button, 20)
 
+        ''' STREAM MODE '''
+        self.stream_mode_hbox = QtWidgets.QHBoxLayout()
+
+        self.stream_mode_label = QtWidgets.QLabel()
+        self.stream_mode_label.setText("Stream mode")
+
+        # Same order as ViconInterface.STREAM_MODE
+        self.stream_mode_list = QtWidgets.QComboBox()
+        self.stream_mode_list.addItems(["Server push (buffered)", "Client pull", "Client pull (prefetch)"])
+        self.stream_mode_list.setCurrentIndex(stream_mode)
+
+        self.stream_mode_hbox.addWidget(self.stream_mode_label)
+        self.stream_mode_hbox.addWidget(self.stream_mode_list)
+
+        ''' RECORDED MARKERS '''
+        self.markers_hbox = QtWidgets.QHBoxLayout()
+
+        # Segments are always recorded, markers on demand
+        self.markers_check = QtWidgets.QCheckBox()
+        self.markers_check.setText("Record markers")
+        self.markers_check.setChecked(bool(profile & ViconInterface.DATA_STREAM['markers']))
+
+        self.unlabeled_markers_check = QtWidgets.QCheckBox()
+        self.unlabeled_markers_check.setText("Record unlabeled markers")
+        self.unlabeled_markers_check.setChecked(bool(profile & ViconInterface.DATA_STREAM['unlabeled_markers']))
+
+        self.markers_hbox.addWidget(self.markers_check)
+        self.markers_hbox.addWidget(self.unlabeled_markers_check)
+
         ''' CONNECT AND DISCONNECT BUTTONS '''
         self.hbox_connect_disconnect_buttons = QtWidgets.QHBoxLayout()
 
@@ -102,26 +133,39 @@ class QtVicon(QtWidgets.QGroupBox):
 
         ''' ADD LAYOUTS/WIDGETS '''
         self.root_layout.addLayout(self.config_hbox)
+        self.root_layout.addLayout(self.stream_mode_hbox)
+        self.root_layout.addLayout(self.markers_hbox)
         self.root_layout.addLayout(self.hbox_connect_disconnect_buttons)
         self.root_layout.addLayout(self.hbox_start_stop_buttons)
         self.root_layout.addWidget(self.console_log_check)
 
         ''' VICON WORKER (THREAD) '''
-        # Worker
-        self.vicon_worker = QtViconWorker(title, exp_name, 10)
+        self.vicon_thread = None
+
+        if worker is not None:
+            # Worker of the acquisition engine (no thread of its own)
+            self.vicon_worker = worker
+        else:
+            # Worker
+            self.vicon_worker = QtViconWorker(title, exp_name, 10, stream_mode, dict({"profile": profile}))
+
+            # Thread
+            self.vicon_thread = QtCore.QThread(self)
+            self.vicon_thread.setObjectName(title.replace(" ", "_").upper())
+            self.vicon_worker.moveToThread(self.vicon_thread)
+
         self.version_label.setText("SDK Version: " + self.vicon_worker.get_instance().get_version())
         self.set_ip_button_clicked()
 
-        # Thread
-        self.vicon_thread = QtCore.QThread(self)
-        self.vicon_thread.setObjectName(title.replace(" ", "_").upper())
-        self.vicon_worker.moveToThread(self.vicon_thread)
-
         # Signals
         self.vicon_worker.get_worker_response_signal().connect(self.vicon_response_received)
+        self.stream_mode_list.currentIndexChanged.connect(self.stream_mode_changed)
+        self.markers_check.stateChanged.connect(self.profile_changed)
+        self.unlabeled_markers_check.stateChanged.connect(self.profile_changed)
 
         # Start vicon thread
-        self.vicon_thread.start()
+        if self.vicon_thread is not None:
+            self.vicon_thread.start()
 
     @pyqtSlot()
     def set_ip_button_clicked(self):
@@ -132,6 +176,27 @@ class QtVicon(QtWidgets.QGroupBox):
     def console_log_changed(self, checked):
         self.send_command('console', str(self.console_log_check.isChecked()))
 
+    @pyqtSlot(int)
+    def stream_mode_changed(self, i):
+        self.send_command('stream', str(i))
+
+    @pyqtSlot()
+    def profile_changed(self):
+        self.send_command('profile', str(self.get_profile()))
+
+    def get_profile(self):
+        """ :returns:
+                The selected data streams [ViconInterface.DATA_STREAM flags]
+        """
+
+        profile = ViconInterface.DATA_STREAM['segments']
+        if self.markers_check.isChecked():
+            profile |= ViconInterface.DATA_STREAM['markers']
+        if self.unlabeled_markers_check.isChecked():
+            profile |= ViconInterface.DATA_STREAM['unlabeled_markers']
+
+        return profile
+
     @pyqtSlot()
     def connect_button_clicked(self):
         self.logger.info('Connecting Vicon...')
@@ -147,6 +212,13 @@ class QtVicon(QtWidgets.QGroupBox):
         self.logger.info('Starting...')
         self.send_command('start')
 
+    def start_synchronized(self, coordinator):
+        """ Start together with the other devices (START ALL, see lib/start_sync.py)
+        """
+
+        self.logger.info('Starting (synchronized)...')
+        self.vicon_worker.start_synchronized(coordinator)
+
     @pyqtSlot()
     def stop_button_clicked(self):
         self.logger.info('Stopping...')
@@ -158,6 +230,9 @@ class QtVicon(QtWidgets.QGroupBox):
     def change_file_handler(self, name):
         self.send_command('handler', str(name))
 
+    def export_log(self):
+        self.send_command('export')
+
     def set_reference_time(self, t0):
         self.vicon_worker.set_reference_time(t0)
 
@@ -167,23 +242,34 @@ class QtVicon(QtWidgets.QGroupBox):
     @pyqtSlot(int, bool, str)
     def vicon_response_received(self, resp, success, extra):
         if resp == QtGlobalWorker.WORKER_RESPONSE['connected']:
-            self.vicon_connected(success)
+            self.vicon_connected(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['disconnected']:
             self.vicon_disconnected(success)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['started']:
-            self.vicon_started(success)
+            self.vicon_started(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['stopped']:
             self.vicon_stopped(success)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['mode_changed']:
             self.mode_changed(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['handler_changed']:
             self.handler_changed(success, extra)
+        elif resp == QtGlobalWorker.WORKER_RESPONSE['stream_changed']:
+            self.stream_changed(success, extra)
+        elif resp == QtGlobalWorker.WORKER_RESPONSE['profile_changed']:
+            self.data_streams_changed(success, extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['log_data']:
             self.log_data(extra)
+        elif resp == QtGlobalWorker.WORKER_RESPONSE['exported']:
+            self.log_exported(success, extra)
+        elif resp == QtGlobalWorker.WORKER_RESPONSE['warning']:
+            self.log_warning(extra)
         elif resp == QtGlobalWorker.WORKER_RESPONSE['error']:
             self.log_error(extra)
 
-    def vicon_connected(self, success):
+    def vicon_connected(self, success, timings=""):
+        if timings:
+            self.logger.info("Handshake: " + timings)
+
         if success:
             self.logger.info("Successfully connected!")
 
@@ -211,15 +297,24 @@ class QtVicon(QtWidgets.QGroupBox):
         self.disconnect_button.setEnabled(False)
         self.start_button.setEnabled(False)
         self.stop_button.setEnabled(False)
+        self.stream_mode_list.setEnabled(True)
+        self.markers_check.setEnabled(True)
+        self.unlabeled_markers_check.setEnabled(True)
         self.IP_address_edit.setEnabled(True)
         self.IP_address_button.setEnabled(True)
 
-    def vicon_started(self, success):
+    def vicon_started(self, success, timings=""):
+        if timings:
+            self.logger.info("Handshake: " + timings)
+
         if success:
             self.logger.info('Successfully started!')
 
             self.start_button.setEnabled(False)
             self.stop_button.setEnabled(True)
+            self.stream_mode_list.setEnabled(False)
+            self.markers_check.setEnabled(False)
+            self.unlabeled_markers_check.setEnabled(False)
             self.IP_address_edit.setEnabled(False)
             self.IP_address_button.setEnabled(False)
         else:
@@ -238,6 +333,9 @@ class QtVicon(QtWidgets.QGroupBox):
 
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
+        self.stream_mode_list.setEnabled(True)
+        self.markers_check.setEnabled(True)
+        self.unlabeled_markers_check.setEnabled(True)
         self.IP_address_edit.setEnabled(False)
         self.IP_address_button.setEnabled(False)
 
@@ -247,15 +345,36 @@ class QtVicon(QtWidgets.QGroupBox):
         else:
             self.logger.error("Invalid mode selected! Invalid mode " + extra)
 
+    def stream_changed(self, success, extra):
+        if success:
+            self.logger.info("Stream mode set to " + self.stream_mode_list.currentText())
+        else:
+            self.logger.error("Could not set the stream mode " + extra)
+
+    def data_streams_changed(self, success, extra):
+        if success:
+            self.logger.info("Recorded data streams updated " + extra)
+        else:
+            self.logger.error("Could not select the data streams " + extra)
+
     def handler_changed(self, success, extra):
         if success:
             self.logger.debug("Successfully changed log file! New file " + extra)
         else:
             self.logger.debug("Log file not updated! " + extra)
 
+    def log_exported(self, success, extra):
+        if success:
+            self.logger.info("Successfully exported text log " + extra)
+        else:
+            self.logger.error("Could not export text log! " + extra)
+
     def log_data(self, data):
         self.logger.info(data)
 
+    def log_warning(self, msg):
+        self.logger.warning(msg)
+
     def log_error(self, msg):
         self.logger.error(msg)
 
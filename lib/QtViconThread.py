@@ -2,7 +2,7 @@ import datetime
 
 from PyQt5.QtCore import pyqtSlot
 
-from lib.vicon_interface import ViconInterface
+from lib import backends
 from lib.template.GlobalThread import QtGlobalWorker
 
 
@@ -10,7 +10,16 @@ class QtViconWorker(QtGlobalWorker):
     """ Main serial worker
     """
 
-    def __init__(self, title, exp_name, interval):
+    def __init__(self, title, exp_name, interval, stream_mode=0, options=None):
+        """
+            :param options:
+                Further arguments of the interface, e.g. the data stream profile
+        """
+
         super().__init__(title, exp_name, interval, QtGlobalWorker.DATA_TYPES['vicon'])
 
-        self._interface = ViconInterface()
+        self.set_interface(backends.create_interface('vicon', stream_mode, **(options or dict())))
+
+        # GetFrame blocks until the next frame in ServerPush mode, so the worker is paced by the camera rate. The
+        # pull modes are polled (interval with backoff)
+        self.set_scheduler(QtGlobalWorker.SCHEDULER_MODE['event'])
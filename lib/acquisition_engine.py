@@ -0,0 +1,395 @@
+import asyncio
+import logging
+import threading
+import concurrent.futures
+
+from lib import recorder
+from lib.handshake import format_timings
+from lib.start_sync import synchronized_start, format_skew
+from lib.template import GlobalProtocol
+from lib.template.SampleSink import SampleSink
+
+# Start engine logger
+logger = logging.getLogger('PC.ENGINE')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# ACQUISITION ENGINE                           #
+#                                              #
+# - Runs any number of devices on one asyncio  #
+#   event loop                                 #
+#                                              #
+################################################
+
+# Devices with a file descriptor (serial ports on posix) are watched with loop.add_reader: process_data only runs
+# when the port is readable and never blocks. Sources which can't be watched (Vicon GetFrame, serial ports on
+# Windows) are read by a polling task which runs the blocking call in the executor.
+#
+# The commands of a device are coroutines, executed one after the other (a lock per device). The blocking parts
+# (handshakes, SDK calls) run in the executor, so one slow device never holds up the others. Responses are passed
+# to the response callback as (device title, response code, success, argument), called from the engine thread.
+
+
+class DeviceChannel:
+    """ State of one device on the engine
+    """
+
+    def __init__(self, title, exp_name, interface, data_type):
+        self.title = title
+        self.interface = interface
+        self.sink = SampleSink(title, exp_name, data_type)
+        self.interface.set_metrics(self.sink.get_metrics())
+
+        self.lock = None
+        self.reading = False
+        self.fd = None
+        self.poll_task = None
+        self.wait_timeout = None
+
+
+class AcquisitionEngine:
+    """ Event loop which multiplexes the acquisition of all devices
+    """
+
+    def __init__(self, response_callback=None, max_workers=None, poll_interval=0.001, latency_budget=0.05):
+        """
+            :param response_callback:
+                Called with (title, response code, success, argument) for every response [WORKER_RESPONSE]
+            :param max_workers:
+                Threads of the executor for the blocking calls
+            :param poll_interval:
+                Initial sleep (seconds) of the polling task of a non-blocking source without new data. It doubles up
+                to the latency budget while no data arrives
+        """
+
+        self._response_callback = response_callback
+        self._poll_interval = poll_interval
+        self._latency_budget = latency_budget
+
+        self._devices = dict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix='engine_io')
+
+        # One thread per device for the synchronized start (all devices wait at the barrier at the same time)
+        self._start_executor = None
+
+        self._loop = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._start_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(self._devices)),
+                                                                     thread_name_prefix='engine_start')
+
+        # Selector loop on all platforms (the proactor loop of Windows has no add_reader)
+        self._loop = asyncio.SelectorEventLoop()
+        self._thread = threading.Thread(target=self._run, name='engine', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """ Stop all devices and the event loop
+        """
+
+        if self._thread is None:
+            return
+
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            logger.error("Devices did not stop in time")
+
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+        self._executor.shutdown(wait=False)
+        self._start_executor.shutdown(wait=False)
+        self._start_executor = None
+
+    def is_running(self):
+        return self._thread is not None
+
+    def add_device(self, title, exp_name, interface, data_type):
+        """ Register a device [DATA_TYPES]. Call before the engine is started
+        """
+
+        if title in self._devices:
+            raise ValueError("Device '{}' already exists".format(title))
+
+        self._devices[title] = DeviceChannel(title, exp_name, interface, data_type)
+
+    def get_devices(self):
+        return list(self._devices.keys())
+
+    def get_interface(self, title):
+        return self._devices[title].interface
+
+    def send_command(self, title, command, arg=''):
+        """ Queue a command [WORKER_COMMAND] for a device. Thread safe
+
+            :raises RuntimeError:
+                If the engine was not started
+            :returns:
+                concurrent.futures.Future of the command
+        """
+
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(self.handle_command(self._devices[title], command, arg), loop)
+
+    def start_synchronized(self, title, coordinator):
+        """ Start a device together with the other devices of the coordinator (lib/start_sync.py). Thread safe
+
+            :returns:
+                concurrent.futures.Future of the start
+        """
+
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(self._start_synchronized(self._devices[title], coordinator), loop)
+
+    def set_reference_time(self, title, t0):
+        self._get_loop().call_soon_threadsafe(self._devices[title].interface.set_reference_time, t0)
+
+    def set_plotter_ring(self, title, ring):
+        device = self._devices[title]
+        if self._loop is None:
+            device.sink.set_plotter_ring(ring)
+        else:
+            self._loop.call_soon_threadsafe(device.sink.set_plotter_ring, ring)
+
+    def _get_loop(self):
+        if self._loop is None:
+            raise RuntimeError("Acquisition engine not started, start it before sending commands")
+
+        return self._loop
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+        self._loop.close()
+
+    async def _shutdown(self):
+        for device in self._devices.values():
+            if device.reading:
+                await self.handle_command(device, GlobalProtocol.WORKER_COMMAND['stop'], '')
+
+        for device in self._devices.values():
+            device.sink.close()
+
+    ''' COMMANDS '''
+
+    async def handle_command(self, device, command, arg):
+        if device.lock is None:
+            device.lock = asyncio.Lock()
+
+        async with device.lock:
+            try:
+                if command == GlobalProtocol.WORKER_COMMAND['connect']:
+                    await self.connect(device, arg)
+                elif command == GlobalProtocol.WORKER_COMMAND['disconnect']:
+                    await self.disconnect(device)
+                elif command == GlobalProtocol.WORKER_COMMAND['start']:
+                    await self.start_read(device)
+                elif command == GlobalProtocol.WORKER_COMMAND['stop']:
+                    await self.stop_read(device)
+                elif command == GlobalProtocol.WORKER_COMMAND['mode']:
+                    await self.change_mode(device, arg)
+                elif command == GlobalProtocol.WORKER_COMMAND['handler']:
+                    await self.change_log_handler(device, arg)
+                elif command == GlobalProtocol.WORKER_COMMAND['console']:
+                    device.sink.set_log_to_console(arg == 'True')
+                elif command == GlobalProtocol.WORKER_COMMAND['export']:
+                    await self.export_log(device)
+                elif command == GlobalProtocol.WORKER_COMMAND['stream']:
+                    await self.change_stream_mode(device, arg)
+                elif command == GlobalProtocol.WORKER_COMMAND['profile']:
+                    await self.change_profile(device, arg)
+            except Exception as e:
+                logger.exception("Command {} of {} failed".format(GlobalProtocol.get_command_name(command),
+                                                                  device.title))
+                self._respond(device, 'error', False, str(e))
+
+    async def _start_synchronized(self, device, coordinator):
+        if device.lock is None:
+            device.lock = asyncio.Lock()
+
+        async with device.lock:
+            try:
+                await self.start_read_synchronized(device, coordinator)
+            except Exception as e:
+                logger.exception("Synchronized start of {} failed".format(device.title))
+                self._respond(device, 'error', False, str(e))
+
+    async def connect(self, device, port):
+        await self._stop_reading(device)
+        success = await self._run_blocking(device.interface.open_port, port)
+        self._respond(device, 'connected', success, format_timings(device.interface.get_timings()))
+
+    async def disconnect(self, device):
+        await self._stop_reading(device)
+        self._respond(device, 'disconnected', await self._run_blocking(device.interface.close_port), "")
+
+    async def start_read(self, device):
+        await self._stop_reading(device)
+
+        success = await self._run_blocking(device.interface.start_device)
+        self._respond(device, 'started', success, format_timings(device.interface.get_timings()))
+
+        if success:
+            self._start_reading(device)
+
+    async def start_read_synchronized(self, device, coordinator):
+        await self._stop_reading(device)
+
+        success, summary = await self._loop.run_in_executor(self._start_executor, synchronized_start,
+                                                            device.interface, device.title, coordinator)
+        if success:
+            device.sink.get_recorder().update_metadata(dict({"start": summary}))
+
+        self._respond(device, 'started', success, "{}, {}".format(format_timings(device.interface.get_timings()),
+                                                                  format_skew(summary)))
+        if success:
+            self._start_reading(device)
+
+    async def stop_read(self, device):
+        await self._stop_reading(device)
+        self._respond(device, 'stopped', await self._run_blocking(device.interface.stop_device), "")
+
+        warning = device.sink.stopped(device.interface.get_continuity(), device.interface.get_recording_metadata())
+        if warning is not None:
+            self._respond(device, 'warning', True, warning)
+
+    async def change_mode(self, device, mode):
+        self._respond(device, 'mode_changed', device.interface.set_mode(int(mode)), "[{}]".format(mode))
+
+    async def change_stream_mode(self, device, mode):
+        success = await self._run_blocking(device.interface.set_stream_mode, int(mode))
+        self._respond(device, 'stream_changed', success, "[{}]".format(mode))
+
+    async def change_profile(self, device, profile):
+        success = await self._run_blocking(device.interface.set_profile, int(profile))
+        self._respond(device, 'profile_changed', success, "[{}]".format(profile))
+
+    async def change_log_handler(self, device, exp_name):
+        # Closing the old recording waits for the writer thread, keep it off the loop
+        if not await self._run_blocking(device.sink.change_exp_name, exp_name):
+            self._respond(device, 'handler_changed', False, "Name unchanged")
+            return
+
+        self._respond(device, 'handler_changed', True, "[{}]".format(device.sink.get_recorder().get_filename()))
+
+    async def export_log(self, device):
+        success, msg = await self._run_blocking(device.sink.export_log)
+        self._respond(device, 'exported', success, msg)
+
+    ''' READING '''
+
+    def _start_reading(self, device):
+        device.reading = True
+
+        fd = device.interface.get_fd()
+        if fd is not None:
+            try:
+                self._loop.add_reader(fd, self._on_readable, device)
+                device.fd = fd
+
+                # Only called once the data is there => never block in process_data
+                device.wait_timeout = device.interface.get_wait_timeout()
+                device.interface.set_wait_timeout(0)
+                return
+            except (NotImplementedError, ValueError, OSError):
+                logger.debug("Can't watch {}, polling".format(device.title))
+
+        device.poll_task = self._loop.create_task(self._poll(device))
+
+    async def _stop_reading(self, device):
+        device.reading = False
+
+        if device.fd is not None:
+            self._loop.remove_reader(device.fd)
+            device.fd = None
+
+        if device.wait_timeout is not None:
+            device.interface.set_wait_timeout(device.wait_timeout)
+            device.wait_timeout = None
+
+        # Let a running blocking read finish (the interface must not be used concurrently)
+        if device.poll_task is not None and device.poll_task is not asyncio.current_task():
+            await device.poll_task
+        device.poll_task = None
+
+    def _on_readable(self, device):
+        if self._handle_data(device, device.interface.process_data()) is None:
+            self._loop.remove_reader(device.fd)
+            device.fd = None
+            self._loop.create_task(self._lost(device))
+
+    async def _poll(self, device):
+        interval = self._poll_interval
+        while device.reading:
+            received = self._handle_data(device, await self._run_blocking(device.interface.process_data))
+            if received is None:
+                device.reading = False
+                self._loop.create_task(self._lost(device))
+                return
+
+            if device.interface.is_blocking():
+                continue
+
+            # Nothing received from a non-blocking source: back off up to the latency budget
+            if received == 0:
+                await asyncio.sleep(interval)
+                interval = min(2 * interval, self._latency_budget)
+            else:
+                interval = self._poll_interval
+
+    async def _lost(self, device):
+        await self.handle_command(device, GlobalProtocol.WORKER_COMMAND['stop'], '')
+        self._respond(device, 'error', True, "Lost connection or empty frame! Stopping...")
+
+    def _handle_data(self, device, data):
+        """ :returns:
+                Number of received samples or None if the device was lost
+        """
+
+        if type(data) == int and data == -1:
+            return None
+
+        samples = device.sink.consume(data)
+        if samples is None:
+            return 0
+
+        if device.sink.is_logging_to_console():
+            self._respond(device, 'log_data', True, '\t'.join(recorder.rows_to_text(samples)))
+
+        return len(samples)
+
+    ''' HELPERS '''
+
+    async def _run_blocking(self, func, *args):
+        return await self._loop.run_in_executor(self._executor, func, *args)
+
+    def _respond(self, device, resp_type, success, arg):
+        if self._response_callback is None or resp_type not in GlobalProtocol.WORKER_RESPONSE:
+            return
+
+        self._response_callback(device.title, GlobalProtocol.WORKER_RESPONSE[resp_type], success, arg)
+
+
+def wait_for(future, timeout=None):
+    """ Wait for a command queued with send_command
+
+        :returns:
+            True if the command completed in time
+    """
+
+    try:
+        future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        return False
+
+    return True
+
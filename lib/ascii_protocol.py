@@ -0,0 +1,84 @@
+import numpy as np
+
+
+################################################
+# ASCII LINE PROTOCOL                          #
+#                                              #
+# - Tab separated sample lines sent by the     #
+#   EV-KIT and the STM32 board in ASCII mode   #
+#                                              #
+################################################
+
+# Line layout (tab separated, terminated by a tab and \r\n):
+#
+#   [garbage] dev_id in_time dist_raw temp dist_filt vel bin_1 bin_2 [empty]
+#
+# The first field is not used (the host time replaces it) and the trailing tab leaves an empty last field, so a
+# complete line has FIELD_COUNT fields. Every line is parsed on its own, a bad line is skipped and the parser continues
+# with the next one. If the line end of a record got lost on the link, the cut record and the next one arrive as one
+# line with too many fields. The cut record merges into the (unused) first field of the next one, so the last
+# FIELD_COUNT fields are still a complete record and are recovered.
+
+FIELD_COUNT = 10
+
+# Number of sample values of a line (fields 1 to 8)
+VALUE_COUNT = FIELD_COUNT - 2
+
+
+def parse_line(fields):
+    """ Sample values of the fields of a line
+
+        :returns:
+            List of VALUE_COUNT floats or None if the fields are not a valid record
+    """
+
+    if len(fields) != FIELD_COUNT or fields[-1].strip():
+        return None
+
+    try:
+        return [float(v) for v in fields[1:FIELD_COUNT - 1]]
+    except ValueError:
+        return None
+
+
+def parse_lines(lines):
+    """ Parse received lines (without line endings), skipping the bad ones
+
+        :returns:
+            (values, malformed, truncated, undecodable, recovered) - the sample values of the valid lines as array
+            (lines x VALUE_COUNT), the number of lines with invalid values or layout, of lines which are too short
+            (cut records), of lines which aren't ASCII, and of records recovered from lines with a cut record in
+            front (each of these also counts as one truncated line)
+    """
+
+    values = []
+    malformed = 0
+    truncated = 0
+    undecodable = 0
+    recovered = 0
+
+    for line in lines:
+        try:
+            fields = line.decode('ascii').split('\t')
+        except UnicodeDecodeError:
+            undecodable += 1
+            continue
+
+        if len(fields) < FIELD_COUNT:
+            # Empty lines (e.g. a stray line end) are no lost records
+            if line.strip():
+                truncated += 1
+            continue
+
+        row = parse_line(fields[-FIELD_COUNT:])
+        if row is None:
+            malformed += 1
+            continue
+
+        if len(fields) > FIELD_COUNT:
+            truncated += 1
+            recovered += 1
+
+        values.append(row)
+
+    return np.array(values, dtype=np.float64).reshape(-1, VALUE_COUNT), malformed, truncated, undecodable, recovered
@@ -0,0 +1,351 @@
+import time
+import logging
+import threading
+import collections
+
+import numpy as np
+
+# Start writer logger
+logger = logging.getLogger('PC.WRITER')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# ASYNCHRONOUS WRITER                          #
+#                                              #
+# - Writes the recordings of all devices from  #
+#   one background thread                      #
+#                                              #
+################################################
+
+# Every device gets a bounded queue (a deque; appending and popping are atomic, no lock is taken by the producer).
+# The acquisition thread only copies its samples into the queue, the writer thread drains all queues, coalesces the
+# queued samples into one block per device and hands them to the recorders. File writes release the GIL, so a
+# stalled disk only delays the writer thread.
+#
+# A full queue never blocks the producer: the samples are dropped and counted. Control operations (flush, metadata,
+# new streams, close) are always queued and executed in order with the samples. Every block carries the time it was queued, so
+# the time until it was handed to the file (parse -> disk) can be recorded into a latency histogram.
+
+_OP_DATA = 0
+_OP_FLUSH = 1
+_OP_META = 2
+_OP_CLOSE = 3
+_OP_STREAM = 4
+
+
+class AsyncWriter:
+    """ Background writer thread shared by all devices
+    """
+
+    def __init__(self, queue_size=1024, flush_interval=1.0, flush_bytes=4 * 1024 * 1024, fsync=False):
+        """
+            :param queue_size:
+                Maximum number of queued sample blocks per device
+            :param flush_interval:
+                Flush the files at least every `flush_interval` seconds
+            :param flush_bytes:
+                Flush a file once this many bytes were written since its last flush
+            :param fsync:
+                Also force the flushed data to the disk (os.fsync)
+        """
+
+        self._queue_size = queue_size
+        self._flush_interval = flush_interval
+        self._flush_bytes = flush_bytes
+        self._fsync = fsync
+
+        self._queues = []
+        self._lock = threading.Lock()  # Protects the list of queues only
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Write everything still queued, close all recorders and stop the thread
+        """
+
+        if not self._running:
+            return
+
+        with self._lock:
+            queues = list(self._queues)
+
+        for q in queues:
+            q.close()
+
+        self._running = False
+        self._wakeup.set()
+        self._thread.join()
+        self._thread = None
+
+    def is_running(self):
+        return self._running
+
+    def open(self, rec):
+        """ Hand a recorder to the writer thread
+
+            :returns:
+                RecorderQueue which is used like the recorder by the acquisition thread
+        """
+
+        q = RecorderQueue(self, rec, self._queue_size)
+        with self._lock:
+            self._queues.append(q)
+
+        self.start()
+        return q
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while self._running:
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+
+            with self._lock:
+                queues = list(self._queues)
+
+            for q in queues:
+                q.process(self._flush_interval, self._flush_bytes, self._fsync)
+
+            with self._lock:
+                self._queues = [q for q in self._queues if not q.is_finished()]
+
+        # Stopped: write whatever arrived in the meantime
+        for q in self._queues:
+            q.process(0, 0, self._fsync)
+
+        self._queues = []
+
+
+class RecorderQueue:
+    """ Queue between an acquisition thread and a recorder (ColumnarRecorder interface)
+    """
+
+    def __init__(self, writer, rec, queue_size):
+        self._writer = writer
+        self._recorder = rec
+        self._queue_size = queue_size
+        self._queue = collections.deque()
+
+        # Statistics (only updated by the producer or only by the writer thread)
+        self._high_water = 0
+        self._dropped = 0
+        self._written_rows = 0
+        self._written_bytes = 0
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+
+        # Histogram (lib/metrics.py) of the time between queueing and writing the samples, only used by the writer
+        self._latency = None
+
+        # Streams added through the queue (the recorder only declares them once the writer got there)
+        self._streams = set()
+
+        self._closed = False
+
+        # Set by the writer thread once the close was executed (everything queued before it is written)
+        self._finished = threading.Event()
+
+    def get_filename(self):
+        return self._recorder.get_filename()
+
+    def get_dtype(self, stream='samples'):
+        return self._recorder.get_dtype(stream)
+
+    def is_closed(self):
+        return self._closed
+
+    def has_stream(self, stream):
+        return stream in self._streams or self._recorder.has_stream(stream)
+
+    def add_stream(self, name, dtype):
+        """ Declare an additional stream, samples can be appended to it right away
+        """
+
+        if self.has_stream(name):
+            return
+
+        self._streams.add(name)
+        self._put(_OP_STREAM, (name, dtype))
+
+    def set_latency_histogram(self, histogram):
+        """ Record the queue -> file latency (us) of every written block into the histogram
+        """
+
+        self._latency = histogram
+
+    def is_finished(self):
+        """ Closed and everything written
+        """
+
+        return self._recorder.is_closed()
+
+    def get_stats(self):
+        """ :returns:
+                Dictionary with the queue length, its high-water mark, the number of dropped blocks and the written
+                rows/bytes
+        """
+
+        return dict({"queued": len(self._queue), "high_water": self._high_water, "capacity": self._queue_size,
+                     "dropped": self._dropped, "rows": self._written_rows, "bytes": self._written_bytes})
+
+    def append(self, rows, stream='samples'):
+        """ Queue samples. The rows are copied, the caller can reuse its buffer. Never blocks
+        """
+
+        if self._closed:
+            return
+
+        length = len(self._queue)
+        if length >= self._queue_size:
+            self._dropped += 1
+            if self._dropped == 1 or self._dropped % 1000 == 0:
+                logger.warning("Write queue of {} full, {} blocks dropped".format(self.get_filename(), self._dropped))
+            return
+
+        self._queue.append((_OP_DATA, stream, np.array(rows, copy=True), time.monotonic_ns()))
+        if length + 1 > self._high_water:
+            self._high_water = length + 1
+
+        self._writer.wakeup()
+
+    def update_metadata(self, metadata):
+        self._put(_OP_META, metadata)
+
+    def flush(self, timeout=None):
+        """ Write everything queued so far to the file
+
+            :param timeout:
+                Wait (at most this many seconds) until the data was written. None => don't wait
+            :returns:
+                True if the data was written (or not waited for)
+        """
+
+        # Closed: nothing is queued after the close, which writes everything queued before it
+        if self._closed:
+            return True if timeout is None else self._finished.wait(timeout)
+
+        done = threading.Event() if timeout is not None else None
+        self._put(_OP_FLUSH, done)
+
+        if done is None:
+            return True
+
+        return done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._put(_OP_CLOSE, None)
+        self._closed = True
+
+    def _put(self, op, arg):
+        if self._closed:
+            return
+
+        self._queue.append((op, None, arg, 0))
+        self._writer.wakeup()
+
+    def process(self, flush_interval, flush_bytes, fsync):
+        """ Drain the queue (writer thread)
+        """
+
+        # Stream -> queued blocks. The streams are independent, so the blocks of every stream are coalesced up to the
+        # next control operation
+        blocks = dict()
+        while True:
+            try:
+                op, stream, arg, queued = self._queue.popleft()
+            except IndexError:
+                break
+
+            if op == _OP_DATA:
+                blocks.setdefault(stream, []).append((stream, arg, queued))
+                continue
+
+            self._write_all(blocks)
+
+            if op == _OP_STREAM:
+                self._recorder.add_stream(*arg)
+            elif op == _OP_META:
+                self._recorder.update_metadata(arg)
+            elif op == _OP_FLUSH:
+                self._flush(fsync)
+                if arg is not None:
+                    arg.set()
+            elif op == _OP_CLOSE:
+                self._flush(fsync)
+                self._recorder.close()
+                self._finished.set()
+                logger.info("Closed {} ({})".format(self.get_filename(), self.get_stats()))
+
+        self._write_all(blocks)
+
+        if self._unflushed_bytes and (self._unflushed_bytes >= flush_bytes or
+                                      time.monotonic() - self._last_flush >= flush_interval):
+            self._flush(fsync)
+
+    def _write_all(self, blocks):
+        for stream_blocks in blocks.values():
+            self._write(stream_blocks)
+        blocks.clear()
+
+    def _write(self, blocks):
+        if not blocks:
+            return
+
+        data = np.concatenate([b for _, b, _ in blocks]) if len(blocks) > 1 else blocks[0][1]
+        try:
+            self._recorder.append(data, blocks[0][0])
+        except (OSError, ValueError) as e:
+            logger.error("Could not write to {}: {}".format(self.get_filename(), e))
+            return
+
+        self._written_rows += len(data)
+        self._written_bytes += data.nbytes
+        self._unflushed_bytes += data.nbytes
+
+        if self._latency is not None:
+            now = time.monotonic_ns()
+            self._latency.record_many([(now - queued) // 1000 for _, _, queued in blocks])
+
+    def _flush(self, fsync):
+        try:
+            self._recorder.flush()
+            if fsync:
+                self._recorder.sync()
+        except (OSError, ValueError) as e:
+            logger.error("Could not flush {}: {}".format(self.get_filename(), e))
+
+        self._unflushed_bytes = 0
+        self._last_flush = time.monotonic()
+
+
+# Writer shared by all workers of the application
+_shared_writer = None
+
+
+def get_shared_writer():
+    global _shared_writer
+
+    if _shared_writer is None:
+        _shared_writer = AsyncWriter()
+
+    return _shared_writer
+
+
+def stop_shared_writer():
+    if _shared_writer is not None:
+        _shared_writer.stop()
@@ -0,0 +1,143 @@
+import time
+import logging
+import importlib
+import importlib.util
+
+from lib import startup_profile
+
+# Start backends logger
+logger = logging.getLogger('PC.BACKENDS')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# DEVICE BACKENDS                              #
+#                                              #
+# - Registry of the device kinds and the       #
+#   optional parts of the application          #
+#                                              #
+################################################
+
+# Every backend names the packages it requires and the module which implements it. Whether a backend is available
+# is checked without importing anything (the packages are only looked up); the module is imported on first use and
+# the time it took is recorded in the startup profile. A backend whose packages are missing or fail to import is
+# unavailable: the application runs without it instead of crashing at import.
+#
+#   module, interface: interface class of a device kind (GlobalInterface)
+#   requires: top level packages which have to be installed
+
+BACKENDS = {
+    'tmos': dict({"module": "lib.serial_interface", "interface": "SerialInterface", "requires": ["serial"]}),
+    'vicon': dict({"module": "lib.vicon_interface", "interface": "ViconInterface", "requires": ["vicon_dssdk"]}),
+    'plotter': dict({"module": None, "interface": None, "requires": ["PyQt5", "pyqtgraph"]})
+}
+
+
+class BackendUnavailable(ImportError):
+    """ A backend can't be used (missing or broken packages)
+    """
+
+
+# Name -> reason of the backends which turned out to be unavailable, and the loaded modules
+_unavailable = dict()
+_modules = dict()
+
+
+def is_available(name):
+    """ Check that the packages of a backend are installed, without importing them
+
+        :returns:
+            True if the backend can be used (as far as known before loading it)
+    """
+
+    return get_unavailable_reason(name) is None
+
+
+def get_unavailable_reason(name):
+    """ :returns:
+            Why the backend can't be used or None
+    """
+
+    if name not in BACKENDS:
+        return "Unknown backend '{}'".format(name)
+
+    if name not in _unavailable:
+        for package in BACKENDS[name]["requires"]:
+            try:
+                found = importlib.util.find_spec(package) is not None
+            except (ImportError, ValueError):
+                found = False
+
+            if not found:
+                _unavailable[name] = "{} is not installed".format(package)
+                break
+        else:
+            _unavailable[name] = None
+
+    return _unavailable[name]
+
+
+def get_status():
+    """ :returns:
+            Dictionary of backend name -> reason why it is unavailable (None if available)
+    """
+
+    return {name: get_unavailable_reason(name) for name in BACKENDS}
+
+
+def load(name):
+    """ Import the module of a backend (and its packages) on first use
+
+        :returns:
+            The module (None for a backend without module)
+        :raises BackendUnavailable:
+            If the packages are missing or can't be imported
+    """
+
+    module = _modules.get(name)
+    if module is not None:
+        return module
+
+    reason = get_unavailable_reason(name)
+    if reason is not None:
+        raise BackendUnavailable("Backend '{}' is not available: {}".format(name, reason))
+
+    # Backends which are run as programs of their own (plotter) have nothing to import
+    if BACKENDS[name]["module"] is None:
+        return None
+
+    t0 = time.monotonic()
+    try:
+        module = importlib.import_module(BACKENDS[name]["module"])
+        load_packages = getattr(module, 'load_sdk', None)
+        if load_packages is not None:
+            load_packages()
+    except ImportError as e:
+        _unavailable[name] = str(e)
+        logger.warning("Backend '{}' is not available: {}".format(name, e))
+        raise BackendUnavailable("Backend '{}' is not available: {}".format(name, e)) from e
+
+    duration = time.monotonic() - t0
+    startup_profile.add_deferred(name, duration)
+    logger.debug("Loaded backend '{}' in {:.0f} ms".format(name, duration * 1000))
+
+    _modules[name] = module
+    return module
+
+
+def get_interface_class(name):
+    """ :raises BackendUnavailable:
+            If the backend can't be loaded
+    """
+
+    return getattr(load(name), BACKENDS[name]["interface"])
+
+
+def create_interface(name, *args, **kwargs):
+    """ Interface of a device kind, the backend is loaded on first use
+
+        :raises BackendUnavailable:
+            If the backend can't be loaded
+    """
+
+    return get_interface_class(name)(*args, **kwargs)
@@ -0,0 +1,156 @@
+import struct
+import binascii
+
+import numpy as np
+
+
+################################################
+# BINARY FRAME PROTOCOL                        #
+#                                              #
+# - Packed sample frames sent by the STM32     #
+#   board once binary mode is negotiated       #
+#                                              #
+################################################
+
+# Frame layout (little-endian, packed, 28 bytes):
+#
+#   sync      uint16   0xA55A (sent as 5A A5)
+#   dev_id    uint16
+#   in_time   uint32   device local time
+#   dist_raw  int32
+#   temp      float32
+#   dist_filt float32
+#   vel       float32
+#   bin_1     uint8    presence bit
+#   bin_2     uint8    movement bit
+#   crc       uint16   CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF) over dev_id..bin_2
+#
+# The board switches to binary frames after it acknowledged the binary command with "OK". Control commands and
+# their responses (s, p, OK) stay ASCII.
+
+SYNC_WORD = 0xA55A
+SYNC_BYTES = struct.pack('<H', SYNC_WORD)
+
+CRC_INIT = 0xFFFF
+
+# Command sent to the board to switch the sample stream to binary frames
+BINARY_MODE_COMMAND = b'b'
+
+FRAME_DTYPE = np.dtype([('sync', '<u2'), ('dev_id', '<u2'), ('in_time', '<u4'), ('dist_raw', '<i4'), ('temp', '<f4'),
+                        ('dist_filt', '<f4'), ('vel', '<f4'), ('bin_1', 'u1'), ('bin_2', 'u1'), ('crc', '<u2')])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+
+_PAYLOAD_START = 2
+_PAYLOAD_END = FRAME_SIZE - 2
+
+
+def _build_crc_table():
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        table[byte] = binascii.crc_hqx(bytes([byte]), 0)
+
+    return table
+
+
+# CRC of every byte value (poly 0x1021, init 0), to compute the CRCs of many frames at once
+_CRC_TABLE = _build_crc_table()
+
+
+def frame_crc(payload):
+    return binascii.crc_hqx(payload, CRC_INIT)
+
+
+def frame_crcs(payloads):
+    """ CRCs of many payloads at once, same result as frame_crc for every row. Table-driven, one pass per byte
+        column
+
+        :param payloads:
+            2-D uint8 array, one payload per row
+        :returns:
+            uint16 array with the CRC of every row
+    """
+
+    crc = np.full(len(payloads), CRC_INIT, dtype=np.uint16)
+    for column in payloads.T:
+        crc = (crc << 8) ^ _CRC_TABLE[(crc >> 8) ^ column]
+
+    return crc
+
+
+def encode_frame(dev_id, in_time, dist_raw, temp, dist_filt, vel, bin_1, bin_2):
+    """ Build a frame (as the firmware does). Useful for simulators and tests
+
+        :returns:
+            Frame bytes
+    """
+
+    frame = np.zeros(1, dtype=FRAME_DTYPE)
+    frame[0] = (SYNC_WORD, dev_id, in_time, dist_raw, temp, dist_filt, vel, bin_1, bin_2, 0)
+    raw = bytearray(frame.tobytes())
+    raw[_PAYLOAD_END:] = struct.pack('<H', frame_crc(bytes(raw[_PAYLOAD_START:_PAYLOAD_END])))
+
+    return bytes(raw)
+
+
+def decode_frames(buffer):
+    """ Decode all complete frames of a receive buffer. The buffer itself is not modified
+
+        Aligned runs of frames are viewed and CRC checked in bulk with NumPy; on a missing sync word or a CRC mismatch
+        the decoder skips a single byte and searches for the next sync word
+
+        :returns:
+            (frames, consumed, crc_errors, skipped_bytes) - the valid frames as structured array (FRAME_DTYPE), the
+            number of bytes which can be dropped from the buffer, the number of rejected frames and the number of
+            bytes skipped while resynchronizing
+    """
+
+    n = len(buffer)
+
+    blocks = []
+    crc_errors = 0
+    skipped = 0
+    pos = 0
+
+    while True:
+        start = buffer.find(SYNC_BYTES, pos)
+        if start < 0:
+            # Keep the last byte, it might be the first half of a sync word
+            end = max(pos, n - 1)
+            skipped += end - pos
+            pos = end
+            break
+
+        skipped += start - pos
+        pos = start
+
+        count = (n - pos) // FRAME_SIZE
+        if count == 0:
+            break
+
+        frames = np.frombuffer(buffer, dtype=FRAME_DTYPE, count=count, offset=pos)
+
+        # Length of the run of frames which start with a sync word
+        in_sync = frames['sync'] == SYNC_WORD
+        run = count if in_sync.all() else int(np.argmin(in_sync))
+
+        # CRCs of the whole run at once (2-D byte view, one frame per row)
+        raw = np.frombuffer(buffer, dtype=np.uint8, count=run * FRAME_SIZE, offset=pos).reshape(run, FRAME_SIZE)
+        crc_valid = frame_crcs(raw[:, _PAYLOAD_START:_PAYLOAD_END]) == frames['crc'][:run]
+        crc_ok = bool(crc_valid.all())
+        if not crc_ok:
+            run = int(np.argmin(crc_valid))
+        del raw
+
+        blocks.append(frames[:run].copy())
+        pos += run * FRAME_SIZE
+        del frames
+
+        if run < count:
+            # Out of sync or corrupted frame: skip one byte and search again
+            if not crc_ok:
+                crc_errors += 1
+            pos += 1
+            skipped += 1
+
+    out = np.concatenate(blocks) if blocks else np.empty(0, dtype=FRAME_DTYPE)
+    return out, pos, crc_errors, skipped
@@ -0,0 +1,255 @@
+import json
+import collections
+
+import numpy as np
+
+
+################################################
+# CONTINUITY                                   #
+#                                              #
+# - Detects lost, duplicated and reordered     #
+#   samples from the device time (in_time)     #
+#                                              #
+################################################
+
+# The device time of consecutive samples of a sensor advances by one sample period. Every new sample is compared to
+# the latest device time seen so far (per dev_id):
+#
+#   delta > (1 + tolerance) * period    gap, round(delta / period) - 1 samples are missing
+#   0 <= delta < (1 - tolerance) * period    duplicate (repeated or early sample)
+#   delta < 0                           reordered (late) sample. It was counted as missing with the gap before, which
+#                                       it fills: the gap has one missing sample less (and is dropped once filled)
+#   delta < -restart_periods * period   the device time restarted (board reset, counter wrap), tracking starts over
+#
+# Only the events are stored, so a complete recording has an empty gap index. A reordered but intact recording is
+# complete, its gap index only lists the reorder events.
+
+# Number of recent gaps per sensor which late samples can still fill
+OPEN_GAPS = 64
+
+EVENT = {
+    'gap': 1,
+    'duplicate': 2,
+    'reorder': 3,
+    'restart': 4
+}
+
+EVENT_DTYPE = np.dtype([('kind', 'u1'), ('dev_id', '<u2'), ('in_time', '<f8'), ('delta', '<f8'), ('missing', '<i4'),
+                        ('time', '<i8')])
+
+
+def get_event_name(kind):
+    for name, value in EVENT.items():
+        if value == kind:
+            return name
+
+    return str(kind)
+
+
+class ContinuityTracker:
+    """ Continuity check of the device time of one device (any number of sensors, told apart by dev_id)
+    """
+
+    def __init__(self, period, tolerance=0.5, restart_periods=10, max_events=100000):
+        """
+            :param period:
+                Expected device time between two samples of a sensor
+            :param tolerance:
+                Accepted deviation from the period (fraction of the period)
+            :param restart_periods:
+                A backward jump of more than this many periods is a restart of the device time
+            :param max_events:
+                Events kept for the gap index, further events are only counted
+        """
+
+        self._period = period
+        self._tolerance = tolerance
+        self._restart_periods = restart_periods
+        self._max_events = max_events
+
+        self._last = dict()
+        self._events = []
+        self._stored_events = 0
+        self._counts = dict()
+
+        # dev_id -> recent gaps [first missing, end, missing], which late samples can fill
+        self._open_gaps = dict()
+
+        self.reset()
+
+    def reset(self):
+        """ Start a new measurement
+        """
+
+        self._last = dict()
+        self._events = []
+        self._stored_events = 0
+        self._open_gaps = dict()
+        self._counts = dict({"samples": 0, "gaps": 0, "missing": 0, "duplicates": 0, "reordered": 0, "restarts": 0})
+
+    def get_period(self):
+        return self._period
+
+    def set_period(self, period):
+        self._period = period
+
+    def get_counts(self):
+        return dict(self._counts)
+
+    def is_complete(self):
+        """ True if no sample is missing so far
+        """
+
+        return self._counts["missing"] == 0
+
+    def update(self, dev_ids, in_times, times):
+        """ Check new samples (in receive order)
+
+            :param times:
+                Host times of the samples (stored with the events)
+            :returns:
+                Dictionary with the counts of the new samples (same keys as get_counts). Late samples which fill
+                earlier gaps are subtracted, so "missing" and "gaps" can be negative
+        """
+
+        counts = dict.fromkeys(self._counts, 0)
+        counts["samples"] = len(in_times)
+
+        ids = np.unique(dev_ids)
+        for dev_id in ids:
+            if len(ids) == 1:
+                self._check(int(dev_id), np.asarray(in_times, dtype=np.float64), np.asarray(times), counts)
+            else:
+                selected = dev_ids == dev_id
+                self._check(int(dev_id), np.asarray(in_times, dtype=np.float64)[selected], np.asarray(times)[selected],
+                            counts)
+
+        for name, value in counts.items():
+            self._counts[name] += value
+
+        return counts
+
+    def _check(self, dev_id, in_times, times, counts):
+        while len(in_times):
+            last = self._last.get(dev_id)
+            if last is None:
+                # First sample of the sensor, nothing to compare with
+                self._last[dev_id] = in_times[0]
+                in_times = in_times[1:]
+                times = times[1:]
+                continue
+
+            # Delta of every sample to the latest device time before it
+            latest = np.maximum.accumulate(np.concatenate(([last], in_times)))
+            delta = in_times - latest[:-1]
+
+            restarts = np.flatnonzero(delta < -self._restart_periods * self._period)
+            end = restarts[0] if len(restarts) else len(in_times)
+
+            self._classify(dev_id, in_times[:end], delta[:end], times[:end], counts)
+
+            if end == len(in_times):
+                self._last[dev_id] = latest[end]
+                break
+
+            # Device time restarted: continue with the samples after it as a new sequence
+            counts["restarts"] += 1
+            self._store(EVENT['restart'], dev_id, in_times[end:end + 1], delta[end:end + 1], 0, times[end:end + 1])
+            self._last[dev_id] = in_times[end]
+            self._open_gaps.pop(dev_id, None)
+            in_times = in_times[end + 1:]
+            times = times[end + 1:]
+
+    def _classify(self, dev_id, in_times, delta, times, counts):
+        period = self._period
+
+        gaps = delta > (1 + self._tolerance) * period
+        if gaps.any():
+            missing = np.rint(delta[gaps] / period).astype(np.int64) - 1
+            counts["gaps"] += int(gaps.sum())
+            counts["missing"] += int(missing.sum())
+            self._store(EVENT['gap'], dev_id, in_times[gaps], delta[gaps], missing, times[gaps])
+
+            open_gaps = self._open_gaps.setdefault(dev_id, collections.deque(maxlen=OPEN_GAPS))
+            for end, gap_delta, gap_missing in zip(in_times[gaps].tolist(), delta[gaps].tolist(), missing.tolist()):
+                open_gaps.append([end - gap_delta, end, gap_missing])
+
+        duplicates = (delta >= 0) & (delta < (1 - self._tolerance) * period)
+        if duplicates.any():
+            counts["duplicates"] += int(duplicates.sum())
+            self._store(EVENT['duplicate'], dev_id, in_times[duplicates], delta[duplicates], 0, times[duplicates])
+
+        reordered = delta < 0
+        if reordered.any():
+            counts["reordered"] += int(reordered.sum())
+            self._store(EVENT['reorder'], dev_id, in_times[reordered], delta[reordered], 0, times[reordered])
+
+            for in_time in in_times[reordered].tolist():
+                self._fill_gap(dev_id, in_time, counts)
+
+    def _fill_gap(self, dev_id, in_time, counts):
+        """ A late sample arrived: it is no longer missing from the gap it belongs to
+        """
+
+        for gap in reversed(self._open_gaps.get(dev_id, ())):
+            start, end, missing = gap
+            if start < in_time < end and missing > 0:
+                gap[2] -= 1
+                counts["missing"] -= 1
+                if gap[2] == 0:
+                    counts["gaps"] -= 1
+
+                for events in self._events:
+                    events['missing'][(events['kind'] == EVENT['gap']) & (events['dev_id'] == dev_id) &
+                                      (events['in_time'] == end)] = gap[2]
+                return
+
+    def _store(self, kind, dev_id, in_times, delta, missing, times):
+        n = min(len(in_times), self._max_events - self._stored_events)
+        if n <= 0:
+            return
+
+        events = np.zeros(n, dtype=EVENT_DTYPE)
+        events['kind'] = kind
+        events['dev_id'] = dev_id
+        events['in_time'] = in_times[:n]
+        events['delta'] = delta[:n]
+        events['missing'] = missing[:n] if isinstance(missing, np.ndarray) else missing
+        events['time'] = times[:n]
+
+        self._events.append(events)
+        self._stored_events += n
+
+    def get_events(self):
+        """ :returns:
+                All stored events (EVENT_DTYPE), sorted by host time. Gaps which late samples filled are left out
+        """
+
+        if not self._events:
+            return np.empty(0, dtype=EVENT_DTYPE)
+
+        events = np.concatenate(self._events)
+        events = events[(events['kind'] != EVENT['gap']) | (events['missing'] > 0)]
+        return events[np.argsort(events['time'], kind='stable')]
+
+    def get_summary(self):
+        """ Counts and expected period, stored in the recording metadata
+        """
+
+        summary = self.get_counts()
+        summary["period"] = self._period
+        summary["complete"] = self.is_complete()
+        return summary
+
+    def write_index(self, filename):
+        """ Write the gap index (JSON): the summary and one row per event
+        """
+
+        events = self.get_events()
+        index = dict({"summary": self.get_summary(),
+                      "columns": list(EVENT_DTYPE.names),
+                      "events": [[get_event_name(e['kind']), int(e['dev_id']), float(e['in_time']), float(e['delta']),
+                                  int(e['missing']), int(e['time'])] for e in events]})
+
+        with open(filename, 'w') as fh:
+            json.dump(index, fh)
@@ -0,0 +1,246 @@
+import os
+import sys
+import types
+import logging
+import contextlib
+import multiprocessing
+import multiprocessing.managers
+
+import numpy as np
+
+from lib import metrics
+from lib import backends
+from lib import async_writer
+from lib.shm_ring import SharedRingBuffer
+from lib.start_sync import StartCoordinator
+from lib.recorder import SAMPLE_DTYPES
+from lib.acquisition_engine import AcquisitionEngine
+from lib.template import GlobalProtocol
+
+# Start device process logger
+logger = logging.getLogger('PC.PROCESS')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# DEVICE PROCESS                               #
+#                                              #
+# - Runs the acquisition of one device in its  #
+#   own OS process                             #
+#                                              #
+################################################
+
+# The process runs an acquisition engine with a single device and its own recording writer, so it never competes
+# with the GUI (or the other devices) for the interpreter.
+#
+#   parent -> device: command queue of (command, argument) tuples. The commands are the WORKER_COMMAND codes and the
+#                     PROCESS_COMMAND codes below
+#   device -> parent: responses (WORKER_RESPONSE) in a shared memory ring (STATUS_DTYPE), samples in the plotter
+#                     ring of the device
+#
+# Neither ring ever blocks the device process, a frozen GUI only loses responses once the status ring wrapped.
+#
+# A spawned child normally imports the __main__ module of the parent first (QtMain and with it Qt and pyqtgraph).
+# The device process only needs this module, the main module is hidden while the process is started.
+#
+# A synchronized start (START ALL) is coordinated across the processes by a StartCoordinator whose barriers live in
+# a manager process, started on the first synchronized start. The processes are released together and every one
+# writes its start skew into the metadata of its recording.
+
+PROCESS_COMMAND = {
+    'reference_time': 100,
+    'plotter_ring': 101,
+    'quit': 102,
+    'start_synchronized': 103
+}
+
+STATUS_DTYPE = np.dtype([('resp', '<i4'), ('success', 'u1'), ('arg', 'S2048')])
+STATUS_RING_CAPACITY = 512
+
+# Manager of the shared start coordinators (started on first use)
+_start_manager = None
+
+
+def create_interface(kind, mode=0, options=None):
+    """ Interface of a device, mode is the sensor mode (tmos) or the stream mode (vicon), options are further
+        arguments of the interface. Only the backend of the device kind is loaded by the process
+    """
+
+    if kind not in GlobalProtocol.DATA_TYPES or kind == 'nan':
+        raise ValueError("Unknown device kind '{}'".format(kind))
+
+    return backends.create_interface(kind, mode, **(options or dict()))
+
+
+def run_device(title, exp_name, kind, mode, command_queue, status_ring_name, options=None):
+    """ Entry point of the device process
+    """
+
+    logging.basicConfig()
+
+    status_ring = SharedRingBuffer.attach(status_ring_name, STATUS_DTYPE)
+
+    # Plotter rings are only closed at the end, the engine thread might still be writing to a replaced one
+    plotter_rings = []
+
+    def respond(_, resp, success, arg):
+        status_ring.write(np.array([(resp, success, arg.encode('utf-8', 'replace')[:STATUS_DTYPE['arg'].itemsize])],
+                                   dtype=STATUS_DTYPE))
+
+    try:
+        interface = create_interface(kind, mode, options)
+    except backends.BackendUnavailable as e:
+        respond(title, GlobalProtocol.WORKER_RESPONSE['error'], False, str(e))
+        status_ring.close()
+        return
+
+    engine = AcquisitionEngine(respond)
+    engine.add_device(title, exp_name, interface, GlobalProtocol.DATA_TYPES[kind])
+    engine.start()
+
+    # The metrics of the process can't be shown by the GUI, they are only written to their own file
+    reporter = metrics.MetricsReporter(metrics.get_registry(),
+                                       metrics.get_default_filename('_' + title.replace(" ", "_").upper()))
+    reporter.start()
+
+    while True:
+        command, arg = command_queue.get()
+
+        if command == PROCESS_COMMAND['quit']:
+            break
+        elif command == PROCESS_COMMAND['reference_time']:
+            engine.set_reference_time(title, int(arg))
+        elif command == PROCESS_COMMAND['start_synchronized']:
+            engine.start_synchronized(title, arg)
+        elif command == PROCESS_COMMAND['plotter_ring']:
+            ring = SharedRingBuffer.attach(arg, SAMPLE_DTYPES[kind]) if arg else None
+            engine.set_plotter_ring(title, ring)
+            if ring is not None:
+                plotter_rings.append(ring)
+        else:
+            engine.send_command(title, command, arg)
+
+    engine.stop()
+    async_writer.stop_shared_writer()
+    reporter.stop()
+
+    for ring in plotter_rings:
+        ring.close()
+    status_ring.close()
+
+
+@contextlib.contextmanager
+def _hidden_main_module():
+    """ Replace the __main__ module by an empty one, so a process spawned meanwhile doesn't import it
+    """
+
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main_module
+
+
+def create_start_coordinator(parties, t0=None):
+    """ Start coordinator which can be passed to the device processes (DeviceProcess.start_synchronized)
+    """
+
+    global _start_manager
+
+    if _start_manager is None:
+        _start_manager = multiprocessing.managers.SyncManager(ctx=multiprocessing.get_context('spawn'))
+        with _hidden_main_module():
+            _start_manager.start()
+
+    return StartCoordinator(parties, t0=t0, manager=_start_manager)
+
+
+def stop_start_manager():
+    global _start_manager
+
+    if _start_manager is not None:
+        _start_manager.shutdown()
+        _start_manager = None
+
+
+class DeviceProcess:
+    """ Handle of a device process (parent side)
+    """
+
+    def __init__(self, title, exp_name, kind, mode=0, options=None):
+        self._title = title
+        self._kind = kind
+
+        # Spawn on all platforms: the parent has Qt and threads running, forking those is not safe
+        context = multiprocessing.get_context('spawn')
+
+        self._status_ring = SharedRingBuffer.create("tmos_status_{}_{}".format(os.getpid(),
+                                                                               title.replace(" ", "_").lower()),
+                                                    STATUS_DTYPE, STATUS_RING_CAPACITY)
+        self._status_seq = 0
+
+        self._command_queue = context.Queue()
+        self._process = context.Process(target=run_device, name=title,
+                                        args=(title, exp_name, kind, mode, self._command_queue,
+                                              self._status_ring.get_name(), options),
+                                        daemon=True)
+        with _hidden_main_module():
+            self._process.start()
+
+    def get_title(self):
+        return self._title
+
+    def get_kind(self):
+        return self._kind
+
+    def is_alive(self):
+        return self._process.is_alive()
+
+    def send_command(self, command, arg=''):
+        """ Queue a command [WORKER_COMMAND or PROCESS_COMMAND] for the device process
+        """
+
+        self._command_queue.put((command, arg))
+
+    def set_reference_time(self, t0):
+        # time.monotonic_ns() is system wide, the value is valid in the device process
+        self.send_command(PROCESS_COMMAND['reference_time'], str(t0))
+
+    def start_synchronized(self, coordinator):
+        """ Start together with the other devices, coordinator from create_start_coordinator
+        """
+
+        self.send_command(PROCESS_COMMAND['start_synchronized'], coordinator)
+
+    def set_plotter_ring(self, ring):
+        self.send_command(PROCESS_COMMAND['plotter_ring'], ring.get_name() if ring is not None else '')
+
+    def read_responses(self):
+        """ Responses published since the last call
+
+            :returns:
+                List of (response code, success, argument) tuples
+        """
+
+        records, self._status_seq, lost = self._status_ring.read(self._status_seq)
+        if lost:
+            logger.warning("{}: {} responses lost".format(self._title, lost))
+
+        return [(int(r['resp']), bool(r['success']), r['arg'].decode('utf-8', 'replace')) for r in records]
+
+    def stop(self, timeout=10.0):
+        """ Stop the device (closes its recording) and the process
+        """
+
+        if self._process.is_alive():
+            self.send_command(PROCESS_COMMAND['quit'])
+            self._process.join(timeout)
+
+            if self._process.is_alive():
+                logger.error("{} did not stop, terminating".format(self._title))
+                self._process.terminate()
+                self._process.join()
+
+        self._command_queue.close()
+        self._status_ring.close()
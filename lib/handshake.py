@@ -0,0 +1,88 @@
+import time
+import logging
+import concurrent.futures
+
+# Start handshake logger
+logger = logging.getLogger('PC.HANDSHAKE')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# HANDSHAKE                                    #
+#                                              #
+# - Brings up all boards of a rig at the same  #
+#   time                                       #
+#                                              #
+################################################
+
+# Every board waits for its acknowledges with blocking reads against a deadline, so a handshake costs no CPU while
+# it waits. The handshakes of all boards run concurrently, the whole rig is ready after about the time of the slowest
+# board.
+
+
+def bring_up(interface, port, start=True):
+    """ Open, identify and (optionally) start one device
+
+        :returns:
+            Dictionary with the result ("success"), the failed step ("failed") and the duration of every phase in ms
+            (the interface phases plus "total")
+    """
+
+    t0 = time.monotonic()
+    result = dict({"port": port, "success": False, "failed": None})
+
+    if not interface.open_port(port):
+        result["failed"] = 'open'
+    elif start and not interface.start_device():
+        result["failed"] = 'start'
+    else:
+        result["success"] = True
+
+    result.update(interface.get_timings())
+    result["total"] = round((time.monotonic() - t0) * 1000, 1)
+
+    return result
+
+
+def bring_up_all(devices, start=True, max_workers=None):
+    """ Bring up all devices concurrently
+
+        :param devices:
+            Dictionary of title -> (interface, port)
+        :returns:
+            Dictionary of title -> timing breakdown (see bring_up)
+    """
+
+    results = dict()
+    if not devices:
+        return results
+
+    t0 = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or len(devices)) as pool:
+        futures = dict()
+        for title, (interface, port) in devices.items():
+            futures[title] = pool.submit(bring_up, interface, port, start)
+
+        for title, future in futures.items():
+            try:
+                results[title] = future.result()
+            except Exception as e:
+                logger.exception("Handshake of {} failed".format(title))
+                results[title] = dict({"port": devices[title][1], "success": False, "failed": str(e)})
+
+    logger.info("{} of {} devices ready in {:.0f} ms".format(sum(r["success"] for r in results.values()), len(results),
+                                                           (time.monotonic() - t0) * 1000))
+    return results
+
+
+def format_timings(result):
+    """ One line summary of a timing breakdown, e.g. "open 12.0 ms, identify 1003.2 ms, total 1015.2 ms"
+    """
+
+    parts = ["{} {} ms".format(name, value) for name, value in result.items()
+             if name not in ("port", "success", "failed")]
+
+    if result.get("failed"):
+        parts.append("failed at {}".format(result["failed"]))
+
+    return ", ".join(parts)
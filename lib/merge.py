@@ -0,0 +1,334 @@
+import sys
+import glob
+import logging
+import argparse
+
+import numpy as np
+
+from lib import recorder
+
+# Start merge logger
+logger = logging.getLogger('PC.MERGE')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# OFFLINE MERGE                                #
+#                                              #
+# - Merges the recordings of an experiment     #
+#   into one time aligned table                #
+#                                              #
+################################################
+
+# All TMOS recordings are k-way merged by time, block by block: every sensor contributes the samples up to the
+# smallest "last buffered time" of all sensors (the watermark), so a block is complete once it is emitted. The Vicon
+# recording is read alongside and the position of every segment is joined onto each TMOS sample (linear
+# interpolation or nearest sample). Only one chunk per sensor and the Vicon samples of a window of `max_gap` ms are
+# kept in memory, the runtime is linear in the length of the session.
+#
+# Rotations (quaternions) are interpolated component-wise, which is a good approximation between consecutive frames.
+
+JOIN_METHOD = {
+    'linear': 0,
+    'nearest': 1
+}
+
+# Vicon columns which are not joined
+JOIN_EXCLUDE = ('time', 'frame', 'latency', 'rx_time')
+
+
+class ChunkCursor:
+    """ Sequential reader of one stream of a recording, chunk by chunk
+    """
+
+    def __init__(self, filename, stream='samples'):
+        self.filename = filename
+        self.metadata = dict()
+        self.dtype = recorder.read_stream_dtypes(filename)[stream]
+
+        with open(filename, 'rb') as fh:
+            self.metadata.update(recorder.read_header(fh)["metadata"])
+
+        self._stream = stream
+        self._chunks = recorder.iter_chunks(filename, self.metadata)
+        self._buffer = np.empty(0, dtype=self.dtype)
+        self._exhausted = False
+
+    def is_exhausted(self):
+        return self._exhausted and len(self._buffer) == 0
+
+    def buffered(self):
+        return self._buffer
+
+    def load(self):
+        """ Read the next chunk into the buffer. The buffer is kept sorted by time
+
+            :returns:
+                False if the file has no more data
+        """
+
+        for name, data in self._chunks:
+            if name == self._stream and len(data):
+                self._buffer = np.concatenate((self._buffer, data)) if len(self._buffer) else data
+
+                # Recorded in order, except for reordered samples (rare, see lib/continuity.py)
+                times = self._buffer['time']
+                if np.any(times[1:] < times[:-1]):
+                    self._buffer = self._buffer[np.argsort(times, kind='stable')]
+                return True
+
+        self._exhausted = True
+        return False
+
+    def last_time(self):
+        if len(self._buffer) == 0 and not self._exhausted:
+            self.load()
+
+        if len(self._buffer) == 0:
+            return None
+
+        return self._buffer['time'][-1]
+
+    def take_until(self, t):
+        """ Remove and return all buffered samples with time <= t
+        """
+
+        end = np.searchsorted(self._buffer['time'], t, 'right')
+        taken = self._buffer[:end]
+        self._buffer = self._buffer[end:]
+        return taken
+
+    def drop_before(self, t):
+        self._buffer = self._buffer[np.searchsorted(self._buffer['time'], t, 'left'):]
+
+
+def find_recordings(exp_name, folder="output/"):
+    """ All recordings of an experiment, grouped by device kind
+
+        :returns:
+            (tmos files, vicon files)
+    """
+
+    prefix = folder + exp_name.replace(" ", "_").upper() + "_"
+    tmos_files = []
+    vicon_files = []
+
+    for filename in sorted(glob.glob(prefix + "*" + recorder.RECORD_EXTENSION)):
+        metadata = dict()
+        with open(filename, 'rb') as fh:
+            try:
+                metadata.update(recorder.read_header(fh)["metadata"])
+            except ValueError:
+                continue
+
+        if metadata.get("kind") == 'tmos':
+            tmos_files.append(filename)
+        elif metadata.get("kind") == 'vicon':
+            vicon_files.append(filename)
+
+    return tmos_files, vicon_files
+
+
+def vicon_columns(dtype):
+    """ Numeric columns of the Vicon samples which are joined (positions, rotations, occlusion)
+    """
+
+    return [name for name in dtype.names if name not in JOIN_EXCLUDE and dtype.fields[name][0].kind in 'fiu']
+
+
+def segment_labels(data):
+    """ Segment name of every Vicon sample, prefixed with the subject if the recording has one
+    """
+
+    if 'subject' not in data.dtype.names:
+        return data['segment']
+
+    return np.char.add(np.char.add(data['subject'], b'/'), data['segment'])
+
+
+def scan_segments(vicon_file):
+    """ Segment names of a Vicon recording. Read from the segment table in the metadata, only recordings without
+        one (not stopped properly, or older) are scanned
+    """
+
+    metadata = recorder.read_metadata(vicon_file)
+    if "segments" in metadata:
+        return sorted(name.encode('ascii', 'replace') for name in metadata["segments"])
+
+    logger.info("{} has no segment table, scanning the samples".format(vicon_file))
+
+    segments = set()
+    for name, data in recorder.iter_chunks(vicon_file):
+        if name == 'samples':
+            segments.update(np.unique(segment_labels(data)).tolist())
+
+    return sorted(segments)
+
+
+def merged_dtype(tmos_dtype, segments, columns):
+    fields = [(name, tmos_dtype.fields[name][0].str) for name in tmos_dtype.names]
+    fields.append(('sensor', 'S32'))
+    for segment in segments:
+        for column in columns:
+            fields.append(("{}.{}".format(segment.decode('ascii', 'replace'), column), '<f8'))
+
+    return np.dtype(fields)
+
+
+def join_segment(t, seg_t, seg_values, method, max_gap):
+    """ Values of one segment at the times t
+
+        :returns:
+            Array of shape (len(t), n columns), NaN where no Vicon sample is close enough
+    """
+
+    out = np.full((len(t), seg_values.shape[1]), np.nan)
+    if len(seg_t) == 0:
+        return out
+
+    idx = np.searchsorted(seg_t, t, side='right')
+    left = np.clip(idx - 1, 0, len(seg_t) - 1)
+    right = np.clip(idx, 0, len(seg_t) - 1)
+
+    if method == JOIN_METHOD['nearest']:
+        nearest = np.where(np.abs(seg_t[right] - t) < np.abs(t - seg_t[left]), right, left)
+        valid = np.abs(seg_t[nearest] - t) <= max_gap
+        out[valid] = seg_values[nearest[valid]]
+        return out
+
+    # Linear interpolation between the samples around t (exact hits and the last sample included)
+    exact = seg_t[left] == t
+    bracketed = (idx > 0) & (idx < len(seg_t)) & (seg_t[right] - seg_t[left] <= max_gap)
+    valid = exact | bracketed
+
+    span = (seg_t[right] - seg_t[left]).astype(np.float64)
+    weight = np.divide(t - seg_t[left], span, out=np.zeros(len(t)), where=span > 0)
+    interpolated = seg_values[left] + weight[:, None] * (seg_values[right] - seg_values[left])
+    out[valid] = interpolated[valid]
+
+    return out
+
+
+def merge_experiment(tmos_files, vicon_file, out_filename, method=JOIN_METHOD['linear'], max_gap=50):
+    """ Merge the TMOS recordings and join the Vicon segments onto every sample
+
+        :returns:
+            Number of merged samples
+    """
+
+    cursors = [ChunkCursor(f) for f in tmos_files]
+    if not cursors:
+        raise ValueError("No TMOS recordings to merge")
+
+    tmos_dtype = cursors[0].dtype
+    titles = [c.metadata.get("title", c.filename).encode('ascii', 'replace')[:32] for c in cursors]
+
+    vicon = None
+    segments = []
+    columns = []
+    if vicon_file is not None:
+        vicon = ChunkCursor(vicon_file)
+        segments = scan_segments(vicon_file)
+        columns = vicon_columns(vicon.dtype)
+
+    out_dtype = merged_dtype(tmos_dtype, segments, columns)
+    metadata = dict({"kind": 'merged', "sources": list(tmos_files) + ([vicon_file] if vicon_file else []),
+                     "method": [k for k, v in JOIN_METHOD.items() if v == method][0], "max_gap": max_gap})
+    out = recorder.ColumnarRecorder(out_filename, streams=dict({"samples": out_dtype}), metadata=metadata)
+
+    total = 0
+    while True:
+        # Watermark: every sensor has all its samples up to this time buffered
+        last_times = [c.last_time() for c in cursors]
+        pending = [t for t in last_times if t is not None]
+        if not pending:
+            break
+        watermark = min(pending)
+
+        blocks = []
+        sensor_ids = []
+        for i, c in enumerate(cursors):
+            taken = c.take_until(watermark)
+            blocks.append(taken)
+            sensor_ids.append(np.full(len(taken), i))
+
+        block = np.concatenate(blocks)
+        sensor_idx = np.concatenate(sensor_ids)
+        order = np.argsort(block['time'], kind='stable')
+        block = block[order]
+        sensor_idx = sensor_idx[order]
+
+        merged = np.zeros(len(block), dtype=out_dtype)
+        for name in tmos_dtype.names:
+            merged[name] = block[name]
+        merged['sensor'] = np.asarray(titles, dtype='S32')[sensor_idx]
+
+        if vicon is not None and len(block):
+            _join_vicon(merged, vicon, segments, columns, method, max_gap)
+
+        out.append(merged)
+        total += len(merged)
+
+        # The sensors which reached the watermark need their next chunk
+        for c in cursors:
+            if len(c.buffered()) == 0 and not c.is_exhausted():
+                c.load()
+
+    out.close()
+    return total
+
+
+def _join_vicon(merged, vicon, segments, columns, method, max_gap):
+    t = merged['time']
+    t_max = t[-1]
+
+    # Buffer the Vicon samples until one after the end of the block (needed for the interpolation)
+    while not vicon.is_exhausted():
+        last = vicon.last_time()
+        if last is None or last > t_max + max_gap:
+            break
+        if not vicon.load():
+            break
+
+    samples = vicon.buffered()
+    labels = segment_labels(samples)
+    for segment in segments:
+        seg = samples[labels == segment]
+        seg_values = np.column_stack([seg[c].astype(np.float64) for c in columns]) if len(seg) else \
+            np.empty((0, len(columns)))
+        values = join_segment(t, seg['time'], seg_values, method, max_gap)
+
+        prefix = segment.decode('ascii', 'replace')
+        for i, column in enumerate(columns):
+            merged["{}.{}".format(prefix, column)] = values[:, i]
+
+    # Older samples can't be used for later blocks any more
+    vicon.drop_before(t_max - max_gap)
+
+
+if __name__ == '__main__':
+    # Merge all recordings of an experiment: python -m lib.merge "Experiment 0"
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description="Merge the TMOS and Vicon recordings of an experiment")
+    parser.add_argument("experiment", help="Experiment name (as entered in the app)")
+    parser.add_argument("--folder", default="output/", help="Folder of the recordings")
+    parser.add_argument("--output", default=None, help="Output recording (default [FOLDER][EXPERIMENT]_MERGED.rec)")
+    parser.add_argument("--method", default='linear', choices=list(JOIN_METHOD.keys()), help="Vicon join method")
+    parser.add_argument("--max-gap", type=int, default=50, help="Maximum distance (ms) to a Vicon sample")
+    args = parser.parse_args()
+
+    tmos, vicon_files = find_recordings(args.experiment, args.folder)
+    if len(vicon_files) > 1:
+        logger.warning("More than one Vicon recording found, using {}".format(vicon_files[0]))
+
+    output = args.output or args.folder + args.experiment.replace(" ", "_").upper() + "_MERGED" + recorder.RECORD_EXTENSION
+
+    try:
+        n = merge_experiment(tmos, vicon_files[0] if vicon_files else None, output, JOIN_METHOD[args.method],
+                             args.max_gap)
+    except ValueError as e:
+        logger.error(str(e))
+        sys.exit(1)
+
+    print("{} samples merged into {}".format(n, output))
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import logging
+import datetime
+import threading
+
+import numpy as np
+
+# Start metrics logger
+logger = logging.getLogger('PC.METRICS')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# ACQUISITION METRICS                          #
+#                                              #
+# - Counters, gauges and latency histograms of #
+#   every device                               #
+#                                              #
+################################################
+
+# Every counter and histogram has exactly one writer thread (the acquisition thread of the device, or the recording
+# writer thread), so they are updated without locks. Readers (the metrics panel, the reporter thread) take snapshots,
+# a snapshot taken during an update might be off by the value being recorded.
+#
+# Latencies are recorded in microseconds into HDR style histograms: values below 2**SUB_BITS are exact, above that
+# every power of two is split into 2**(SUB_BITS - 1) buckets, so the relative error of a percentile stays below
+# 2**(1 - SUB_BITS) (~6%) from microseconds up to hours, with a fixed and small memory footprint.
+
+SUB_BITS = 5
+HALF_BUCKETS = 1 << (SUB_BITS - 1)
+MAX_VALUE = (1 << 36) - 1  # us, about 19 hours
+
+# Counters which mean that samples were lost or corrupted (a recording without them has no gaps)
+LOSS_COUNTERS = ['lines_malformed', 'lines_truncated', 'lines_undecodable', 'crc_errors', 'frames_lost',
+                 'frame_errors', 'writer_dropped', 'samples_missing']
+
+# Percentiles of the histogram summaries
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def bucket_index(value):
+    """ Histogram bucket of a (non negative, integer) value
+    """
+
+    if value < (1 << SUB_BITS):
+        return value
+
+    shift = value.bit_length() - SUB_BITS
+    return (shift + 1) * HALF_BUCKETS + (value >> shift) - HALF_BUCKETS
+
+
+def bucket_value(index):
+    """ Representative (middle) value of a histogram bucket
+    """
+
+    if index < (1 << SUB_BITS):
+        return index
+
+    shift = index // HALF_BUCKETS - 1
+    lower = (index % HALF_BUCKETS + HALF_BUCKETS) << shift
+    return lower + ((1 << shift) >> 1)
+
+
+class Counter:
+    """ Monotonic counter (one writer)
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def add(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    """ HDR style latency histogram in microseconds (one writer)
+    """
+
+    def __init__(self):
+        self._counts = np.zeros(bucket_index(MAX_VALUE) + 1, dtype=np.int64)
+        self._count = 0
+        self._total = 0
+        self._min = None
+        self._max = 0
+
+    def record(self, value):
+        """ Record a latency (us)
+        """
+
+        value = min(max(int(value), 0), MAX_VALUE)
+        self._counts[bucket_index(value)] += 1
+        self._count += 1
+        self._total += value
+
+        if self._min is None or value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def record_many(self, values):
+        """ Record an array of latencies (us)
+        """
+
+        values = np.clip(np.asarray(values, dtype=np.int64), 0, MAX_VALUE)
+        if len(values) == 0:
+            return
+
+        # bit_length of every value (exact, the values are below 2**53)
+        shift = np.maximum(np.frexp(values.astype(np.float64))[1] - SUB_BITS, 0)
+        index = np.where(values < (1 << SUB_BITS), values,
+                         (shift + 1) * HALF_BUCKETS + (values >> shift) - HALF_BUCKETS)
+        np.add.at(self._counts, index, 1)
+
+        self._count += len(values)
+        self._total += int(values.sum())
+
+        low = int(values.min())
+        if self._min is None or low < self._min:
+            self._min = low
+        self._max = max(self._max, int(values.max()))
+
+    def get_count(self):
+        return self._count
+
+    def percentile(self, p, counts=None):
+        counts = self._counts if counts is None else counts
+        total = int(counts.sum())
+        if total == 0:
+            return 0
+
+        rank = max(1, int(np.ceil(total * p / 100.0)))
+        return bucket_value(int(np.searchsorted(np.cumsum(counts), rank)))
+
+    def summary(self):
+        """ :returns:
+                Dictionary with the count, min, mean, max and the percentiles (us)
+        """
+
+        counts = self._counts.copy()
+        count = self._count
+        result = dict({"count": count, "min": self._min or 0, "max": self._max,
+                       "mean": round(self._total / count, 1) if count else 0})
+        for p in PERCENTILES:
+            result["p{}".format(p)] = self.percentile(p, counts)
+
+        return result
+
+
+class DeviceMetrics:
+    """ Metrics of one device
+    """
+
+    def __init__(self, title):
+        self._title = title
+        self._counters = dict()
+        self._histograms = dict()
+        self._gauges = None
+
+    def get_title(self):
+        return self._title
+
+    def counter(self, name):
+        counter = self._counters.get(name)
+        if counter is None:
+            counter = self._counters[name] = Counter()
+
+        return counter
+
+    def histogram(self, name):
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            histogram = self._histograms[name] = Histogram()
+
+        return histogram
+
+    def count(self, name, n=1):
+        self.counter(name).add(n)
+
+    def record(self, name, value):
+        self.histogram(name).record(value)
+
+    def set_gauges(self, func):
+        """ Function which returns the current gauge values (dictionary), called by the readers
+        """
+
+        self._gauges = func
+
+    def snapshot(self):
+        """ :returns:
+                Dictionary with the counters, the gauges and the histogram summaries
+        """
+
+        gauges = dict()
+        if self._gauges is not None:
+            try:
+                gauges = self._gauges()
+            except Exception:
+                logger.exception("Gauges of {} failed".format(self._title))
+
+        counters = dict({name: c.value for name, c in list(self._counters.items())})
+        counters.update({name: value for name, value in gauges.items() if name in LOSS_COUNTERS})
+
+        return dict({"counters": counters,
+                     "gauges": {name: value for name, value in gauges.items() if name not in LOSS_COUNTERS},
+                     "histograms": {name: h.summary() for name, h in list(self._histograms.items())}})
+
+
+class MetricsRegistry:
+    """ Metrics of all devices of the application
+    """
+
+    def __init__(self):
+        self._devices = dict()
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+
+    def device(self, title):
+        """ Metrics of a device (created on first use)
+        """
+
+        with self._lock:
+            metrics = self._devices.get(title)
+            if metrics is None:
+                metrics = self._devices[title] = DeviceMetrics(title)
+
+        return metrics
+
+    def snapshot(self):
+        """ :returns:
+                Dictionary with the time and the snapshot of every device
+        """
+
+        with self._lock:
+            devices = list(self._devices.values())
+
+        return dict({"time": datetime.datetime.now().isoformat(),
+                     "uptime": round(time.monotonic() - self._t0, 3),
+                     "devices": {m.get_title(): m.snapshot() for m in devices}})
+
+
+def compute_rates(previous, current):
+    """ Per second rates of the counters between two registry snapshots
+
+        :returns:
+            Dictionary of device title -> counter name -> rate
+    """
+
+    rates = dict()
+    if previous is None:
+        return rates
+
+    dt = current["uptime"] - previous["uptime"]
+    if dt <= 0:
+        return rates
+
+    for title, device in current["devices"].items():
+        before = previous["devices"].get(title, dict({"counters": dict()}))["counters"]
+        rates[title] = dict({name: round((value - before.get(name, 0)) / dt, 2)
+                             for name, value in device["counters"].items()})
+
+    return rates
+
+
+def count_losses(device):
+    """ Sum of the loss counters of a device snapshot. Missing samples which arrived late are not lost
+    """
+
+    counters = device["counters"]
+    return sum(counters.get(name, 0) for name in LOSS_COUNTERS) - counters.get('samples_recovered', 0)
+
+
+class MetricsReporter:
+    """ Background thread which appends a snapshot of the registry to a JSON lines file every interval
+    """
+
+    def __init__(self, registry, filename=None, interval=5.0):
+        self._registry = registry
+        self._filename = filename or get_default_filename()
+        self._interval = interval
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._previous = None
+
+    def get_filename(self):
+        return self._filename
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the thread, the last snapshot is written before
+        """
+
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def dump(self):
+        snapshot = self._registry.snapshot()
+        snapshot["rates"] = compute_rates(self._previous, snapshot)
+        self._previous = snapshot
+
+        try:
+            with open(self._filename, 'a') as fh:
+                fh.write(json.dumps(snapshot) + '\n')
+        except OSError as e:
+            logger.error("Could not write {}: {}".format(self._filename, e))
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.dump()
+
+        self.dump()
+
+
+def get_default_filename(suffix=''):
+    """ output/metrics_[DATE]_[TIME][SUFFIX].jsonl
+    """
+
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join("output", "metrics_{}{}.jsonl".format(stamp, suffix))
+
+
+# Registry shared by the application
+_registry = None
+
+
+def get_registry():
+    global _registry
+
+    if _registry is None:
+        _registry = MetricsRegistry()
+
+    return _registry
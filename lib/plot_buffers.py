@@ -0,0 +1,226 @@
+import numpy as np
+
+
+################################################
+# PLOT BUFFERS                                 #
+#                                              #
+# - Preallocated sample buffers for the live   #
+#   plotter                                    #
+#                                              #
+################################################
+
+
+class CircularBuffer:
+    """ Circular buffer of the last `capacity` samples of a set of columns
+
+        Every value is stored twice (at i and at i + capacity), so the newest samples are always a contiguous slice
+        of the storage and can be handed to the plot without copying or reordering
+    """
+
+    def __init__(self, capacity, columns):
+        self._capacity = capacity
+        self._columns = dict()
+        for name in columns:
+            self._columns[name] = np.zeros(2 * capacity, dtype=np.float64)
+
+        self._total = 0
+
+    def get_capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return min(self._total, self._capacity)
+
+    def reset(self):
+        self._total = 0
+
+    def append(self, records):
+        """ Append a batch of records (structured array or dictionary of columns)
+        """
+
+        n = len(records[next(iter(self._columns))])
+        if n == 0:
+            return
+
+        skip = max(0, n - self._capacity)
+        idx = (self._total + skip + np.arange(n - skip)) % self._capacity
+
+        for name, data in self._columns.items():
+            values = records[name][skip:]
+            data[idx] = values
+            data[idx + self._capacity] = values
+
+        self._total += n
+
+    def view(self, column):
+        """ The buffered samples of a column, oldest first (a view, valid until the next append)
+        """
+
+        count = len(self)
+        end = self._total % self._capacity + self._capacity
+        return self._columns[column][end - count:end]
+
+
+class GrowableColumnStore:
+    """ Append-only columns which grow by doubling (amortized O(1) per sample)
+    """
+
+    def __init__(self, columns, capacity=4096):
+        self._columns = dict()
+        for name in columns:
+            self._columns[name] = np.empty(capacity, dtype=np.float64)
+
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reset(self):
+        self._size = 0
+
+    def append(self, records):
+        n = len(records[next(iter(self._columns))])
+        if n == 0:
+            return
+
+        self._reserve(self._size + n)
+        for name, data in self._columns.items():
+            data[self._size:self._size + n] = records[name]
+
+        self._size += n
+
+    def column(self, name):
+        return self._columns[name][:self._size]
+
+    def _reserve(self, size):
+        capacity = len(next(iter(self._columns.values())))
+        if size <= capacity:
+            return
+
+        while capacity < size:
+            capacity *= 2
+
+        for name, data in self._columns.items():
+            grown = np.empty(capacity, dtype=np.float64)
+            grown[:self._size] = data[:self._size]
+            self._columns[name] = grown
+
+
+class MinMaxPyramid:
+    """ Multi-resolution min/max summary of a column
+
+        Level k holds one bucket per `factor ** k` samples with the x of its first sample and the min and max of its
+        values. Only complete buckets are stored; they are computed incrementally from the level below, so appending
+        costs O(new samples)
+    """
+
+    def __init__(self, factor=4, min_buckets=256):
+        self._factor = factor
+        self._min_buckets = min_buckets
+
+        # Level 0 is the raw data (kept by the owner), levels 1.. are GrowableColumnStores of x/min/max
+        self._levels = []
+
+    def reset(self):
+        self._levels = []
+
+    def update(self, x, y):
+        """ Summarize the samples appended to x/y since the last update
+        """
+
+        below_x, below_min, below_max = x, y, y
+        level = 0
+        while len(below_x) // self._factor >= 1:
+            if level == len(self._levels):
+                # Don't create levels which would be too small to be worth it
+                if len(below_x) // self._factor < self._min_buckets and level > 0:
+                    break
+                self._levels.append(GrowableColumnStore(["x", "min", "max"], capacity=1024))
+
+            store = self._levels[level]
+            done = len(store)
+            complete = len(below_x) // self._factor
+            if complete > done:
+                start = done * self._factor
+                end = complete * self._factor
+                store.append(dict({"x": below_x[start:end:self._factor],
+                                   "min": below_min[start:end].reshape(-1, self._factor).min(axis=1),
+                                   "max": below_max[start:end].reshape(-1, self._factor).max(axis=1)}))
+
+            below_x, below_min, below_max = store.column("x"), store.column("min"), store.column("max")
+            level += 1
+
+    def render(self, x, y, x0, x1, max_points):
+        """ Points to draw the range [x0, x1] with at most about `max_points` points
+
+            :returns:
+                (x, y) - raw samples if they fit, otherwise the min/max envelope of the coarsest fitting level
+        """
+
+        lo, hi = self._range(x, x0, x1)
+        if hi - lo <= max_points:
+            return x[lo:hi], y[lo:hi]
+
+        for level, store in enumerate(self._levels):
+            level_x = store.column("x")
+            lo, hi = self._range(level_x, x0, x1)
+            if 2 * (hi - lo) <= max_points or level == len(self._levels) - 1:
+                out_x = np.repeat(level_x[lo:hi], 2)
+                out_y = np.empty(2 * (hi - lo), dtype=np.float64)
+                out_y[0::2] = store.column("min")[lo:hi]
+                out_y[1::2] = store.column("max")[lo:hi]
+
+                # Samples after the last complete bucket are summarized by one more bucket and the newest sample
+                covered = len(store) * self._factor ** (level + 1)
+                if hi == len(level_x) and covered < len(x):
+                    tail = y[covered:]
+                    out_x = np.concatenate((out_x, [x[covered], x[covered], x[-1]]))
+                    out_y = np.concatenate((out_y, [tail.min(), tail.max(), y[-1]]))
+
+                return out_x, out_y
+
+        return x[lo:hi], y[lo:hi]
+
+    @staticmethod
+    def _range(x, x0, x1):
+        lo = max(int(np.searchsorted(x, x0, side='left')) - 1, 0)
+        hi = min(int(np.searchsorted(x, x1, side='right')) + 1, len(x))
+        return lo, hi
+
+
+class HistoryStore:
+    """ Complete history of a sensor with one min/max pyramid per plotted column
+    """
+
+    def __init__(self, columns, x_column="time"):
+        self._x_column = x_column
+        self._store = GrowableColumnStore([x_column] + list(columns))
+        self._pyramids = dict()
+        for name in columns:
+            self._pyramids[name] = MinMaxPyramid()
+
+    def __len__(self):
+        return len(self._store)
+
+    def reset(self):
+        self._store.reset()
+        for pyramid in self._pyramids.values():
+            pyramid.reset()
+
+    def append(self, records):
+        self._store.append(records)
+
+        x = self._store.column(self._x_column)
+        for name, pyramid in self._pyramids.items():
+            pyramid.update(x, self._store.column(name))
+
+    def x_range(self):
+        x = self._store.column(self._x_column)
+        if len(x) == 0:
+            return 0, 0
+
+        return x[0], x[-1]
+
+    def render(self, column, x0, x1, max_points):
+        return self._pyramids[column].render(self._store.column(self._x_column), self._store.column(column), x0, x1,
+                                             max_points)
@@ -0,0 +1,246 @@
+import time
+import logging
+import threading
+import concurrent.futures
+
+import serial
+from serial.tools import list_ports
+
+# Start discovery logger
+logger = logging.getLogger('PC.PORTS')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# PORT DISCOVERY                               #
+#                                              #
+# - Finds the serial ports of the boards and   #
+#   watches for plugged/unplugged devices      #
+#                                              #
+################################################
+
+# The ports are enumerated from the OS metadata (serial.tools.list_ports), no port is opened for that. Only USB
+# ports (the EV-KIT and the STM32 boards enumerate as USB CDC/FTDI devices) are probed, in parallel and with a short
+# timeout, to check that they can be opened. Probe results are cached by VID/PID/serial number, a board is only
+# probed again once it was unplugged or the cache is invalidated.
+#
+# Ports which the application holds open (acquire/release) are never probed and not listed as available. Releasing a
+# port invalidates its cache entry and triggers a rescan, so the port is offered again right after a disconnect.
+
+
+def port_key(info):
+    """ Identity of a port which survives re-plugging (the device name might change)
+    """
+
+    if info.vid is None:
+        return info.device
+
+    return "{:04X}:{:04X}:{}".format(info.vid, info.pid, info.serial_number or info.location or info.device)
+
+
+def is_candidate(info):
+    """ Whether a port can be a TMOS board (USB serial device)
+    """
+
+    return info.vid is not None
+
+
+def probe_port(device, timeout=0.2):
+    """ Check that a port can be opened
+
+        :returns:
+            True if the port is available
+    """
+
+    try:
+        s = serial.Serial(timeout=timeout, write_timeout=timeout)
+        s.port = device
+
+        # Opening asserts DTR/RTS by default, which resets boards with an auto-reset circuit
+        s.dtr = False
+        s.rts = False
+
+        s.open()
+        s.close()
+    except (OSError, ValueError, serial.SerialException):
+        return False
+
+    return True
+
+
+class PortDiscovery:
+    """ Cached, parallel discovery of the available serial ports
+    """
+
+    def __init__(self, max_workers=8, probe_timeout=0.2, include_all=False):
+        """
+            :param include_all:
+                Probe every port the OS lists, not only USB ports
+        """
+
+        self._max_workers = max_workers
+        self._probe_timeout = probe_timeout
+        self._include_all = include_all
+
+        # port key -> {"device": ..., "available": ...}
+        self._cache = dict()
+        self._lock = threading.Lock()
+
+        # Devices opened by the application, and a counter of their changes (see HotplugWatcher)
+        self._in_use = set()
+        self._in_use_changes = 0
+
+    def snapshot(self):
+        """ The candidate ports currently listed by the OS (cheap, no port is opened)
+
+            :returns:
+                Dictionary of port key -> device name
+        """
+
+        ports = dict()
+        for info in list_ports.comports():
+            if self._include_all or is_candidate(info):
+                ports[port_key(info)] = info.device
+
+        return ports
+
+    def scan(self):
+        """ Enumerate the ports and probe the ones which are not cached yet
+
+            :returns:
+                Sorted list of the available device names
+        """
+
+        t0 = time.monotonic()
+        ports = self.snapshot()
+
+        with self._lock:
+            # Forget unplugged devices
+            for key in [k for k in self._cache if k not in ports]:
+                del self._cache[key]
+
+            to_probe = [(key, device) for key, device in ports.items() if device not in self._in_use and
+                        (key not in self._cache or self._cache[key]["device"] != device)]
+
+        if to_probe:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(self._max_workers, len(to_probe))) as pool:
+                results = list(pool.map(lambda p: probe_port(p[1], self._probe_timeout), to_probe))
+
+            with self._lock:
+                for (key, device), available in zip(to_probe, results):
+                    self._cache[key] = dict({"device": device, "available": available})
+
+        with self._lock:
+            available = sorted(entry["device"] for entry in self._cache.values()
+                               if entry["available"] and entry["device"] not in self._in_use)
+
+        logger.debug("Found {} ports ({} probed) in {:.0f} ms".format(len(available), len(to_probe),
+                                                                      (time.monotonic() - t0) * 1000))
+        return available
+
+    def acquire(self, device):
+        """ The application opened a port: don't probe or offer it any more. Thread safe
+        """
+
+        with self._lock:
+            self._in_use.add(device)
+            self._in_use_changes += 1
+
+    def release(self, device):
+        """ The application closed a port (or lost it): probe it again at the next scan. Thread safe
+        """
+
+        with self._lock:
+            if device not in self._in_use:
+                return
+
+            self._in_use.discard(device)
+            self._in_use_changes += 1
+            for key in [k for k, entry in self._cache.items() if entry["device"] == device]:
+                del self._cache[key]
+
+    def get_in_use_changes(self):
+        return self._in_use_changes
+
+    def invalidate(self, key=None):
+        """ Probe a port (or all ports) again at the next scan
+        """
+
+        with self._lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+
+class HotplugWatcher:
+    """ Background thread which rescans the ports whenever a device is plugged or unplugged, or a port was opened
+        or closed by the application
+
+        The OS port list is polled every interval (no port is opened while nothing changes); the callback is called
+        from the watcher thread with the list of available ports
+    """
+
+    def __init__(self, discovery, callback, interval=1.0):
+        self._discovery = discovery
+        self._callback = callback
+        self._interval = interval
+
+        self._refresh = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._refresh.set()  # Initial scan
+        self._thread = threading.Thread(target=self._run, name='port_watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+
+        self._running = False
+        self._refresh.set()
+        self._thread.join()
+        self._thread = None
+
+    def refresh(self, invalidate=True):
+        """ Rescan now (e.g. refresh button). Thread safe
+        """
+
+        if invalidate:
+            self._discovery.invalidate()
+        self._refresh.set()
+
+    def _run(self):
+        last = None
+        while self._running:
+            forced = self._refresh.wait(self._interval)
+            self._refresh.clear()
+            if not self._running:
+                break
+
+            try:
+                current = (self._discovery.snapshot(), self._discovery.get_in_use_changes())
+                if forced or current != last:
+                    last = current
+                    self._callback(self._discovery.scan())
+            except Exception:
+                logger.exception("Port scan failed")
+
+
+# Discovery shared by the application
+_shared_discovery = None
+
+
+def get_shared_discovery():
+    global _shared_discovery
+
+    if _shared_discovery is None:
+        _shared_discovery = PortDiscovery()
+
+    return _shared_discovery
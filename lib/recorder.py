@@ -0,0 +1,483 @@
+import os
+import sys
+import json
+import time
+import struct
+import logging
+import datetime
+
+import numpy as np
+
+# Start recorder logger
+logger = logging.getLogger('PC.RECORDER')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# COLUMNAR RECORDER                            #
+#                                              #
+# - Writes samples into typed, preallocated    #
+#   chunks of a binary recording file          #
+#                                              #
+################################################
+
+# Layout of a recording file:
+#
+#   MAGIC | uint32 header length | header (JSON)
+#   chunk | chunk | ...
+#
+# Every chunk starts with a 4 byte tag, a uint16 stream id and a uint32 payload length:
+#
+#   STRM: declares a new stream, the payload is a JSON object {"name": ..., "dtype": ...}
+#   DATA: raw rows of the stream dtype (little-endian, packed)
+#   META: JSON object that is merged into the recording metadata
+#
+# A file which was not closed properly (crash, power loss) can still be loaded up to the last complete chunk.
+
+MAGIC = b'TMOSREC\x01'
+FORMAT_VERSION = 1
+
+CHUNK_HEADER = struct.Struct('<4sHI')
+HEADER_LENGTH = struct.Struct('<I')
+
+TAG_STREAM = b'STRM'
+TAG_DATA = b'DATA'
+TAG_META = b'META'
+
+RECORD_EXTENSION = ".rec"
+
+# Row layout of the samples of every device type
+SAMPLE_DTYPES = {
+    'tmos': np.dtype([('time', '<i8'), ('dev_id', '<i4'), ('in_time', '<i8'), ('dist_raw', '<f4'), ('temp', '<f4'),
+                      ('dist_filt', '<f4'), ('vel', '<f4'), ('bin_1', 'u1'), ('bin_2', 'u1'), ('rx_time', '<i8')]),
+    'vicon': np.dtype([('time', '<i8'), ('frame', '<i8'), ('latency', '<f4'), ('subject', 'S32'), ('segment', 'S32'),
+                       ('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('qx', '<f8'), ('qy', '<f8'), ('qz', '<f8'),
+                       ('qw', '<f8'), ('occluded', 'u1'), ('rx_time', '<i8')])
+}
+
+# Additional streams of the Vicon recordings, only written if enabled in the stream profile (lib/vicon_interface.py).
+# The markers of a frame are variable length: 'marker_frames' has one row per frame with the number of labeled and
+# unlabeled markers, the rows of all frames are stored back to back in 'markers' and 'unlabeled_markers'
+# (see Recording.get_frame_offsets). Labeled markers refer to 'marker_labels' by index.
+VICON_STREAM_DTYPES = {
+    'marker_frames': np.dtype([('frame', '<i8'), ('time', '<i8'), ('markers', '<u4'), ('unlabeled_markers', '<u4')]),
+    'markers': np.dtype([('label', '<u2'), ('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('occluded', 'u1')]),
+    'marker_labels': np.dtype([('label', '<u2'), ('subject', 'S32'), ('marker', 'S32'), ('segment', 'S32')]),
+    'unlabeled_markers': np.dtype([('trajectory', '<u4'), ('x', '<f8'), ('y', '<f8'), ('z', '<f8')])
+}
+
+
+def dtype_to_json(dtype):
+    return [list(field) for field in dtype.descr]
+
+
+def dtype_from_json(descr):
+    return np.dtype([tuple(field) for field in descr])
+
+
+def parse_rows(rows, dtype):
+    """ Convert comma separated text rows into a structured array
+
+        Rows without the receive time (written before it was recorded, e.g. piped into the plotter) are accepted,
+        their rx_time is 0
+
+        :returns:
+            Structured array of the given dtype. Rows with the wrong number of fields or with values which
+            can't be converted are skipped
+    """
+
+    n_fields = len(dtype.names)
+    split_rows = [r.split(',') for r in rows]
+
+    if dtype.names[-1] == 'rx_time':
+        split_rows = [r + ['0'] if len(r) == n_fields - 1 else r for r in split_rows]
+    split_rows = [r for r in split_rows if len(r) == n_fields]
+
+    if len(split_rows) != len(rows):
+        logger.warning("Skipped {} malformed rows (expected {} fields)".format(len(rows) - len(split_rows), n_fields))
+
+    try:
+        return _columns_to_array(split_rows, dtype)
+    except ValueError:
+        pass
+
+    # Slow path, convert row by row and skip the ones that fail
+    valid_rows = []
+    for r in split_rows:
+        try:
+            _columns_to_array([r], dtype)
+            valid_rows.append(r)
+        except ValueError:
+            logger.debug("Could not convert row {}".format(r))
+
+    logger.warning("Skipped {} rows with invalid values".format(len(split_rows) - len(valid_rows)))
+    return _columns_to_array(valid_rows, dtype)
+
+
+def _columns_to_array(split_rows, dtype):
+    out = np.empty(len(split_rows), dtype=dtype)
+    if not split_rows:
+        return out
+
+    for name, column in zip(dtype.names, zip(*split_rows)):
+        field_type = dtype.fields[name][0]
+        if field_type.kind in 'SU':
+            out[name] = np.asarray(column, dtype=field_type)
+        else:
+            out[name] = np.asarray(column, dtype=np.float64)
+
+    return out
+
+
+class ColumnarRecorder:
+    """ Binary columnar recorder
+
+        Rows are copied into a preallocated chunk per stream and written to the file in blocks, either when the
+        chunk is full, when the flush interval elapsed or when the recorder is flushed/closed. With a flush interval
+        of None the file is only flushed explicitly
+    """
+
+    def __init__(self, filename, streams=None, metadata=None, chunk_rows=4096, flush_interval=1.0):
+        self._filename = filename
+        self._chunk_rows = chunk_rows
+        self._flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+        self._streams = dict()
+
+        self._file = open(filename, 'wb')
+
+        header = dict({"version": FORMAT_VERSION, "metadata": dict() if metadata is None else metadata})
+        header_bytes = json.dumps(header).encode('utf-8')
+        self._file.write(MAGIC + HEADER_LENGTH.pack(len(header_bytes)) + header_bytes)
+
+        for name, dtype in (streams or dict()).items():
+            self.add_stream(name, dtype)
+
+    def get_filename(self):
+        return self._filename
+
+    def get_dtype(self, stream='samples'):
+        return self._streams[stream]["dtype"]
+
+    def has_stream(self, stream):
+        return stream in self._streams
+
+    def is_closed(self):
+        return self._file is None
+
+    def add_stream(self, name, dtype):
+        """ Declare a new stream. Streams can be added at any time
+
+            :returns:
+                The id of the stream
+        """
+
+        if name in self._streams:
+            return self._streams[name]["id"]
+
+        dtype = np.dtype(dtype)
+        stream_id = len(self._streams)
+        self._streams[name] = dict({"id": stream_id, "dtype": dtype, "buffer": np.empty(self._chunk_rows, dtype=dtype),
+                                    "count": 0})
+
+        payload = json.dumps(dict({"name": name, "dtype": dtype_to_json(dtype)})).encode('utf-8')
+        self._write_chunk(TAG_STREAM, stream_id, payload)
+
+        return stream_id
+
+    def append(self, rows, stream='samples'):
+        """ Append a structured array (or a single row) to a stream
+        """
+
+        if self._file is None:
+            return
+
+        cur_stream = self._streams[stream]
+        rows = np.atleast_1d(np.asarray(rows, dtype=cur_stream["dtype"]))
+
+        buffer = cur_stream["buffer"]
+        n = len(rows)
+        pos = 0
+        while pos < n:
+            count = cur_stream["count"]
+            take = min(self._chunk_rows - count, n - pos)
+            buffer[count:count + take] = rows[pos:pos + take]
+            cur_stream["count"] = count + take
+            pos += take
+
+            if cur_stream["count"] == self._chunk_rows:
+                self._write_stream(cur_stream)
+
+        if self._flush_interval is not None and time.monotonic() - self._last_flush > self._flush_interval:
+            self.flush()
+
+    def update_metadata(self, metadata):
+        """ Add or overwrite metadata entries of the recording
+        """
+
+        if self._file is None:
+            return
+
+        self._write_chunk(TAG_META, 0, json.dumps(metadata).encode('utf-8'))
+
+    def flush(self):
+        if self._file is None:
+            return
+
+        for cur_stream in self._streams.values():
+            self._write_stream(cur_stream)
+
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def sync(self):
+        """ Force the flushed data to the disk
+        """
+
+        if self._file is None:
+            return
+
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def _write_stream(self, cur_stream):
+        count = cur_stream["count"]
+        if count == 0:
+            return
+
+        self._write_chunk(TAG_DATA, cur_stream["id"], cur_stream["buffer"][:count].tobytes())
+        cur_stream["count"] = 0
+
+    def _write_chunk(self, tag, stream_id, payload):
+        self._file.write(CHUNK_HEADER.pack(tag, stream_id, len(payload)))
+        self._file.write(payload)
+
+
+class Recording:
+    """ A recording loaded into memory
+    """
+
+    def __init__(self, metadata, streams):
+        self.metadata = metadata
+        self.streams = streams
+
+    def __getitem__(self, stream):
+        return self.streams[stream]
+
+    def get_frame_offsets(self, stream, frames='marker_frames'):
+        """ Offsets of the rows of every frame in a variable length stream (markers, unlabeled_markers)
+
+            :returns:
+                Array with one entry more than frames, the rows of frame i are stream[offsets[i]:offsets[i + 1]]
+            :raises ValueError:
+                If the counts of the frames don't match the rows of the stream (blocks dropped while recording)
+        """
+
+        offsets = np.zeros(len(self.streams[frames]) + 1, dtype=np.int64)
+        np.cumsum(self.streams[frames][stream], out=offsets[1:])
+
+        if offsets[-1] != len(self.streams[stream]):
+            raise ValueError("{} frames count {} rows of '{}', the recording has {}".format(
+                len(self.streams[frames]), offsets[-1], stream, len(self.streams[stream])))
+
+        return offsets
+
+    def get_marker_labels(self):
+        """ :returns:
+                Dictionary of label -> (subject, marker, segment)
+        """
+
+        return {int(r['label']): (r['subject'].decode(), r['marker'].decode(), r['segment'].decode())
+                for r in self.streams.get('marker_labels', [])}
+
+
+def read_header(fh):
+    """ Read and validate the header of an opened recording
+
+        :raises ValueError:
+            If the file is not a recording
+        :returns:
+            The header dictionary
+    """
+
+    magic = fh.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError("Not a TMOS recording (wrong magic)")
+
+    header_length, = HEADER_LENGTH.unpack(fh.read(HEADER_LENGTH.size))
+    return json.loads(fh.read(header_length).decode('utf-8'))
+
+
+def iter_chunks(filename, metadata=None):
+    """ Iterate over the data chunks of a recording without loading the whole file
+
+        :returns:
+            Generator of (stream name, structured array) tuples. If a metadata dictionary is given, it is updated
+            with the header metadata and every metadata chunk on the way
+    """
+
+    streams_by_id = dict()
+
+    with open(filename, 'rb') as fh:
+        header = read_header(fh)
+        if metadata is not None:
+            metadata.update(header["metadata"])
+
+        while True:
+            chunk_header = fh.read(CHUNK_HEADER.size)
+            if len(chunk_header) < CHUNK_HEADER.size:
+                break
+
+            tag, stream_id, length = CHUNK_HEADER.unpack(chunk_header)
+            payload = fh.read(length)
+            if len(payload) < length:
+                logger.warning("Truncated chunk at the end of {}".format(filename))
+                break
+
+            if tag == TAG_STREAM:
+                stream = json.loads(payload.decode('utf-8'))
+                streams_by_id[stream_id] = (stream["name"], dtype_from_json(stream["dtype"]))
+            elif tag == TAG_DATA:
+                name, dtype = streams_by_id[stream_id]
+                yield name, np.frombuffer(payload, dtype=dtype)
+            elif tag == TAG_META:
+                if metadata is not None:
+                    metadata.update(json.loads(payload.decode('utf-8')))
+            else:
+                logger.warning("Unknown chunk '{}' in {}. Skipping".format(tag, filename))
+
+
+def read_stream_dtypes(filename):
+    """ Scan a recording for its declared streams
+
+        :returns:
+            Dictionary of stream name -> dtype
+    """
+
+    dtypes = dict()
+
+    with open(filename, 'rb') as fh:
+        read_header(fh)
+
+        while True:
+            chunk_header = fh.read(CHUNK_HEADER.size)
+            if len(chunk_header) < CHUNK_HEADER.size:
+                break
+
+            tag, stream_id, length = CHUNK_HEADER.unpack(chunk_header)
+            if tag == TAG_STREAM:
+                stream = json.loads(fh.read(length).decode('utf-8'))
+                dtypes[stream["name"]] = dtype_from_json(stream["dtype"])
+            else:
+                fh.seek(length, 1)
+
+    return dtypes
+
+
+def read_metadata(filename):
+    """ Metadata of a recording (header and metadata chunks), without reading the data chunks
+
+        :returns:
+            Metadata dictionary
+    """
+
+    metadata = dict()
+
+    with open(filename, 'rb') as fh:
+        metadata.update(read_header(fh)["metadata"])
+
+        while True:
+            chunk_header = fh.read(CHUNK_HEADER.size)
+            if len(chunk_header) < CHUNK_HEADER.size:
+                break
+
+            tag, stream_id, length = CHUNK_HEADER.unpack(chunk_header)
+            if tag == TAG_META:
+                payload = fh.read(length)
+                if len(payload) < length:
+                    break
+                metadata.update(json.loads(payload.decode('utf-8')))
+            else:
+                fh.seek(length, 1)
+
+    return metadata
+
+
+def load_recording(filename):
+    """ Load a complete recording
+
+        :returns:
+            Recording object with the metadata and one structured array per stream
+    """
+
+    metadata = dict()
+    blocks = dict()
+    for name, data in iter_chunks(filename, metadata):
+        blocks.setdefault(name, []).append(data)
+
+    streams = dict()
+    for name, dtype in read_stream_dtypes(filename).items():
+        streams[name] = np.concatenate(blocks[name]) if name in blocks else np.empty(0, dtype=dtype)
+
+    return Recording(metadata, streams)
+
+
+def rows_to_text(data):
+    """ Format a structured array as comma separated text rows (the format of the old .log files)
+
+        :returns:
+            List of strings
+    """
+
+    columns = []
+    for name in data.dtype.names:
+        col = data[name]
+        if col.dtype.kind == 'S':
+            columns.append([v.decode('ascii', 'replace') for v in col])
+        else:
+            columns.append(col.astype(str))
+
+    return [','.join(r) for r in zip(*columns)]
+
+
+def export_log(rec_filename, log_filename, stream='samples'):
+    """ Export a stream of a recording to a text log (one comma separated row per line)
+
+        :returns:
+            Number of exported rows
+    """
+
+    n = 0
+    with open(log_filename, 'w') as fh:
+        for name, data in iter_chunks(rec_filename):
+            if name != stream:
+                continue
+
+            lines = rows_to_text(data)
+            if lines:
+                fh.write('\n'.join(lines) + '\n')
+            n += len(lines)
+
+    return n
+
+
+def create_metadata(exp_name, title, kind):
+    return dict({"experiment": exp_name, "title": title, "kind": kind,
+                 "created": datetime.datetime.now().isoformat()})
+
+
+if __name__ == '__main__':
+    # Export recordings to text logs: python -m lib.recorder output/EXPERIMENT_0_SENSOR_1.rec [...]
+    logging.basicConfig()
+
+    for rec_file in sys.argv[1:]:
+        log_file = rec_file[:-len(RECORD_EXTENSION)] + ".log" if rec_file.endswith(RECORD_EXTENSION) else rec_file + ".log"
+        print("{} -> {} ({} rows)".format(rec_file, log_file, export_log(rec_file, log_file)))
@@ -1,11 +1,15 @@
-import sys
-import glob
 import time
 import serial
 import logging
-import datetime
 
+from lib import ascii_protocol
+from lib import binary_protocol
+from lib import port_discovery
+from lib.serial_reader import SerialReader
+from lib.continuity import ContinuityTracker
+from lib.timestamping import ClockSync, elapsed_ms
 from lib.template import GlobalInterface
+from lib.template.SampleBatch import SampleBatch
 
 # Start serial logger - Global logger, since there are multiple instances of the SerialInterface class
 logger = logging.getLogger('PC.COMM')
@@ -29,6 +33,18 @@ class SerialInterface(GlobalInterface.GlobalInterface):
         'stm32': 1
     }
 
+    # Format of the sample stream
+    PROTOCOL = {
+        'ascii': 0,
+        'binary': 1
+    }
+
+    # Sample fields sent by the board (ASCII columns 1 to 8, binary frame fields)
+    BOARD_FIELDS = ['dev_id', 'in_time', 'dist_raw', 'temp', 'dist_filt', 'vel', 'bin_1', 'bin_2']
+
+    # Device time (in_time, ms) between two samples of a sensor per mode (SLOW 8 Hz, FAST 32 Hz)
+    SAMPLE_PERIOD = [125.0, 31.25]
+
     def __init__(self, mode=0):
         super(SerialInterface, self).__init__(mode)
 
@@ -38,6 +54,22 @@ class SerialInterface(GlobalInterface.GlobalInterface):
 
         self.device_type = self.BOARD_TYPE['ev_kit']
 
+        # Binary frames are negotiated with STM32 boards, the EV-KIT always uses ASCII
+        self._binary_requested = True
+        self.protocol = self.PROTOCOL['ascii']
+
+        # Bulk reader. process_data blocks at most this long (seconds) while waiting for data
+        self._reader = SerialReader()
+        self._wait_timeout = 0.05
+
+        # Maps the device local time (in_time) to host time
+        self._clock = ClockSync()
+
+        # Detects lost, duplicated and reordered samples from the device time
+        self._continuity = ContinuityTracker(self.SAMPLE_PERIOD[self._mode])
+
+        self._batch = SampleBatch('tmos')
+
     def open_port(self, port):
         """ Opens a port
 
@@ -46,8 +78,10 @@ class SerialInterface(GlobalInterface.GlobalInterface):
         """
 
         self._port = port
+        self._timings = dict()
         try:
             logger.debug("Opening %s", str(port))
+            t0 = time.monotonic()
             self._comm = serial.Serial(baudrate=self._baudraute, port=self._port, timeout=self._timeout,
                                        parity=self._parity, stopbits=self._stop_bits)
             if not self._comm.isOpen():
@@ -56,8 +90,12 @@ class SerialInterface(GlobalInterface.GlobalInterface):
             logger.debug("MCU connected!")
 
             self._comm.reset_input_buffer()  # flush buffer
+            self._reader.attach(self._comm)
+            t0 = self._mark_timing('open', t0)
             self.identify_board()
+            t0 = self._mark_timing('identify', t0)
             self.stop_device()
+            self._mark_timing('stop', t0)
 
         except serial.SerialException:
             self._comm = None
@@ -89,6 +127,7 @@ class SerialInterface(GlobalInterface.GlobalInterface):
             if (self.wait_for_text_timeout("OK", 1000)):
                 self.device_type = self.BOARD_TYPE["stm32"]
                 logger.info("STM32 Connected")
+                self.negotiate_protocol()
             else:
                 self._comm.write(b'\r\n')
                 self.device_type = self.BOARD_TYPE["ev_kit"]
@@ -100,6 +139,36 @@ class SerialInterface(GlobalInterface.GlobalInterface):
 
         return True
 
+    def negotiate_protocol(self):
+        """ Switch STM32 boards to binary frames. Boards which don't acknowledge keep sending ASCII lines
+
+            :returns:
+                The protocol in use [PROTOCOL]
+        """
+
+        self.protocol = self.PROTOCOL['ascii']
+
+        if self.device_type != self.BOARD_TYPE["stm32"] or not self._binary_requested:
+            return self.protocol
+
+        self._comm.write(binary_protocol.BINARY_MODE_COMMAND)
+        if self.wait_for_text_timeout("OK", 200):
+            self.protocol = self.PROTOCOL['binary']
+            logger.info("Binary frame protocol enabled")
+        else:
+            logger.info("Binary frames not supported by firmware. Using ASCII")
+
+        return self.protocol
+
+    def get_fd(self):
+        if not self.is_connected():
+            return None
+
+        return self._reader.get_fd()
+
+    def set_binary_requested(self, requested):
+        self._binary_requested = requested
+
     def stop_device(self):
         """ Stop reading
 
@@ -113,11 +182,16 @@ class SerialInterface(GlobalInterface.GlobalInterface):
             logger.debug("Stopping device")
             if self.device_type == self.BOARD_TYPE["stm32"]:
                 self._comm.write(b'p')
-                if not self.wait_for_text_timeout("OK", 500):
+                if self.protocol == self.PROTOCOL['binary']:
+                    # The acknowledge arrives after the last binary frames
+                    if not self.wait_for_bytes_timeout(b'OK\r\n', 500):
+                        return False
+                elif not self.wait_for_text_timeout("OK", 500):
                     return False
             else:
                 self._comm.write(b'STOP\r\n')  # Stop any ongoing reading
             self._comm.reset_input_buffer()  # flush buffer
+            self._reader.clear()
 
         except serial.SerialException:
             self._comm = None
@@ -133,13 +207,25 @@ class SerialInterface(GlobalInterface.GlobalInterface):
                 Returns true if it is connected
         """
 
+        return self.prepare_start() and self.trigger_start()
+
+    def prepare_start(self):
+        """ First part of the start: stop and reset the device (and connect the EV-KIT), so that only the start command
+            is left
+
+            :returns:
+                True if the device is ready to be started
+        """
+
         if not self.is_connected():
             return False
 
         try:
             logger.debug("Stopping and resetting device")
+            t0 = time.monotonic()
             if not self.stop_device():
                 return False
+            t0 = self._mark_timing('stop', t0)
 
             # Connect only for the case of the ev-kit
             if self.device_type == self.BOARD_TYPE["ev_kit"]:
@@ -151,6 +237,27 @@ class SerialInterface(GlobalInterface.GlobalInterface):
                 if not (self.wait_for_text_timeout("CONNECTED ", 3000) and self.wait_for_text_timeout(">", 3000)):
                     logger.error("Could not connect to board")
                     return False
+                self._mark_timing('connect', t0)
+
+        except serial.SerialException:
+            self._comm = None
+            # self.emit_error_signal()
+            return False
+
+        return True
+
+    def trigger_start(self):
+        """ Second part of the start: send the start command and wait for its acknowledge
+
+            :returns:
+                True if the device started
+        """
+
+        if not self.is_connected():
+            return False
+
+        try:
+            t0 = time.monotonic()
 
             # Send START command
             logger.debug("Start sensor reading [MODE " + str(self._mode) + " - " + ("SLOW", "FAST")[self._mode] + "]")
@@ -166,8 +273,13 @@ class SerialInterface(GlobalInterface.GlobalInterface):
                     logger.error("Could not start reading")
                     return False
 
+            self._mark_timing('start', t0)
             logger.debug("Initialization complete!")
 
+            # The device time restarts with the measurement
+            self._clock.reset()
+            self._continuity.reset()
+
             # time.sleep(1)
 
         except serial.SerialException:
@@ -177,6 +289,17 @@ class SerialInterface(GlobalInterface.GlobalInterface):
 
         return True
 
+    def _mark_timing(self, phase, t0):
+        """ Store the duration (ms) of a handshake phase which started at t0 (time.monotonic())
+
+            :returns:
+                The current time, the start of the next phase
+        """
+
+        t = time.monotonic()
+        self._timings[phase] = round((t - t0) * 1000, 1)
+        return t
+
     def close_port(self):
         """ Closes a port
 
@@ -184,6 +307,9 @@ class SerialInterface(GlobalInterface.GlobalInterface):
                 Returns true port was successfully closed
         """
 
+        self.protocol = self.PROTOCOL['ascii']
+        self._reader.attach(None)
+
         if self.is_connected():
             try:
                 self._comm.close()
@@ -198,52 +324,158 @@ class SerialInterface(GlobalInterface.GlobalInterface):
         """ Process the data received from the MCU
 
             :returns:
-                Returns true data was successfully processed
+                SampleBatch with the received samples or -1 on a lost connection
         """
 
         if not self.is_connected():
             return -1
 
-        log_text = ''
+        self._batch.clear()
+
+        if self.protocol == self.PROTOCOL['binary']:
+            return self.process_frames()
+
         try:
-            recv = self.read_text()
-            while recv != '':
+            if not self._reader.has_line():
+                self._reader.wait_readable(self._wait_timeout)
+            self._reader.fill()
+            rx_time = time.monotonic_ns()
+
+            # A trailing partial line stays in the reader until its line end arrives
+            lines = self._reader.pop_lines()
+
+        except serial.SerialException:
+            self._comm = None
+            self.emit_error_signal()
+            return -1
 
-                list_data = recv.split('\t')  # Data separated by tabs
-                n = len(list_data)  # Number of elements
+        if logger.isEnabledFor(logging.DEBUG):
+            for line in lines:
+                logger.debug("Received {}".format(line.decode("ascii", "replace")))
 
-                # We always receive 10 data elements
-                if n != 10:
-                    logger.debug("Wrong data received! Skipping [{}]".format(n))
-                    return ''
+        # Bad lines are skipped, the good samples of the same read are kept
+        values, malformed, truncated, undecodable, recovered = ascii_protocol.parse_lines(lines)
+        if malformed or truncated or undecodable:
+            logger.debug("Skipped {} malformed, {} truncated and {} undecodable lines".format(malformed, truncated,
+                                                                                           undecodable))
+            self._metrics.count('lines_malformed', malformed)
+            self._metrics.count('lines_truncated', truncated)
+            self._metrics.count('lines_undecodable', undecodable)
+            self._metrics.count('lines_recovered', recovered)
 
-                # list_data = list_data[1:n - 1]  # First and last elements are garbage
-                list_data = list_data[0:n - 1]
-                list_data[0] = str(int((datetime.datetime.now() - self._time_zero).total_seconds() * 1000))
+        if len(values) == 0:
+            return self._batch
 
-                log_text = log_text + ','.join(map(str, list_data)) + '\t'
+        samples = self._batch.allocate(len(values))
+        for i, name in enumerate(self.BOARD_FIELDS):
+            samples[name] = values[:, i]
 
-                recv = self.read_text()
+        # Corrected host time from the device time, the raw receive time is kept as well
+        samples['time'] = elapsed_ms(self._clock.update(samples['in_time'], rx_time), self._time_zero)
+        samples['rx_time'] = elapsed_ms(rx_time, self._time_zero)
 
+        self.check_continuity(samples)
+        self._metrics.record('read_to_parse', (time.monotonic_ns() - rx_time) // 1000)
+        return self._batch
+
+    def process_frames(self):
+        """ Decode the binary frames received from the MCU
+
+            :returns:
+                SampleBatch with the received samples (same layout as process_data) or -1 on a lost connection
+        """
+
+        try:
+            if self._reader.pending() < binary_protocol.FRAME_SIZE:
+                self._reader.wait_readable(self._wait_timeout)
+            self._reader.fill()
         except serial.SerialException:
             self._comm = None
             self.emit_error_signal()
             return -1
 
-        return log_text
+        rx_time = time.monotonic_ns()
+        frames, consumed, crc_errors, skipped = binary_protocol.decode_frames(self._reader.get_buffer())
+        self._reader.consume(consumed)
+
+        if crc_errors or skipped:
+            logger.debug("Dropped {} corrupted frames, skipped {} bytes".format(crc_errors, skipped))
+            self._metrics.count('crc_errors', crc_errors)
+            self._metrics.count('bytes_skipped', skipped)
+
+        if len(frames) == 0:
+            return self._batch
+
+        samples = self._batch.allocate(len(frames))
+        for name in self.BOARD_FIELDS:
+            samples[name] = frames[name]
+
+        samples['time'] = elapsed_ms(self._clock.update(frames['in_time'], rx_time), self._time_zero)
+        samples['rx_time'] = elapsed_ms(rx_time, self._time_zero)
+
+        self.check_continuity(samples)
+        self._metrics.record('read_to_parse', (time.monotonic_ns() - rx_time) // 1000)
+        return self._batch
+
+    def check_continuity(self, samples):
+        """ Check the device time of new samples for lost, duplicated and reordered samples
+        """
+
+        counts = self._continuity.update(samples['dev_id'], samples['in_time'], samples['time'])
+        if not (counts["gaps"] or counts["duplicates"] or counts["reordered"] or counts["restarts"]):
+            return
+
+        if counts["missing"] > 0:
+            logger.info("{} samples missing ({} in total)".format(counts["missing"],
+                                                                  self._continuity.get_counts()["missing"]))
+
+        # Late samples which filled a gap reduce the missing samples, the counters only grow
+        self._metrics.count('samples_missing', max(counts["missing"], 0))
+        self._metrics.count('samples_recovered', max(-counts["missing"], 0))
+        self._metrics.count('gaps', max(counts["gaps"], 0))
+        self._metrics.count('duplicates', counts["duplicates"])
+        self._metrics.count('reordered', counts["reordered"])
+        self._metrics.count('restarts', counts["restarts"])
+
+    def get_continuity(self):
+        return self._continuity
+
+    def set_mode(self, mode):
+        if not super(SerialInterface, self).set_mode(mode):
+            return False
 
-    def read_text(self):
+        self._continuity.set_period(self.SAMPLE_PERIOD[self._mode])
+        return True
+
+    def read_text(self, timeout=None):
         """ Receive text from serial port.
 
+            :param timeout:
+                Wait at most this long (seconds) for a complete line. Default is the port timeout
             :returns:
                 Decoded and stripped text
         """
 
-        if not self.is_connected() or not self._comm.in_waiting:
+        if not self.is_connected():
             return ''
 
+        deadline = time.monotonic() + (self._timeout if timeout is None else timeout)
         try:
-            read_string = self._comm.readline().decode('ascii').rstrip("\r\n")
+            line = self._reader.pop_line()
+            while line is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                # Blocks until data arrives (or the deadline), no polling
+                self._reader.wait_readable(remaining)
+                self._reader.fill()
+                line = self._reader.pop_line()
+
+            if line is None:
+                return ''
+
+            read_string = line.decode('ascii')
         except serial.SerialException:
             self._comm = None
             self.emit_error_signal()
@@ -256,47 +488,68 @@ class SerialInterface(GlobalInterface.GlobalInterface):
         return read_string
 
     def wait_for_text_timeout(self, txt, timeout_ms):
-        """ Wait for a specific text/pattern. Timeout given in seconds
+        """ Wait for a specific text/pattern. Timeout given in milliseconds
 
             :returns:
                 true if there was a match, false for a timeout
         """
 
-        t0 = datetime.datetime.now()
+        deadline = time.monotonic() + timeout_ms / 1000.0
+
+        while self.is_connected():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
 
-        while int((datetime.datetime.now() - t0).total_seconds() * 1000) < timeout_ms:
-            if self.read_text() == txt:
+            if self.read_text(remaining) == txt:
                 return True
 
         logger.error("Did not receive '{}'".format(txt))
         return False
 
+    def wait_for_bytes_timeout(self, pattern, timeout_ms):
+        """ Wait for a byte pattern in the raw stream (binary mode). Timeout given in milliseconds
+
+            :returns:
+                true if there was a match, false for a timeout
+        """
+
+        if not self.is_connected():
+            return False
+
+        deadline = time.monotonic() + timeout_ms / 1000.0
+
+        try:
+            while True:
+                idx = self._reader.find(pattern)
+                if idx >= 0:
+                    self._reader.consume(idx + len(pattern))
+                    return True
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                self._reader.wait_readable(remaining)
+                self._reader.fill()
+        except (serial.SerialException, AttributeError):
+            # Port lost (or closed by another thread) while waiting
+            self._comm = None
+            self.emit_error_signal()
+            return False
+
+        logger.error("Did not receive {}".format(pattern))
+        return False
+
 
 def list_available_ports():
     """ Lists serial port names
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
+        Only USB serial ports which can be opened are listed. The ports are probed in parallel and the results are
+        cached, see lib.port_discovery
+
         :returns:
             A list of the serial ports available on the system
     """
 
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
-
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
+    return port_discovery.get_shared_discovery().scan()
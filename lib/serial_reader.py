@@ -0,0 +1,176 @@
+import select
+
+import serial
+
+
+################################################
+# SERIAL READER                                #
+#                                              #
+# - Drains the serial port in bulk into a      #
+#   receive buffer and splits it into lines    #
+#                                              #
+################################################
+
+
+class SerialReader:
+    """ Bulk serial reader
+
+        Everything available on the port is read with a single read() call and appended to a receive buffer.
+        Complete lines (or frames) are taken from the front of the buffer, partial ones stay for the next call.
+        Consumed bytes are only dropped once they make up half of the buffer, so taking lines does not copy the rest
+        of the buffer every time
+    """
+
+    def __init__(self, comm=None):
+        self._comm = None
+        self._fd = None
+        self._buffer = bytearray()
+        self._start = 0
+
+        self.attach(comm)
+
+    def attach(self, comm):
+        """ Attach an opened serial port. The receive buffer is cleared
+        """
+
+        self._comm = comm
+        self._fd = None
+        self.clear()
+
+        if comm is None:
+            return
+
+        # File descriptor for select() (POSIX only, the Windows implementation has none)
+        try:
+            self._fd = comm.fileno()
+        except (AttributeError, OSError, serial.SerialException):
+            self._fd = None
+
+    def get_fd(self):
+        return self._fd
+
+    def clear(self):
+        self._buffer.clear()
+        self._start = 0
+
+    def pending(self):
+        """ Number of buffered bytes which were not consumed yet
+        """
+
+        return len(self._buffer) - self._start
+
+    def fill(self):
+        """ Read everything available on the port
+
+            :raises serial.SerialException:
+                If the port is lost
+            :returns:
+                Number of bytes read
+        """
+
+        n = self._comm.in_waiting
+        if n:
+            self._buffer += self._comm.read(n)
+
+        return n
+
+    def wait_readable(self, timeout):
+        """ Block until there is data on the port or the timeout (seconds) expired
+
+            :raises serial.SerialException:
+                If the port is lost
+            :returns:
+                true if there is data to read
+        """
+
+        if self._comm.in_waiting:
+            return True
+
+        if timeout <= 0:
+            return False
+
+        if self._fd is not None:
+            try:
+                readable, _, _ = select.select([self._fd], [], [], timeout)
+            except (OSError, ValueError):
+                raise serial.SerialException("Port not readable")
+
+            return bool(readable)
+
+        # No file descriptor (Windows): block for the first byte, with the requested timeout instead of the port's
+        port_timeout = self._comm.timeout
+        self._comm.timeout = timeout
+        try:
+            first = self._comm.read(1)
+        finally:
+            self._comm.timeout = port_timeout
+
+        if first:
+            self._buffer += first
+            return True
+
+        return False
+
+    def has_line(self):
+        return self._buffer.find(b'\n', self._start) >= 0
+
+    def pop_line(self):
+        """ Take the next complete line from the buffer
+
+            :returns:
+                The line without the line ending or None if there is no complete line
+        """
+
+        end = self._buffer.find(b'\n', self._start)
+        if end < 0:
+            return None
+
+        line = bytes(self._buffer[self._start:end]).rstrip(b'\r')
+        self.consume(end + 1 - self._start)
+
+        return line
+
+    def pop_lines(self):
+        """ Take all complete lines from the buffer. A trailing partial line is kept
+
+            :returns:
+                List of lines without line endings
+        """
+
+        end = self._buffer.rfind(b'\n', self._start)
+        if end < 0:
+            return []
+
+        lines = bytes(self._buffer[self._start:end]).split(b'\n')
+        self.consume(end + 1 - self._start)
+
+        return [line.rstrip(b'\r') for line in lines]
+
+    def find(self, pattern):
+        """ Search a pattern in the unconsumed data
+
+            :returns:
+                Offset relative to the unconsumed data or -1
+        """
+
+        idx = self._buffer.find(pattern, self._start)
+        return idx - self._start if idx >= 0 else -1
+
+    def get_buffer(self):
+        """ The unconsumed data. The returned object must not be kept after the next consume()
+        """
+
+        self._compact(force=True)
+        return self._buffer
+
+    def consume(self, n):
+        self._start += n
+        self._compact()
+
+    def _compact(self, force=False):
+        if self._start == 0:
+            return
+
+        if force or self._start >= len(self._buffer) // 2:
+            del self._buffer[:self._start]
+            self._start = 0
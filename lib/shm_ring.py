@@ -0,0 +1,187 @@
+import os
+import multiprocessing
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+################################################
+# SHARED MEMORY RING BUFFER                    #
+#                                              #
+# - Single producer ring of fixed-width        #
+#   records shared between processes           #
+#                                              #
+################################################
+
+# Layout of the shared memory block:
+#
+#   header (8 x uint64) | capacity x record
+#
+#   header[0]  write sequence (total number of records written, updated after the records)
+#   header[1]  capacity
+#   header[2]  record size (bytes)
+#   header[3]  read sequence (last sequence acknowledged by the consumer)
+#   header[4]  time of the last acknowledge (time.monotonic_ns() of the consumer)
+#
+# The producer never waits for the consumer. A consumer which falls more than `capacity` records behind loses the
+# oldest ones and is told how many.
+
+HEADER_FIELDS = 8
+HEADER_SIZE = HEADER_FIELDS * 8
+
+_WRITE_SEQ = 0
+_CAPACITY = 1
+_ITEMSIZE = 2
+_READ_SEQ = 3
+_READ_TIME = 4
+
+
+class SharedRingBuffer:
+    """ Shared memory ring buffer of structured records
+    """
+
+    def __init__(self, shm, dtype, owner):
+        self._shm = shm
+        self._owner = owner
+        self._dtype = np.dtype(dtype)
+
+        self._header = np.ndarray(HEADER_FIELDS, dtype=np.uint64, buffer=shm.buf)
+        self._capacity = int(self._header[_CAPACITY])
+
+        if int(self._header[_ITEMSIZE]) != self._dtype.itemsize:
+            raise ValueError("Record size mismatch ({} != {})".format(int(self._header[_ITEMSIZE]),
+                                                                      self._dtype.itemsize))
+
+        self._records = np.ndarray(self._capacity, dtype=self._dtype, buffer=shm.buf, offset=HEADER_SIZE)
+
+    @classmethod
+    def create(cls, name, dtype, capacity):
+        """ Create a new ring (producer side)
+        """
+
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + capacity * dtype.itemsize)
+
+        header = np.ndarray(HEADER_FIELDS, dtype=np.uint64, buffer=shm.buf)
+        header[:] = 0
+        header[_CAPACITY] = capacity
+        header[_ITEMSIZE] = dtype.itemsize
+        del header
+
+        return cls(shm, dtype, True)
+
+    @classmethod
+    def attach(cls, name, dtype):
+        """ Attach to an existing ring (consumer side)
+        """
+
+        shm = shared_memory.SharedMemory(name=name)
+
+        # The creator owns the block. Don't let the resource tracker of this process remove it at exit (processes
+        # started by multiprocessing share the tracker of their parent, the creator unregisters it there)
+        if os.name == 'posix' and multiprocessing.parent_process() is None:
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+            except (ImportError, AttributeError):
+                pass
+
+        return cls(shm, dtype, False)
+
+    def get_name(self):
+        return self._shm.name
+
+    def get_dtype(self):
+        return self._dtype
+
+    def get_capacity(self):
+        return self._capacity
+
+    def get_write_seq(self):
+        return int(self._header[_WRITE_SEQ])
+
+    def get_read_seq(self):
+        return int(self._header[_READ_SEQ])
+
+    def get_read_time(self):
+        return int(self._header[_READ_TIME])
+
+    def backlog(self):
+        """ Number of records written but not yet acknowledged by the consumer
+        """
+
+        return self.get_write_seq() - self.get_read_seq()
+
+    def write(self, rows):
+        """ Append records (producer side). No system call is involved
+        """
+
+        rows = np.atleast_1d(rows)
+        n = len(rows)
+        if n == 0:
+            return
+
+        seq = int(self._header[_WRITE_SEQ])
+        if n > self._capacity:
+            seq += n - self._capacity
+            rows = rows[n - self._capacity:]
+            n = self._capacity
+
+        start = seq % self._capacity
+        first = min(n, self._capacity - start)
+        self._records[start:start + first] = rows[:first]
+        if first < n:
+            self._records[:n - first] = rows[first:]
+
+        # Publish after the records are in place
+        self._header[_WRITE_SEQ] = seq + n
+
+    def read(self, since):
+        """ Read all records written after sequence `since` (consumer side)
+
+            :returns:
+                (records, seq, lost) - a copy of the new records, the sequence to pass to the next call and the number
+                of records which were overwritten before they could be read
+        """
+
+        seq = int(self._header[_WRITE_SEQ])
+        lost = 0
+        if seq - since > self._capacity:
+            lost = seq - self._capacity - since
+            since = seq - self._capacity
+
+        start = since % self._capacity
+        n = seq - since
+        first = min(n, self._capacity - start)
+        if first < n:
+            rows = np.concatenate((self._records[start:], self._records[:n - first]))
+        else:
+            rows = self._records[start:start + n].copy()
+
+        # Records overwritten while copying are dropped
+        overwritten = min(int(self._header[_WRITE_SEQ]) - self._capacity - since, n)
+        if overwritten > 0:
+            rows = rows[overwritten:]
+            lost += overwritten
+
+        return rows, seq, lost
+
+    def acknowledge(self, seq, time_ns=0):
+        """ Publish the read position of the consumer (used to monitor the backlog)
+        """
+
+        self._header[_READ_SEQ] = seq
+        self._header[_READ_TIME] = time_ns
+
+    def close(self):
+        if self._shm is None:
+            return
+
+        del self._header
+        del self._records
+
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+        self._shm = None
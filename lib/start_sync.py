@@ -0,0 +1,124 @@
+import time
+import threading
+
+
+################################################
+# SYNCHRONIZED START                           #
+#                                              #
+# - Releases the start command of all devices  #
+#   at the same instant                        #
+#                                              #
+################################################
+
+# Every device first prepares its start (stop, connect handshake) on its own thread, then waits at a barrier. Once
+# all devices are prepared they are released together and send their start command. The instant each device sent
+# its command is collected; the skew of a device is its distance to the earliest one.
+#
+# Devices which run in their own processes share the coordinator through a multiprocessing manager: the barriers,
+# the lock and the results are then proxies of objects in the manager process, which can be passed to a running
+# process (see lib/device_process.py).
+
+
+class StartCoordinator:
+    """ Barrier and skew bookkeeping of one synchronized start
+    """
+
+    def __init__(self, parties, timeout=10.0, t0=None, manager=None):
+        """
+            :param parties:
+                Number of devices which take part (every one of them has to call release and finish)
+            :param timeout:
+                Maximum time (seconds) to wait for the other devices
+            :param t0:
+                Reference time of the recording (time.monotonic_ns()), the reported times are relative to it
+            :param manager:
+                Started multiprocessing manager, if the devices run in different processes
+        """
+
+        self._t0 = time.monotonic_ns() if t0 is None else t0
+
+        sync = threading if manager is None else manager
+        self._release = sync.Barrier(parties, timeout=timeout)
+        self._finish = sync.Barrier(parties, timeout=timeout)
+
+        self._lock = sync.Lock()
+        self._results = dict() if manager is None else manager.dict()
+
+    def get_reference_time(self):
+        return self._t0
+
+    def release(self, title, ready):
+        """ Wait until all devices are prepared
+
+            :param ready:
+                Whether this device is prepared. A device which is not still has to wait (it doesn't start)
+            :returns:
+                True if the device should send its start command now
+        """
+
+        try:
+            self._release.wait()
+        except threading.BrokenBarrierError:
+            return False
+
+        return ready
+
+    def report(self, title, success, sent_ns=None, ack_ns=None):
+        """ Record when the start command was sent and acknowledged (time.monotonic_ns())
+        """
+
+        with self._lock:
+            self._results[title] = dict({"success": success, "sent": sent_ns, "ack": ack_ns})
+
+    def finish(self, title):
+        """ Wait until all devices reported
+
+            :returns:
+                Start summary of the device (times in ms relative to the reference time)
+        """
+
+        try:
+            self._finish.wait()
+        except threading.BrokenBarrierError:
+            pass
+
+        with self._lock:
+            result = self._results.get(title, dict({"success": False, "sent": None, "ack": None}))
+            sent = [r["sent"] for r in self._results.values() if r["success"] and r["sent"] is not None]
+
+        summary = dict({"synchronized": True, "devices": len(sent)})
+        if result["success"] and result["sent"] is not None:
+            summary["sent_ms"] = round((result["sent"] - self._t0) / 1e6, 3)
+            summary["ack_ms"] = round((result["ack"] - self._t0) / 1e6, 3)
+            summary["skew_ms"] = round((result["sent"] - min(sent)) / 1e6, 3)
+            summary["max_skew_ms"] = round((max(sent) - min(sent)) / 1e6, 3)
+
+        return summary
+
+
+def format_skew(summary):
+    if "skew_ms" not in summary:
+        return "not started"
+
+    return "skew {} ms (max {} ms over {} devices)".format(summary["skew_ms"], summary["max_skew_ms"],
+                                                           summary["devices"])
+
+
+def synchronized_start(interface, title, coordinator):
+    """ Prepare, wait for the other devices and start (runs on the device's own thread)
+
+        :returns:
+            (success, summary)
+    """
+
+    ready = interface.prepare_start()
+
+    success = False
+    sent_ns = ack_ns = None
+    if coordinator.release(title, ready):
+        sent_ns = time.monotonic_ns()
+        success = interface.trigger_start()
+        ack_ns = time.monotonic_ns()
+
+    coordinator.report(title, success, sent_ns, ack_ns)
+    return success, coordinator.finish(title)
@@ -0,0 +1,96 @@
+import time
+import logging
+
+# Start profile logger
+logger = logging.getLogger('PC.STARTUP')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# STARTUP PROFILE                              #
+#                                              #
+# - Time spent in the phases of the startup of #
+#   an entry point                             #
+#                                              #
+################################################
+
+# An entry point imports this module first and marks the end of every startup phase (imports, window, devices, ...).
+# A phase lasts from the previous mark to its own. Work which is done lazily later on (e.g. loading a device backend)
+# is recorded with its own duration and listed separately, so the report shows what the startup paid for and what
+# was deferred.
+
+# Reference time: the import of this module (about the launch of the entry point)
+_launch = time.monotonic()
+_last_mark = _launch
+
+# (name, duration in seconds) of the startup phases and of the lazily loaded parts
+_phases = []
+_deferred = []
+
+_reported = False
+
+
+def get_elapsed():
+    """ :returns:
+            Seconds since the launch
+    """
+
+    return time.monotonic() - _launch
+
+
+def mark(name):
+    """ End of a startup phase
+    """
+
+    global _last_mark
+
+    now = time.monotonic()
+    _phases.append((name, now - _last_mark))
+    _last_mark = now
+
+
+def add_deferred(name, duration):
+    """ Record work which was done lazily (duration in seconds)
+    """
+
+    _deferred.append((name, duration))
+
+
+def is_reported():
+    return _reported
+
+
+def get_report():
+    """ :returns:
+            Dictionary with the total startup time and the phases (milliseconds)
+    """
+
+    return dict({"total": round((_last_mark - _launch) * 1000, 1),
+                 "phases": [(name, round(duration * 1000, 1)) for name, duration in _phases],
+                 "deferred": [(name, round(duration * 1000, 1)) for name, duration in _deferred]})
+
+
+def format_report(report=None):
+    report = report or get_report()
+
+    text = "Startup {:.0f} ms".format(report["total"])
+    if report["phases"]:
+        text += ": " + ", ".join("{} {:.0f} ms".format(name, duration) for name, duration in report["phases"])
+    if report["deferred"]:
+        text += " (loaded on demand: {})".format(", ".join("{} {:.0f} ms".format(name, duration)
+                                                           for name, duration in report["deferred"]))
+
+    return text
+
+
+def log_report():
+    """ Log the report, once (the end of the startup)
+    """
+
+    global _reported
+
+    if _reported:
+        return
+
+    _reported = True
+    logger.info(format_report())
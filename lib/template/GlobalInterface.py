@@ -1,4 +1,6 @@
-import datetime
+import time
+
+from lib import metrics
 
 
 class GlobalInterface:
@@ -11,7 +13,20 @@ class GlobalInterface:
         self._timeout = 0.005
         self._mode = mode
 
-        self._time_zero = datetime.datetime.now()
+        # Maximum time (seconds) process_data may block while waiting for data. 0 => never block
+        self._wait_timeout = 0
+
+        # Reference time of the recording (time.monotonic_ns())
+        self._time_zero = time.monotonic_ns()
+
+        # Samples returned by process_data (SampleBatch, reused between calls)
+        self._batch = None
+
+        # Duration (ms) of the phases of the last connect/start handshake
+        self._timings = dict()
+
+        # Counters and latencies (lib/metrics.py), replaced by the ones of the device with set_metrics
+        self._metrics = metrics.DeviceMetrics('')
 
     def get_port(self):
         return self._port
@@ -25,6 +40,54 @@ class GlobalInterface:
     def get_instance(self):
         return self._comm
 
+    def get_timings(self):
+        return dict(self._timings)
+
+    def get_metrics(self):
+        return self._metrics
+
+    def set_metrics(self, device_metrics):
+        self._metrics = device_metrics
+
+    def get_recording_metadata(self):
+        """ Metadata of the measurement which is stored in the recording when the device stops
+
+            :returns:
+                Dictionary (empty if the device has nothing to add)
+        """
+
+        return dict()
+
+    def get_continuity(self):
+        """ Continuity tracker of the device time (lib/continuity.py)
+
+            :returns:
+                The tracker or None if the device has no sample counter
+        """
+
+        return None
+
+    def get_wait_timeout(self):
+        return self._wait_timeout
+
+    def set_wait_timeout(self, timeout):
+        self._wait_timeout = timeout
+
+    def get_fd(self):
+        """ File descriptor which becomes readable when new data arrives
+
+            :returns:
+                The descriptor or None if the source can't be watched
+        """
+
+        return None
+
+    def is_blocking(self):
+        """ Whether process_data blocks until data arrives (and therefore paces the caller)
+        """
+
+        return self._wait_timeout > 0
+
     def set_mode(self, mode):
         """ Set operating mode (fast, slow)
 
@@ -39,6 +102,24 @@ class GlobalInterface:
         self._mode = mode
         return True
 
+    def set_stream_mode(self, mode):
+        """ Select how the data is streamed by the device (Vicon)
+
+            :returns:
+                False if the mode is invalid or the device has no stream modes
+        """
+
+        return False
+
+    def set_profile(self, profile):
+        """ Select the data streams read from the device (Vicon)
+
+            :returns:
+                False if the profile is invalid or the device has no data streams to select
+        """
+
+        return False
+
     def set_port(self, port):
         self._port = port
 
@@ -60,7 +141,31 @@ class GlobalInterface:
     def start_device(self):
         pass
 
+    def prepare_start(self):
+        """ Everything of the start except the start command itself (see lib/start_sync.py)
+
+            :returns:
+                True if the device is ready to be started
+        """
+
+        return self.is_connected()
+
+    def trigger_start(self):
+        """ Send the start command (after prepare_start)
+
+            :returns:
+                True if the device started
+        """
+
+        return self.start_device()
+
     def process_data(self):
+        """ Read the samples received since the last call
+
+            :returns:
+                SampleBatch with the new samples (possibly empty, reused by the next call) or -1 on a lost connection
+        """
+
         pass
 
     def emit_error_signal(self):
@@ -0,0 +1,71 @@
+################################################
+# WORKER PROTOCOL                              #
+#                                              #
+# - Commands, responses and device types       #
+#   shared by all acquisition backends         #
+#                                              #
+################################################
+
+# The commands sent by the GUI thread
+WORKER_COMMAND = {
+    'connect': 1,
+    'disconnect': 2,
+    'start': 3,
+    'stop': 4,
+    'mode': 5,
+    'handler': 6,
+    'console': 7,
+    'export': 8,
+    'stream': 9,
+    'profile': 10
+}
+
+# The responses sent to the GUI thread
+WORKER_RESPONSE = {
+    'error': -1,
+    'connected': 1,
+    'disconnected': 2,
+    'started': 3,
+    'stopped': 4,
+    'mode_changed': 5,
+    'handler_changed': 6,
+    'log_data': 7,
+    'exported': 8,
+    'warning': 9,
+    'stream_changed': 10,
+    'profile_changed': 11
+}
+
+DATA_TYPES = {
+    'nan': 0,
+    'tmos': 1,
+    'vicon': 2
+}
+
+
+def get_command_name(command):
+    for name, value in WORKER_COMMAND.items():
+        if value == command:
+            return name
+
+    return None
+
+
+def get_response_name(response):
+    for name, value in WORKER_RESPONSE.items():
+        if value == response:
+            return name
+
+    return None
+
+
+def get_data_type_name(data_type):
+    for name, value in DATA_TYPES.items():
+        if value == data_type:
+            return name
+
+    return 'nan'
+
+
+def get_file_basename(name, title):
+    return "output/" + name.replace(" ", "_").upper() + "_" + title.replace(" ", "_").upper()
@@ -1,9 +1,14 @@
-import logging
-import datetime
+import time
 
 from PyQt5 import QtCore
 from PyQt5.QtCore import pyqtSlot
 
+from lib import recorder
+from lib.handshake import format_timings
+from lib.start_sync import synchronized_start, format_skew
+from lib.template import GlobalProtocol
+from lib.template.SampleSink import SampleSink
+
 
 ################################################
 # BASE THREAD WORKER FOR SENSORS               #
@@ -18,42 +23,28 @@ class QtGlobalWorker(QtCore.QObject):
     """ Main global worker
     """
 
-    # The commands sent by the GUI thread
-    WORKER_COMMAND = {
-        'connect': 1,
-        'disconnect': 2,
-        'start': 3,
-        'stop': 4,
-        'mode': 5,
-        'handler': 6,
-        'console': 7
-    }
-
-    # The responses sent to the GUI thread
-    WORKER_RESPONSE = {
-        'error': -1,
-        'connected': 1,
-        'disconnected': 2,
-        'started': 3,
-        'stopped': 4,
-        'mode_changed': 5,
-        'handler_changed': 6,
-        'log_data': 7
-    }
-
-    DATA_TYPES = {
-        'nan': 0,
-        'tmos': 1,
-        'vicon': 2
+    # The commands, responses and device types (see GlobalProtocol)
+    WORKER_COMMAND = GlobalProtocol.WORKER_COMMAND
+    WORKER_RESPONSE = GlobalProtocol.WORKER_RESPONSE
+    DATA_TYPES = GlobalProtocol.DATA_TYPES
+
+    # How read_data is scheduled
+    #  - timer: fixed interval timer
+    #  - event: woken by the data source (socket notifier on its fd or a blocking read). Sources which can't be
+    #           watched are polled with an exponential backoff bounded by the latency budget
+    SCHEDULER_MODE = {
+        'timer': 0,
+        'event': 1
     }
 
     _worker_response = QtCore.pyqtSignal(int, bool, str)
     _worker_command = QtCore.pyqtSignal(int, str)
+    _worker_start_synchronized = QtCore.pyqtSignal(object)
 
     def __init__(self, title, exp_name, interval, data_type):
         super().__init__()
 
-        self._time_zero = datetime.datetime.now()
+        self._time_zero = time.monotonic_ns()
 
         # Set variables
         self._title = title
@@ -61,24 +52,19 @@ class QtGlobalWorker(QtCore.QObject):
         self._interval = interval
         self.data_type = data_type
 
-        # Log sensor data to console
-        self._log_to_console = False
-
-        # Log to data plotter
-        self._log_to_plotter = False
-        self._logger_process = None
-
         # Global interface
         self._interface = None
 
-        # Data logger
-        self._data_logger = logging.getLogger('DATA.' + self._title)
-        self._data_logger.setLevel(logging.DEBUG)
-        self._data_logger.propagate = False  # Very ugly solution, but it works...
+        # Recording, plotter ring and console output
+        self._sink = SampleSink(self._title, self._exp_name, self.data_type)
 
-        # File Handler
-        self._fh = QtGlobalWorker._create_and_append_new_handler(self._exp_name, self._title)
-        self._data_logger.addHandler(self._fh)  # Print content to file
+        # Scheduler (intervals in milliseconds)
+        self._scheduler_mode = self.SCHEDULER_MODE['timer']
+        self._latency_budget = 50
+        self._backoff_interval = self._interval
+        self._backoff = False
+        self._notifier = None
+        self._interface_wait_timeout = None
 
         # Read timer (we HAVE to set the parent, otherwise we need to explicitly move the timer to the thread)
         self._read_timer = QtCore.QTimer(self)
@@ -86,8 +72,16 @@ class QtGlobalWorker(QtCore.QObject):
 
         # Signals
         self._worker_command.connect(self.received_command)  # Worker commands
+        self._worker_start_synchronized.connect(self.start_read_synchronized)  # START ALL
         self._read_timer.timeout.connect(self.read_data)  # Read timer
 
+    def set_interface(self, interface):
+        """ Set the device interface (by the subclasses), it reports to the metrics of the device
+        """
+
+        self._interface = interface
+        self._interface.set_metrics(self._sink.get_metrics())
+
     @pyqtSlot(int, str)
     def received_command(self, command, arg):
         if command == self.WORKER_COMMAND['connect']:
@@ -104,56 +98,157 @@ class QtGlobalWorker(QtCore.QObject):
             self.change_log_handler(arg)
         elif command == self.WORKER_COMMAND['console']:
             self.change_log_to_console(arg)
+        elif command == self.WORKER_COMMAND['export']:
+            self.export_log()
+        elif command == self.WORKER_COMMAND['stream']:
+            self.change_stream_mode(arg)
+        elif command == self.WORKER_COMMAND['profile']:
+            self.change_profile(arg)
 
     @pyqtSlot()
     def read_data(self):
         data = self._interface.process_data()
 
-        if data == -1:
+        if type(data) == int and data == -1:
             self.stop_read()
             self.emit_response('error', True, "Lost connection or empty frame! Stopping...")
-        elif type(data) == str and data != '':
-            for log_data in filter(None, data.split('\t')):
-                self._data_logger.debug(log_data)
+            return
 
-                if self._log_to_plotter and self._logger_process is not None:
-                    self.write_to_plotter_process("{}\t{}\t{}\n".format(self._title, self.data_type, log_data))
+        samples = self._sink.consume(data)
+        if samples is not None and self._sink.is_logging_to_console():
+            self.emit_response('log_data', True, '\t'.join(recorder.rows_to_text(samples)))
 
-            if self._log_to_console:
-                self.emit_response('log_data', True, data)
+        if self._backoff:
+            self._update_backoff(samples is not None)
 
     def connect(self, port):
-        self.emit_response('connected', self._interface.open_port(port), "")
-        self._read_timer.stop()
+        self._stop_scheduler()
+        success = self._interface.open_port(port)
+        self.emit_response('connected', success, format_timings(self._interface.get_timings()))
 
     def disconnect(self):
+        self._stop_scheduler()
         self.emit_response('disconnected', self._interface.close_port(), "")
-        self._read_timer.stop()
 
     def start_read(self):
-        self.emit_response('started', self._interface.start_device(), "")
-        self._read_timer.start()
+        success = self._interface.start_device()
+        self.emit_response('started', success, format_timings(self._interface.get_timings()))
+        self._start_scheduler()
+
+    @pyqtSlot(object)
+    def start_read_synchronized(self, coordinator):
+        """ Start together with the other devices of the coordinator (lib/start_sync.py)
+        """
+
+        self._stop_scheduler()
+        success, summary = synchronized_start(self._interface, self._title, coordinator)
+        if success:
+            self._sink.get_recorder().update_metadata(dict({"start": summary}))
+
+        self.emit_response('started', success, "{}, {}".format(format_timings(self._interface.get_timings()),
+                                                               format_skew(summary)))
+        if success:
+            self._start_scheduler()
+
+    def start_synchronized(self, coordinator):
+        """ Thread safe, runs start_read_synchronized in the worker thread
+        """
+
+        self._worker_start_synchronized.emit(coordinator)
 
     def stop_read(self):
+        self._stop_scheduler()
         self.emit_response('stopped', self._interface.stop_device(), "")
+
+        warning = self._sink.stopped(self._interface.get_continuity(), self._interface.get_recording_metadata())
+        if warning is not None:
+            self.emit_response('warning', True, warning)
+
+    def set_scheduler(self, mode, latency_budget=None):
+        """ Select how read_data is scheduled [SCHEDULER_MODE]. Takes effect at the next start
+
+            The latency budget (ms) bounds the backoff interval of polled sources and is the watchdog interval of
+            sources woken by a socket notifier
+        """
+
+        self._scheduler_mode = mode
+        if latency_budget is not None:
+            self._latency_budget = max(int(latency_budget), self._interval)
+
+    def _start_scheduler(self):
+        self._stop_scheduler()
+        self._backoff = False
+
+        if self._scheduler_mode == self.SCHEDULER_MODE['event']:
+            fd = self._interface.get_fd()
+            if fd is not None:
+                # Woken by the notifier, the data is already there => never block in process_data
+                self._interface_wait_timeout = self._interface.get_wait_timeout()
+                self._interface.set_wait_timeout(0)
+
+                self._notifier = QtCore.QSocketNotifier(fd, QtCore.QSocketNotifier.Read, self)
+                self._notifier.activated.connect(self.read_data)
+
+                # Watchdog, detects a lost connection even if the notifier never fires
+                self._read_timer.setInterval(self._latency_budget)
+            elif self._interface.is_blocking():
+                # The interface waits for the data itself
+                self._read_timer.setInterval(0)
+            else:
+                self._backoff = True
+                self._backoff_interval = self._interval
+                self._read_timer.setInterval(self._backoff_interval)
+        else:
+            self._read_timer.setInterval(self._interval)
+
+        self._read_timer.start()
+
+    def _stop_scheduler(self):
         self._read_timer.stop()
 
+        if self._notifier is not None:
+            self._notifier.setEnabled(False)
+            self._notifier.activated.disconnect(self.read_data)
+            self._notifier.deleteLater()
+            self._notifier = None
+
+        if self._interface_wait_timeout is not None:
+            self._interface.set_wait_timeout(self._interface_wait_timeout)
+            self._interface_wait_timeout = None
+
+    def _update_backoff(self, received):
+        if received:
+            interval = self._interval
+        else:
+            interval = min(max(2 * self._backoff_interval, 1), self._latency_budget)
+
+        if interval != self._backoff_interval:
+            self._backoff_interval = interval
+            self._read_timer.setInterval(interval)
+
     def change_mode(self, mode):
         self.emit_response('mode_changed', self._interface.set_mode(int(mode)), "[{}]".format(mode))
 
+    def change_stream_mode(self, mode):
+        self.emit_response('stream_changed', self._interface.set_stream_mode(int(mode)), "[{}]".format(mode))
+
+    def change_profile(self, profile):
+        self.emit_response('profile_changed', self._interface.set_profile(int(profile)), "[{}]".format(profile))
+
     def change_log_handler(self, exp_name):
-        if exp_name == self._exp_name:
+        if not self._sink.change_exp_name(exp_name):
             self.emit_response('handler_changed', False, "Name unchanged")
             return
 
         self._exp_name = exp_name
+        self.emit_response('handler_changed', True, "[{}]".format(self._sink.get_recorder().get_filename()))
 
-        self._data_logger.removeHandler(self._fh)  # Remove current handler
-        self._fh.close()  # Close file
-        self._fh = QtGlobalWorker._create_and_append_new_handler(self._exp_name, self._title)  # Create new handler
-        self._data_logger.addHandler(self._fh)  # Attach this new handler
+    def export_log(self):
+        """ Export the current recording to the text log format (output/*.log)
+        """
 
-        self.emit_response('handler_changed', True, "[{}]".format(QtGlobalWorker.get_log_filename(self._exp_name, self._title)))
+        success, msg = self._sink.export_log()
+        self.emit_response('exported', success, msg)
 
     def emit_error_signal(self):
         self.emit_response('error', False, "")
@@ -169,11 +264,10 @@ class QtGlobalWorker(QtCore.QObject):
         self._interface.set_reference_time(t0)
 
     def change_log_to_console(self, activate):
-        self._log_to_console = activate == 'True'
+        self._sink.set_log_to_console(activate == 'True')
 
-    def set_logger_process(self, p):
-        self._logger_process = p
-        self._log_to_plotter = True
+    def set_plotter_ring(self, ring):
+        self._sink.set_plotter_ring(ring)
 
     def get_interval(self):
         return self._interval
@@ -192,23 +286,3 @@ class QtGlobalWorker(QtCore.QObject):
 
     def get_instance(self):
         return self._interface
-
-    def write_to_plotter_process(self, text):
-        try:
-            self._logger_process.stdin.write(text)
-            self._logger_process.stdin.flush()
-        except OSError:
-            self._logger_process = None
-            self._log_to_plotter = False
-            self.emit_response('log_data', True, "Plotter pipe is broken")
-
-    @staticmethod
-    def get_log_filename(name, title):
-        return "output/" + name.replace(" ", "_").upper() + "_" + title.replace(" ", "_").upper() + ".log"
-
-    @staticmethod
-    def _create_and_append_new_handler(name, title):
-        fh = logging.FileHandler(QtGlobalWorker.get_log_filename(name, title))
-        fh.setLevel(logging.DEBUG)
-
-        return fh
@@ -0,0 +1,96 @@
+import numpy as np
+
+from lib import recorder
+
+
+class SampleBatch:
+    """ Columnar block of samples returned by GlobalInterface.process_data
+
+        The rows are stored in a preallocated structured array of the device kind (recorder.SAMPLE_DTYPES) which is
+        reused between calls; it only grows if a call returns more samples than ever before. The consumers (recorder,
+        plotter ring, console) read the rows directly, nothing is formatted or parsed on the way.
+
+        Devices with additional recording streams (e.g. the Vicon markers) attach one batch per stream, they are only
+        recorded
+    """
+
+    def __init__(self, kind, capacity=256, dtype=None):
+        self._kind = kind
+        self._dtype = recorder.SAMPLE_DTYPES[kind] if dtype is None else dtype
+        self._data = np.zeros(capacity, dtype=self._dtype)
+        self._count = 0
+
+        # Stream name -> SampleBatch of the additional streams
+        self._streams = dict()
+
+    def __len__(self):
+        return self._count
+
+    def get_kind(self):
+        return self._kind
+
+    def get_dtype(self):
+        return self._dtype
+
+    def clear(self):
+        self._count = 0
+        for batch in self._streams.values():
+            batch.clear()
+
+    def add_stream(self, name, dtype, capacity=256):
+        """ Attach the batch of an additional recording stream, it is cleared together with this batch
+
+            :returns:
+                The SampleBatch of the stream
+        """
+
+        batch = self._streams.get(name)
+        if batch is None:
+            batch = self._streams[name] = SampleBatch(self._kind, capacity, dtype)
+
+        return batch
+
+    def remove_stream(self, name):
+        self._streams.pop(name, None)
+
+    def get_streams(self):
+        """ :returns:
+                Dictionary of stream name -> SampleBatch of the additional streams
+        """
+
+        return self._streams
+
+    def allocate(self, n):
+        """ Reserve n more rows
+
+            :returns:
+                View of the new rows, to be filled by the caller
+        """
+
+        end = self._count + n
+        if end > len(self._data):
+            grown = np.zeros(max(end, 2 * len(self._data)), dtype=self._dtype)
+            grown[:self._count] = self._data[:self._count]
+            self._data = grown
+
+        rows = self._data[self._count:end]
+        self._count = end
+        return rows
+
+    def truncate(self, count):
+        """ Drop the rows after the first count (e.g. rows allocated for a read which failed)
+        """
+
+        self._count = min(self._count, count)
+
+    def extend(self, rows):
+        """ Copy a structured array (of the same layout) into the batch
+        """
+
+        self.allocate(len(rows))[:] = rows
+
+    def rows(self):
+        """ The samples of the batch (a view, valid until the batch is cleared)
+        """
+
+        return self._data[:self._count]
@@ -0,0 +1,238 @@
+import time
+import collections
+
+from lib import recorder
+from lib import metrics
+from lib import async_writer
+from lib.template import GlobalProtocol
+from lib.template.SampleBatch import SampleBatch
+
+
+class SampleSink:
+    """ Destination of the samples of one device: the recording, the plotter ring and the console
+
+        Shared by the Qt workers and the acquisition engine, no Qt involved
+    """
+
+    def __init__(self, title, exp_name, data_type):
+        self._title = title
+        self._exp_name = exp_name
+        self._data_type = data_type
+
+        # Log sensor data to console
+        self._log_to_console = False
+
+        # Shared memory ring read by the data plotter
+        self._plotter_ring = None
+        self._plot_backlog = 0
+
+        # Acquisition metrics of the device
+        self._metrics = metrics.get_registry().device(self._title)
+        self._metrics.set_gauges(self.get_gauges)
+        self._reads = self._metrics.counter('reads')
+        self._samples = self._metrics.counter('samples')
+        self._plot_latency = self._metrics.histogram('parse_to_plot')
+
+        # (ring sequence, time written) of the samples which the plotter did not acknowledge yet
+        self._plot_pending = collections.deque(maxlen=1024)
+
+        # Data recorder (binary columnar file, written by the shared writer thread)
+        self._recorder = self._open_recorder()
+
+    def get_title(self):
+        return self._title
+
+    def get_exp_name(self):
+        return self._exp_name
+
+    def get_recorder(self):
+        return self._recorder
+
+    def get_metrics(self):
+        return self._metrics
+
+    def get_gauges(self):
+        """ Current queue depths (called from the metrics readers)
+        """
+
+        stats = self._recorder.get_stats()
+        return dict({"writer_queue": stats["queued"], "writer_high_water": stats["high_water"],
+                     "writer_dropped": stats["dropped"], "written_rows": stats["rows"],
+                     "plot_backlog": self._plot_backlog})
+
+    def is_logging_to_console(self):
+        return self._log_to_console
+
+    def set_log_to_console(self, activate):
+        self._log_to_console = activate
+
+    def set_plotter_ring(self, ring):
+        self._plotter_ring = ring
+        self._plot_pending.clear()
+        self._plot_backlog = 0
+
+    def consume(self, data):
+        """ Record and publish the data returned by process_data
+
+            :returns:
+                The samples (structured array) or None if there were none
+        """
+
+        self._reads.add()
+
+        if isinstance(data, SampleBatch):
+            self._record_streams(data)
+
+        samples = self.to_samples(data)
+        if samples is None or len(samples) == 0:
+            return None
+
+        self._samples.add(len(samples))
+        self._recorder.append(samples)
+
+        if self._plotter_ring is not None:
+            self._plotter_ring.write(samples)
+            self._update_plot_latency(self._plotter_ring)
+
+        return samples
+
+    def _record_streams(self, batch):
+        """ Record the additional streams of a batch (declared in the recording when they first have rows)
+        """
+
+        for name, stream_batch in batch.get_streams().items():
+            if len(stream_batch) == 0:
+                continue
+
+            if not self._recorder.has_stream(name):
+                self._recorder.add_stream(name, stream_batch.get_dtype())
+            self._recorder.append(stream_batch.rows(), name)
+
+    def _update_plot_latency(self, ring):
+        """ Record the parse -> plot latency of the samples the plotter acknowledged since the last call
+        """
+
+        self._plot_pending.append((ring.get_write_seq(), time.monotonic_ns()))
+        self._plot_backlog = ring.backlog()
+
+        read_seq = ring.get_read_seq()
+        read_time = ring.get_read_time()
+        while self._plot_pending and self._plot_pending[0][0] <= read_seq:
+            _, written = self._plot_pending.popleft()
+            if read_time >= written:
+                self._plot_latency.record((read_time - written) // 1000)
+
+    def to_samples(self, data):
+        """ Structured array of the data returned by process_data (SampleBatch or tab separated text rows)
+        """
+
+        if isinstance(data, SampleBatch):
+            return data.rows()
+
+        if type(data) == str and data != '':
+            return recorder.parse_rows(list(filter(None, data.split('\t'))), self._recorder.get_dtype())
+
+        return None
+
+    def stopped(self, continuity=None, metadata=None):
+        """ End of a measurement: store the writer statistics (and the continuity of the samples) and flush the
+            recording
+
+            :param continuity:
+                ContinuityTracker of the measurement, its gap index is written next to the recording
+            :param metadata:
+                Metadata of the device to store as well (GlobalInterface.get_recording_metadata)
+            :returns:
+                Warning message or None
+        """
+
+        warnings = []
+
+        stats = self._recorder.get_stats()
+        metadata = dict(metadata or dict())
+        metadata["writer"] = stats
+        if stats["dropped"]:
+            warnings.append("Disk too slow, {} sample blocks dropped".format(stats["dropped"]))
+
+        if continuity is not None:
+            summary = continuity.get_summary()
+            metadata["continuity"] = summary
+            if not summary["complete"]:
+                warnings.append("{} samples missing in {} gaps".format(summary["missing"], summary["gaps"]))
+
+            gap_filename = SampleSink.get_gap_index_filename(self._exp_name, self._title)
+            try:
+                continuity.write_index(gap_filename)
+            except OSError as e:
+                warnings.append("Could not write {}: {}".format(gap_filename, e))
+
+        self._recorder.update_metadata(metadata)
+        self._recorder.flush()
+
+        return ", ".join(warnings) if warnings else None
+
+    def change_exp_name(self, exp_name):
+        """ Close the current recording and start a new one
+
+            :returns:
+                False if the name did not change
+        """
+
+        if exp_name == self._exp_name:
+            return False
+
+        self._exp_name = exp_name
+
+        self._recorder.close()  # Close current file
+        self._recorder = self._open_recorder()  # Create new one
+
+        return True
+
+    def export_log(self):
+        """ Export the current recording to the text log format (output/*.log)
+
+            :returns:
+                (success, message)
+        """
+
+        if not self._recorder.flush(timeout=5.0):
+            return False, "Timeout while writing the recording"
+
+        log_filename = SampleSink.get_log_filename(self._exp_name, self._title)
+        try:
+            n = recorder.export_log(self._recorder.get_filename(), log_filename)
+        except (OSError, ValueError) as e:
+            return False, str(e)
+
+        return True, "[{}] {} rows".format(log_filename, n)
+
+    def close(self):
+        self._recorder.close()
+
+    def _open_recorder(self):
+        rec = SampleSink._create_recorder(self._exp_name, self._title, self._data_type)
+        rec.set_latency_histogram(self._metrics.histogram('parse_to_disk'))
+
+        return rec
+
+    @staticmethod
+    def get_log_filename(name, title):
+        return GlobalProtocol.get_file_basename(name, title) + ".log"
+
+    @staticmethod
+    def get_gap_index_filename(name, title):
+        return GlobalProtocol.get_file_basename(name, title) + ".gaps.json"
+
+    @staticmethod
+    def get_record_filename(name, title):
+        return GlobalProtocol.get_file_basename(name, title) + recorder.RECORD_EXTENSION
+
+    @staticmethod
+    def _create_recorder(name, title, data_type):
+        kind = GlobalProtocol.get_data_type_name(data_type)
+        rec = recorder.ColumnarRecorder(SampleSink.get_record_filename(name, title),
+                                        streams=dict({"samples": recorder.SAMPLE_DTYPES[kind]}),
+                                        metadata=recorder.create_metadata(name, title, kind), flush_interval=None)
+
+        # The writer thread flushes by time/size, the acquisition thread only queues
+        return async_writer.get_shared_writer().open(rec)
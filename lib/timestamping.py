@@ -0,0 +1,141 @@
+import numpy as np
+
+
+################################################
+# TIMESTAMPING                                 #
+#                                              #
+# - Maps device local time to host monotonic   #
+#   time with an online offset/drift model     #
+#                                              #
+################################################
+
+
+def elapsed_ms(t_ns, t0_ns):
+    """ Milliseconds between two time.monotonic_ns() values (scalar or array)
+    """
+
+    return (np.asarray(t_ns, dtype=np.int64) - t0_ns) // 1000000
+
+
+class ClockSync:
+    """ Online clock model of one device
+
+        Fits host_time = offset + drift * device_time by least squares over a sliding window of (device time, host
+        receive time) pairs. Receive times only ever lag the true sample time (USB latency, OS scheduling, bulk
+        reads), so the fitted line is shifted down to a low percentile of the residuals, i.e. towards the lower
+        envelope of the receive times. Until enough pairs are collected the receive time is used as is.
+
+        The model is reset if the device clock jumps backwards (device restarted, counter wrapped)
+    """
+
+    def __init__(self, window=512, min_samples=16, envelope_percentile=5):
+        self._window = window
+        self._min_samples = min_samples
+        self._envelope_percentile = envelope_percentile
+
+        self._device = np.zeros(window, dtype=np.float64)
+        self._host = np.zeros(window, dtype=np.float64)
+        self._count = 0
+        self._pos = 0
+
+        # Reference point; the regression runs on values relative to it (milliseconds) to keep full precision
+        self._device_ref = None
+        self._host_ref = 0
+        self._last_device = None
+
+        self._offset = 0.0
+        self._drift = 1.0
+        self._valid = False
+
+    def reset(self):
+        self._count = 0
+        self._pos = 0
+        self._device_ref = None
+        self._last_device = None
+        self._valid = False
+
+    def is_valid(self):
+        return self._valid
+
+    def get_drift(self):
+        """ Host milliseconds per device time unit
+        """
+
+        return self._drift
+
+    def get_offset_ns(self):
+        return self._host_ref + int(self._offset * 1000000)
+
+    def update(self, device_times, host_ns):
+        """ Add samples and return their corrected host times
+
+            :param device_times:
+                Device local times of the samples (any unit, increasing)
+            :param host_ns:
+                time.monotonic_ns() at reception, scalar for a whole batch or one per sample
+            :returns:
+                Corrected host times (time.monotonic_ns() scale) as int64 array
+        """
+
+        device_times = np.asarray(device_times, dtype=np.float64)
+        host_ns = np.broadcast_to(np.asarray(host_ns, dtype=np.int64), device_times.shape)
+        if len(device_times) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        if self._last_device is not None and device_times[0] < self._last_device:
+            self.reset()
+
+        if self._device_ref is None:
+            self._device_ref = device_times[0]
+            self._host_ref = int(host_ns[0])
+
+        self._last_device = device_times[-1]
+
+        device_rel = device_times - self._device_ref
+        host_rel = (host_ns - self._host_ref) / 1000000.0
+
+        self._add(device_rel, host_rel)
+        self._fit()
+
+        if not self._valid:
+            return host_ns.astype(np.int64)
+
+        # Never report a time after the sample was received
+        corrected = np.minimum(self._offset + self._drift * device_rel, host_rel)
+        return self._host_ref + (corrected * 1000000).astype(np.int64)
+
+    def _add(self, device_rel, host_rel):
+        n = len(device_rel)
+        if n >= self._window:
+            self._device[:] = device_rel[-self._window:]
+            self._host[:] = host_rel[-self._window:]
+            self._pos = 0
+            self._count = self._window
+            return
+
+        idx = (self._pos + np.arange(n)) % self._window
+        self._device[idx] = device_rel
+        self._host[idx] = host_rel
+        self._pos = (self._pos + n) % self._window
+        self._count = min(self._count + n, self._window)
+
+    def _fit(self):
+        if self._count < self._min_samples:
+            return
+
+        d = self._device[:self._count]
+        h = self._host[:self._count]
+
+        d_mean = d.mean()
+        var = np.dot(d - d_mean, d - d_mean)
+        if var <= 0:
+            return
+
+        drift = np.dot(d - d_mean, h - h.mean()) / var
+        if drift <= 0:
+            return
+
+        residuals = h - drift * d
+        self._drift = drift
+        self._offset = np.percentile(residuals, self._envelope_percentile)
+        self._valid = True
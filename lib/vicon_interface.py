@@ -1,9 +1,13 @@
+import time
 import logging
 import socket
-import datetime
 
+import numpy as np
+
+from lib import recorder
 from lib.template import GlobalInterface
-from vicon_dssdk import ViconDataStream
+from lib.template.SampleBatch import SampleBatch
+from lib.timestamping import elapsed_ms
 
 # Start vicon logger - Global logger, since there are multiple instances of the SerialInterface class
 logger = logging.getLogger('VICON.COMM')
@@ -18,17 +22,111 @@ logger.setLevel(logging.DEBUG)
 #                                              #
 ################################################
 
+# The Vicon SDK is only imported when the first interface is created (see lib/backends.py), so the stream modes and
+# data streams below can be used on machines without the SDK.
+ViconDataStream = None
+
+
+def load_sdk():
+    """ Import the Vicon SDK (once)
+
+        :raises ImportError:
+            If vicon_dssdk is not installed or can't be loaded
+    """
+
+    global ViconDataStream
+
+    if ViconDataStream is None:
+        from vicon_dssdk import ViconDataStream as sdk
+        ViconDataStream = sdk
+
+    return ViconDataStream
+
+
+# Stream modes:
+#  - server_push: the server sends every frame, the SDK buffers up to `buffer_size` of them. process_data drains all
+#    buffered frames and returns once GetFrame had to wait for a new one, so no frame is lost as long as a wake-up
+#    comes at least every `buffer_size` frames
+#  - client_pull / client_pull_prefetch: GetFrame fetches the latest frame (prefetch requests the next one in the
+#    background). Frames between two calls are lost, repeated frames are skipped
+#
+# Lost frames are detected from the frame numbers, counted and logged as ranges.
+#
+# Stream profile: only the data streams of the profile [DATA_STREAM flags] are enabled in the SDK and read. Segments
+# are the samples of the device, labeled and unlabeled markers are recorded into additional streams (see
+# recorder.VICON_STREAM_DTYPES). Marker labels get an index when they are first seen, the index stays the same for the
+# whole session and the label table is recorded at every start and whenever new labels appear.
+
 
 class ViconInterface(GlobalInterface.GlobalInterface):
     """ Main serial interface
     """
 
-    def __init__(self):
+    STREAM_MODE = {
+        'server_push': 0,
+        'client_pull': 1,
+        'client_pull_prefetch': 2
+    }
+
+    DATA_STREAM = {
+        'segments': 1,
+        'markers': 2,
+        'unlabeled_markers': 4
+    }
+
+    def __init__(self, stream_mode=STREAM_MODE['server_push'], buffer_size=16, profile=DATA_STREAM['segments'],
+                 buffered_threshold=0.0005):
         super(ViconInterface, self).__init__()
 
+        load_sdk()
         self._comm = ViconDataStream.Client()
         self._port = "192.168.10.1"
 
+        # Stream mode [STREAM_MODE] and the number of frames the SDK buffers in server push mode
+        self._stream_mode = stream_mode
+        self._buffer_size = buffer_size
+
+        # Server push: GetFrame returns the buffered frames right away and blocks until the next frame once the
+        # buffer is empty. A GetFrame which waited at least `buffered_threshold` seconds therefore took a new frame
+        # and ends the drain, which is capped at twice the buffer size in case frames keep arriving
+        self._buffered_threshold = buffered_threshold
+
+        # (frame number, capture time) of the newest frame read, the anchor of the frames drained with it
+        self._newest_frame = None
+
+        # Enabled data streams [DATA_STREAM flags]
+        self._profile = profile
+
+        # Cached subject/segment topology, re-read every `_topology_check_frames` frames or after an SDK error
+        self._topology = None
+        self._marker_topology = []
+        self._topology_check_frames = 100
+        self._frames_since_check = 0
+
+        # Number of the last frame read, to detect lost frames
+        self._last_frame_number = None
+
+        # Preallocated frame (one row per segment) and the per-segment values read from the SDK
+        self._frame = np.zeros(0, dtype=recorder.SAMPLE_DTYPES['vicon'])
+        self._values = np.zeros((0, 7), dtype=np.float64)
+        self._occluded = np.zeros(0, dtype=np.uint8)
+
+        self._batch = SampleBatch('vicon')
+
+        # Additional streams (only filled if enabled in the profile)
+        self._marker_frames = self._batch.add_stream('marker_frames', recorder.VICON_STREAM_DTYPES['marker_frames'])
+        self._markers = self._batch.add_stream('markers', recorder.VICON_STREAM_DTYPES['markers'])
+        self._unlabeled_markers = self._batch.add_stream('unlabeled_markers',
+                                                         recorder.VICON_STREAM_DTYPES['unlabeled_markers'])
+        self._marker_labels = self._batch.add_stream('marker_labels', recorder.VICON_STREAM_DTYPES['marker_labels'])
+
+        # (subject, marker) -> label index, and the labels which were not recorded yet
+        self._labels = dict()
+        self._new_labels = []
+
+        # "subject/segment" names of all segments seen, stored in the recording metadata (lib/merge.py)
+        self._segment_names = set()
+
     def open_port(self, port):
         """ Opens a port
 
@@ -60,11 +158,8 @@ class ViconInterface(GlobalInterface.GlobalInterface):
 
             logger.debug("Vicon connected!")
 
-            self._comm.SetStreamMode(ViconDataStream.Client.StreamMode.EServerPush)
-            self._comm.EnableSegmentData()
-            self._comm.EnableMarkerData()
-            self._comm.EnableUnlabeledMarkerData()
-            self._comm.EnableDeviceData()
+            self.apply_stream_mode()
+            self.apply_profile()
             # self._comm.SetAxisMapping(ViconDataStream.CoreClient.EForward, ViconDataStream.CoreClient.ELeft,
             #                           ViconDataStream.CoreClient.EUp)
 
@@ -103,6 +198,11 @@ class ViconInterface(GlobalInterface.GlobalInterface):
                 Returns true if it is connected
         """
 
+        self._last_frame_number = None
+
+        # Every recording gets the complete label table
+        self._new_labels = list(self._labels.items())
+
         if not self.is_connected() or not self._comm.GetFrame():
             return False
         return True
@@ -124,31 +224,235 @@ class ViconInterface(GlobalInterface.GlobalInterface):
         return True
 
     def process_data(self):
-        """ Process the data received from the MCU
+        """ Process the data received from the Vicon system
 
             :returns:
-                Returns true data was successfully processed
+                SampleBatch with one sample per segment of every frame received since the last call (empty if the
+                frame was already read in the pull modes) or -1 on errors
         """
 
         if not self.is_connected():
             return -1
 
+        self._batch.clear()
+
+        push = self._stream_mode == self.STREAM_MODE['server_push']
+        failed = False
+        drained = 0
         try:
-            if self._comm.GetFrame():
-                names = self._comm.GetSubjectNames()
-                log_text = ''
-                for i in names:
-                    segment_names = self._comm.GetSegmentNames(i)
-                    elapsed_time_ms = str(int((datetime.datetime.now() - self._time_zero).total_seconds() * 1000))
-                    for s in segment_names:
-                        pos = self._comm.GetSegmentGlobalTranslation(i, s)
-                        log_text = log_text + "{},{},{:.2f},{:.2f},{:.2f}\t".format(elapsed_time_ms, s, pos[0][0], pos[0][1], pos[0][2])
-
-                return log_text
-        except ViconDataStream.DataStreamException as e:
-            pass
-
-        return -1
+            # Drain the buffered frames (server push) until GetFrame has to wait for a new one. The pull modes read
+            # one frame, which is skipped if it was already read
+            for _ in range(2 * self._buffer_size if push else 1):
+                t0 = time.monotonic()
+                if not self._comm.GetFrame():
+                    failed = True
+                    break
+                waited = time.monotonic() - t0
+
+                number = self._comm.GetFrameNumber()
+                if number == self._last_frame_number:
+                    break
+                self._batch.extend(self.read_frame(number))
+                drained += 1
+
+                # GetFrame had to wait for a new frame: the buffer is empty
+                if push and waited >= self._buffered_threshold:
+                    self._metrics.count('drain_early_exits')
+                    break
+
+            # The buffered frames were all received now, their capture times are derived from the newest one
+            if drained > 1:
+                self.align_frame_times()
+        except ViconDataStream.DataStreamException:
+            # Subjects or segments might have changed
+            self._topology = None
+            self._metrics.count('frame_errors')
+            failed = True
+
+        # A repeated frame (pull modes) is no error, the batch is just empty
+        if len(self._batch) == 0 and failed:
+            return -1
+
+        return self._batch
+
+    def read_frame(self, number):
+        """ Extract the current frame: translation and rotation (quaternion) of every segment. The markers (if
+            enabled) are added to their streams of the batch
+
+            :raises ViconDataStream.DataStreamException:
+                On SDK errors
+            :returns:
+                The preallocated frame array (one row per segment, empty if segments are not enabled). It is
+                overwritten by the next call
+        """
+
+        rx_time = time.monotonic_ns()
+
+        self._frames_since_check += 1
+        if self._topology is None or self._frames_since_check >= self._topology_check_frames:
+            self.update_topology()
+
+        # Capture time = reception - total latency reported by the SDK
+        latency = self._comm.GetLatencyTotal()
+        capture_time = elapsed_ms(rx_time - int(latency * 1e9), self._time_zero)
+
+        number = self.count_frame(number)
+        self._newest_frame = (number, capture_time)
+        if self._profile & (self.DATA_STREAM['markers'] | self.DATA_STREAM['unlabeled_markers']):
+            self.read_markers(number, capture_time)
+
+        values = self._values
+        occluded = self._occluded
+        for i, (subject, segment) in enumerate(self._topology):
+            translation, occluded_t = self._comm.GetSegmentGlobalTranslation(subject, segment)
+            rotation, occluded_r = self._comm.GetSegmentGlobalRotationQuaternion(subject, segment)
+            values[i, 0:3] = translation
+            values[i, 3:7] = rotation
+            occluded[i] = occluded_t or occluded_r
+
+        frame = self._frame
+        frame['frame'] = number
+        frame['latency'] = latency * 1000
+        frame['time'] = capture_time
+        frame['rx_time'] = elapsed_ms(rx_time, self._time_zero)
+        frame['x'] = values[:, 0]
+        frame['y'] = values[:, 1]
+        frame['z'] = values[:, 2]
+        frame['qx'] = values[:, 3]
+        frame['qy'] = values[:, 4]
+        frame['qz'] = values[:, 5]
+        frame['qw'] = values[:, 6]
+        frame['occluded'] = occluded
+
+        self._metrics.record('read_to_parse', (time.monotonic_ns() - rx_time) // 1000)
+        return frame
+
+    def align_frame_times(self):
+        """ Capture times of the frames drained from the buffer in one call: the newest frame is anchored on its
+            reception minus the latency, the older ones are placed back from it by their frame numbers and the frame
+            rate (their own reception time is when they were taken from the buffer, not when they arrived)
+
+            :raises ViconDataStream.DataStreamException:
+                On SDK errors
+        """
+
+        rate = self._comm.GetFrameRate()
+        if not rate > 0:
+            return
+
+        newest_number, newest_time = self._newest_frame
+        period = 1000.0 / rate
+
+        for rows in (self._batch.rows(), self._marker_frames.rows()):
+            if len(rows):
+                rows['time'] = newest_time - np.rint((newest_number - rows['frame']) * period).astype(np.int64)
+
+    def read_markers(self, number, capture_time):
+        """ Add the labeled and unlabeled markers of the current frame to their streams
+
+            :raises ViconDataStream.DataStreamException:
+                On SDK errors, the rows of the frame are removed again
+        """
+
+        labeled = 0
+        unlabeled = 0
+        n_markers = len(self._markers)
+        n_unlabeled = len(self._unlabeled_markers)
+        try:
+            if self._profile & self.DATA_STREAM['markers']:
+                labeled = len(self._marker_topology)
+                rows = self._markers.allocate(labeled)
+                for i, (subject, marker, label) in enumerate(self._marker_topology):
+                    translation, occluded = self._comm.GetMarkerGlobalTranslation(subject, marker)
+                    rows[i] = (label, translation[0], translation[1], translation[2], occluded)
+
+            if self._profile & self.DATA_STREAM['unlabeled_markers']:
+                markers = self._comm.GetUnlabeledMarkers()
+                unlabeled = len(markers)
+                rows = self._unlabeled_markers.allocate(unlabeled)
+                for i, (translation, trajectory) in enumerate(markers):
+                    rows[i] = (trajectory, translation[0], translation[1], translation[2])
+        except ViconDataStream.DataStreamException:
+            self._markers.truncate(n_markers)
+            self._unlabeled_markers.truncate(n_unlabeled)
+            raise
+
+        self._marker_frames.allocate(1)[0] = (number, capture_time, labeled, unlabeled)
+
+        if self._new_labels:
+            rows = self._marker_labels.allocate(len(self._new_labels))
+            for i, ((subject, marker, segment), label) in enumerate(self._new_labels):
+                rows[i] = (label, subject.encode('ascii', 'replace')[:32], marker.encode('ascii', 'replace')[:32],
+                           segment.encode('ascii', 'replace')[:32])
+            self._new_labels = []
+
+    def count_frame(self, number):
+        """ Count the frame and the frames lost since the last one
+
+            :returns:
+                The frame number
+        """
+
+        self._metrics.count('frames')
+        if self._last_frame_number is not None and number > self._last_frame_number + 1:
+            self._metrics.count('frames_lost', number - self._last_frame_number - 1)
+            logger.info("Frames {} to {} lost".format(self._last_frame_number + 1, number - 1))
+        self._last_frame_number = number
+
+        return number
+
+    def update_topology(self):
+        """ Re-read the subject and segment names. The frame buffers are only reallocated if they changed
+        """
+
+        self._frames_since_check = 0
+
+        topology = []
+        marker_topology = []
+        for subject in self._comm.GetSubjectNames():
+            if self._profile & self.DATA_STREAM['segments']:
+                for segment in self._comm.GetSegmentNames(subject):
+                    topology.append((subject, segment))
+
+            if self._profile & self.DATA_STREAM['markers']:
+                for marker, segment in self._comm.GetMarkerNames(subject):
+                    marker_topology.append((subject, marker, self.get_label(subject, marker, segment)))
+
+        self._marker_topology = marker_topology
+
+        if topology == self._topology:
+            return
+
+        logger.debug("Vicon topology changed: {} segments".format(len(topology)))
+
+        self._topology = topology
+        self._frame = np.zeros(len(topology), dtype=recorder.SAMPLE_DTYPES['vicon'])
+        self._frame['subject'] = [subject.encode('ascii', 'replace')[:32] for subject, _ in topology]
+        self._frame['segment'] = [segment.encode('ascii', 'replace')[:32] for _, segment in topology]
+        self._values = np.zeros((len(topology), 7), dtype=np.float64)
+        self._occluded = np.zeros(len(topology), dtype=np.uint8)
+
+        names = np.char.add(np.char.add(self._frame['subject'], b'/'), self._frame['segment'])
+        self._segment_names.update(name.decode('ascii', 'replace') for name in names.tolist())
+
+    def get_recording_metadata(self):
+        """ :returns:
+                The segment table: every segment seen since the interface was created
+        """
+
+        return dict({"segments": sorted(self._segment_names)})
+
+    def get_label(self, subject, marker, segment):
+        """ Index of a marker label, new labels are queued for recording
+        """
+
+        key = (subject, marker, segment)
+        label = self._labels.get(key)
+        if label is None:
+            label = self._labels[key] = len(self._labels)
+            self._new_labels.append((key, label))
+
+        return label
 
     def read_text(self):
         """ Receive text from serial port.
@@ -159,6 +463,88 @@ class ViconInterface(GlobalInterface.GlobalInterface):
 
         pass
 
+    def get_stream_mode(self):
+        return self._stream_mode
+
+    def set_stream_mode(self, mode):
+        """ Select the stream mode [STREAM_MODE]. Applied immediately if connected, the scheduling of the readers
+            follows at the next start
+
+            :returns:
+                False for an invalid mode
+        """
+
+        if mode not in self.STREAM_MODE.values():
+            return False
+
+        self._stream_mode = mode
+        if self.is_connected():
+            try:
+                self.apply_stream_mode()
+            except ViconDataStream.DataStreamException:
+                return False
+
+        return True
+
+    def get_profile(self):
+        return self._profile
+
+    def set_profile(self, profile):
+        """ Select the data streams [DATA_STREAM flags]. Applied immediately if connected
+
+            :returns:
+                False for an invalid profile
+        """
+
+        if profile <= 0 or profile & ~sum(self.DATA_STREAM.values()):
+            return False
+
+        self._profile = profile
+        self._topology = None
+        if self.is_connected():
+            try:
+                self.apply_profile()
+            except ViconDataStream.DataStreamException:
+                return False
+
+        return True
+
+    def apply_profile(self):
+        """ Enable the data streams of the profile in the SDK and disable all others
+        """
+
+        if self._profile & self.DATA_STREAM['segments']:
+            self._comm.EnableSegmentData()
+        else:
+            self._comm.DisableSegmentData()
+
+        if self._profile & self.DATA_STREAM['markers']:
+            self._comm.EnableMarkerData()
+        else:
+            self._comm.DisableMarkerData()
+
+        if self._profile & self.DATA_STREAM['unlabeled_markers']:
+            self._comm.EnableUnlabeledMarkerData()
+        else:
+            self._comm.DisableUnlabeledMarkerData()
+
+        self._comm.DisableDeviceData()
+
+    def apply_stream_mode(self):
+        if self._stream_mode == self.STREAM_MODE['client_pull']:
+            self._comm.SetStreamMode(ViconDataStream.Client.StreamMode.EClientPull)
+        elif self._stream_mode == self.STREAM_MODE['client_pull_prefetch']:
+            self._comm.SetStreamMode(ViconDataStream.Client.StreamMode.EClientPullPreFetch)
+        else:
+            self._comm.SetStreamMode(ViconDataStream.Client.StreamMode.EServerPush)
+            self._comm.SetBufferSize(self._buffer_size)
+
+    def is_blocking(self):
+        """ In ServerPush mode GetFrame blocks until the next frame was received, the pull modes return at once
+        """
+
+        return self._stream_mode == self.STREAM_MODE['server_push']
+
     def get_version(self):
         if self._comm is None:
             return ''
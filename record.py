@@ -0,0 +1,381 @@
+# Imported first, the startup profile measures from here
+from lib import startup_profile
+
+import os
+import sys
+import time
+import json
+import signal
+import logging
+import argparse
+import threading
+
+from lib import metrics
+from lib import backends
+from lib import async_writer
+from lib.acquisition_engine import AcquisitionEngine, wait_for
+from lib.start_sync import StartCoordinator
+from lib.template import GlobalProtocol
+
+# Start recorder logger
+logger = logging.getLogger('PC.HEADLESS')
+logger.setLevel(logging.INFO)
+
+
+################################################
+# HEADLESS RECORDER                            #
+#                                              #
+# - Records TMOS sensors and the Vicon system  #
+#   without the GUI                            #
+#                                              #
+################################################
+
+# The devices are run on the acquisition engine, exactly like the --engine backend of the GUI: all devices are
+# connected in parallel, started together (synchronized start) and record until SIGINT/SIGTERM, the duration limit,
+# or until all devices were lost. Neither Qt nor the plotter are used, and the modules of a device kind (pyserial,
+# the Vicon SDK) are only imported if such a device is configured.
+#
+# Configuration file (JSON, all keys optional, command line arguments take precedence):
+#
+#   {"experiment": "Experiment 0", "rate": 8, "duration": 3600, "tmos": ["/dev/ttyUSB0", "/dev/ttyUSB1"],
+#    "vicon": "192.168.10.1", "vicon_stream": "server_push", "vicon_markers": ["markers"], "status_interval": 10}
+
+DEFAULT_CONFIG = {
+    "experiment": "Experiment 0",
+    "rate": 8,
+    "duration": None,
+    "tmos": [],
+    "vicon": None,
+    "vicon_stream": 'server_push',
+    "vicon_markers": [],
+    "status_interval": 10.0
+}
+
+# Sample rate (Hz) -> operation mode of the sensors
+RATE_MODE = {
+    8: 0,
+    32: 1
+}
+
+# Seconds to wait for the connect handshakes and the start of all devices
+CONNECT_TIMEOUT = 10.0
+START_TIMEOUT = 15.0
+
+
+def load_config(filename=None, args=None):
+    """ Session configuration: the defaults, overwritten by the configuration file and the given arguments
+
+        :returns:
+            Configuration dictionary (keys of DEFAULT_CONFIG)
+    """
+
+    config = dict(DEFAULT_CONFIG)
+
+    if filename is not None:
+        with open(filename, 'r') as fh:
+            loaded = json.load(fh)
+
+        unknown = set(loaded.keys()) - set(DEFAULT_CONFIG.keys())
+        if unknown:
+            raise ValueError("Unknown configuration keys: {}".format(", ".join(sorted(unknown))))
+        config.update(loaded)
+
+    for name, value in (args or dict()).items():
+        if value is not None:
+            config[name] = value
+
+    if config["rate"] not in RATE_MODE:
+        raise ValueError("Invalid rate {} (valid: {})".format(config["rate"], ", ".join(map(str, RATE_MODE))))
+
+    return config
+
+
+def create_devices(config):
+    """ Interfaces of the configured devices, only the backends of the used device kinds are loaded. A device kind
+        whose backend is not available is skipped
+
+        :returns:
+            List of (title, kind, port, interface)
+    """
+
+    devices = []
+
+    ports = list(config["tmos"])
+    if ports:
+        try:
+            tmos_backend = backends.load('tmos')
+        except backends.BackendUnavailable as e:
+            logger.error("Not recording the sensors: {}".format(e))
+            ports = []
+
+        if ports == ['auto']:
+            ports = tmos_backend.list_available_ports()
+            logger.info("Found {} serial port(s): {}".format(len(ports), ", ".join(ports)))
+
+        for i, port in enumerate(ports):
+            devices.append(("Sensor {}".format(i + 1), 'tmos', port,
+                            backends.create_interface('tmos', RATE_MODE[config["rate"]])))
+
+    if config["vicon"]:
+        try:
+            ViconInterface = backends.get_interface_class('vicon')
+        except backends.BackendUnavailable as e:
+            logger.error("Not recording the Vicon system: {}".format(e))
+            return devices
+
+        profile = ViconInterface.DATA_STREAM['segments']
+        for name in config["vicon_markers"]:
+            profile |= ViconInterface.DATA_STREAM[name]
+
+        interface = ViconInterface(ViconInterface.STREAM_MODE[config["vicon_stream"]], profile=profile)
+        devices.append(("Vicon", 'vicon', config["vicon"], interface))
+
+    return devices
+
+
+class HeadlessSession:
+    """ One recording session on the acquisition engine
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._engine = AcquisitionEngine(self.response_received)
+        self._reporter = metrics.MetricsReporter(metrics.get_registry())
+
+        # Titles of the connected and of the running devices (updated by the engine thread)
+        self._lock = threading.Lock()
+        self._connected = set()
+        self._running = set()
+
+        # Set to end the recording (signal, duration, all devices lost)
+        self._done = threading.Event()
+
+    def stop(self):
+        self._done.set()
+
+    def response_received(self, title, resp, success, arg):
+        """ Responses of the devices (called from the engine thread)
+        """
+
+        name = GlobalProtocol.get_response_name(resp)
+
+        with self._lock:
+            if name == 'connected' and success:
+                self._connected.add(title)
+            elif name == 'disconnected':
+                self._connected.discard(title)
+            elif name == 'started' and success:
+                self._running.add(title)
+            elif name == 'stopped' and title in self._running:
+                self._running.discard(title)
+                if not self._running:
+                    self._done.set()
+
+        if name == 'error':
+            logger.error("{}: {}".format(title, arg))
+        elif name == 'warning':
+            logger.warning("{}: {}".format(title, arg))
+        elif name != 'log_data':
+            logger.info("{}: {} {}{}".format(title, name, "successful" if success else "FAILED",
+                                             " (" + arg + ")" if arg else ""))
+
+    def run(self):
+        """ Record until stopped
+
+            :returns:
+                Exit code, 0 if the devices were recording
+        """
+
+        try:
+            devices = create_devices(self._config)
+        except backends.BackendUnavailable as e:
+            logger.error(str(e))
+            return 1
+
+        if not devices:
+            logger.error("No devices to record (see --help)")
+            return 1
+        startup_profile.mark("devices")
+
+        os.makedirs("output", exist_ok=True)
+
+        exp_name = self._config["experiment"]
+        for title, kind, _, interface in devices:
+            self._engine.add_device(title, exp_name, interface, GlobalProtocol.DATA_TYPES[kind])
+
+        self._engine.start()
+        self._reporter.start()
+
+        try:
+            if not self.connect(devices):
+                return 1
+            startup_profile.mark("connect")
+
+            if not self.start():
+                return 1
+            startup_profile.mark("start")
+
+            logger.info("Recording {} to output/ (Ctrl+C to stop)".format(", ".join(sorted(self._running))))
+            self.wait()
+        finally:
+            self.shutdown()
+
+        return 0
+
+    def connect(self, devices):
+        """ Connect all devices in parallel
+
+            :returns:
+                True if at least one device is connected
+        """
+
+        t0 = time.monotonic()
+        futures = [self._engine.send_command(title, GlobalProtocol.WORKER_COMMAND['connect'], port)
+                   for title, _, port, _ in devices]
+        for future in futures:
+            wait_for(future, CONNECT_TIMEOUT)
+
+        logger.info("Connected {} of {} device(s) in {:.0f} ms".format(len(self._connected), len(devices),
+                                                                        (time.monotonic() - t0) * 1000))
+        return len(self._connected) > 0
+
+    def start(self):
+        """ Start all connected devices together
+
+            :returns:
+                True if at least one device is recording
+        """
+
+        with self._lock:
+            titles = sorted(self._connected)
+
+        t0 = time.monotonic_ns()
+        for title in titles:
+            self._engine.set_reference_time(title, t0)
+
+        coordinator = StartCoordinator(len(titles), t0=t0)
+        futures = [self._engine.start_synchronized(title, coordinator) for title in titles]
+        for future in futures:
+            wait_for(future, START_TIMEOUT)
+
+        return len(self._running) > 0
+
+    def wait(self):
+        """ Block until the session ends. Reports the time until the first sample of every device and, every status
+            interval, the rates of the devices
+        """
+
+        registry = metrics.get_registry()
+        duration = self._config["duration"]
+        interval = self._config["status_interval"]
+
+        end = None if duration is None else time.monotonic() + duration
+        next_status = time.monotonic() + interval if interval else None
+        waiting = set(self._running)
+        previous = registry.snapshot()
+
+        while not self._done.is_set():
+            now = time.monotonic()
+            if end is not None and now >= end:
+                logger.info("Duration of {} s reached".format(duration))
+                break
+
+            for title in list(waiting):
+                if registry.device(title).counter('samples').value > 0:
+                    waiting.discard(title)
+                    logger.info("{}: first sample {:.0f} ms after launch".format(title,
+                                                                                 startup_profile.get_elapsed() * 1000))
+                    if not waiting:
+                        startup_profile.mark("first samples")
+                        startup_profile.log_report()
+
+            if next_status is not None and now >= next_status:
+                previous = self.log_status(previous)
+                next_status = now + interval
+
+            # Short waits until every device delivered its first sample
+            timeout = 0.01 if waiting else 0.5
+            if end is not None:
+                timeout = min(timeout, max(end - now, 0))
+            self._done.wait(timeout)
+
+    def log_status(self, previous):
+        snapshot = metrics.get_registry().snapshot()
+        rates = metrics.compute_rates(previous, snapshot)
+
+        for title in sorted(self._running):
+            device = snapshot["devices"].get(title)
+            if device is None:
+                continue
+
+            logger.info("{}: {:.1f} samples/s, {} samples, {} lost".format(
+                title, rates.get(title, dict()).get("samples", 0), device["counters"].get("samples", 0),
+                metrics.count_losses(device)))
+
+        return snapshot
+
+    def shutdown(self):
+        """ Stop and disconnect all devices, write the recordings and the metrics
+        """
+
+        with self._lock:
+            running = sorted(self._running)
+            connected = sorted(self._connected)
+
+        for title in running:
+            wait_for(self._engine.send_command(title, GlobalProtocol.WORKER_COMMAND['stop']), CONNECT_TIMEOUT)
+        for title in connected:
+            wait_for(self._engine.send_command(title, GlobalProtocol.WORKER_COMMAND['disconnect']), CONNECT_TIMEOUT)
+
+        self._engine.stop()
+        async_writer.stop_shared_writer()
+        self._reporter.stop()
+
+        logger.info("Metrics written to {}".format(self._reporter.get_filename()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="TMOS headless recorder")
+    parser.add_argument("--config", help="JSON configuration file (the arguments below take precedence)")
+    parser.add_argument("--experiment", help="Experiment name (default: {})".format(DEFAULT_CONFIG["experiment"]))
+    parser.add_argument("--tmos", action="append", metavar="PORT",
+                        help="Serial port of a TMOS sensor (repeatable), 'auto' records all detected sensors")
+    parser.add_argument("--vicon", nargs='?', const="192.168.10.1", metavar="ADDRESS",
+                        help="Record the Vicon system (default address: 192.168.10.1)")
+    parser.add_argument("--rate", type=int, choices=sorted(RATE_MODE.keys()), help="Sample rate of the sensors (Hz)")
+    parser.add_argument("--duration", type=float, help="Stop after this many seconds (default: until Ctrl+C)")
+    parser.add_argument("--vicon-stream", choices=['server_push', 'client_pull', 'client_pull_prefetch'],
+                        help="Vicon stream mode (default: server_push)")
+    parser.add_argument("--vicon-markers", nargs='+', choices=['markers', 'unlabeled_markers'],
+                        help="Also record the labeled and/or unlabeled Vicon markers")
+    parser.add_argument("--status-interval", type=float,
+                        help="Seconds between the status lines, 0 disables them (default: 10)")
+    parser.add_argument("--list-ports", action="store_true", help="List the detected sensor ports and exit")
+    args = parser.parse_args()
+    startup_profile.mark("imports")
+
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.list_ports:
+        try:
+            print("\n".join(backends.load('tmos').list_available_ports()))
+        except backends.BackendUnavailable as e:
+            parser.exit(1, "Cannot list the sensor ports: {}\n".format(e))
+        sys.exit(0)
+
+    try:
+        session_config = load_config(args.config, dict({"experiment": args.experiment, "tmos": args.tmos,
+                                                        "vicon": args.vicon, "rate": args.rate,
+                                                        "duration": args.duration, "vicon_stream": args.vicon_stream,
+                                                        "vicon_markers": args.vicon_markers,
+                                                        "status_interval": args.status_interval}))
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    session = HeadlessSession(session_config)
+
+    # Stop cleanly (recordings and gap index written) on Ctrl+C and when the process is terminated
+    signal.signal(signal.SIGINT, lambda *_: session.stop())
+    signal.signal(signal.SIGTERM, lambda *_: session.stop())
+
+    sys.exit(session.run())
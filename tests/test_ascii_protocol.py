@@ -0,0 +1,50 @@
+from lib import ascii_protocol
+
+LINE = b'x\t1\t1000\t250\t25.5\t251.5\t0.5\t1\t0\t'
+VALUES = [1.0, 1000.0, 250.0, 25.5, 251.5, 0.5, 1.0, 0.0]
+
+
+def test_normal_line():
+    values, malformed, truncated, undecodable, recovered = ascii_protocol.parse_lines([LINE, LINE])
+
+    assert values.shape == (2, ascii_protocol.VALUE_COUNT)
+    assert values[0].tolist() == VALUES
+    assert (malformed, truncated, undecodable, recovered) == (0, 0, 0, 0)
+
+
+def test_truncated_line_is_skipped():
+    values, malformed, truncated, undecodable, recovered = ascii_protocol.parse_lines([b'x\t1\t1000\t25', LINE])
+
+    assert values.tolist() == [VALUES]
+    assert (malformed, truncated, undecodable, recovered) == (0, 1, 0, 0)
+
+
+def test_empty_line_is_not_truncated():
+    values, malformed, truncated, _, _ = ascii_protocol.parse_lines([b'', b'  ', LINE])
+
+    assert len(values) == 1
+    assert (malformed, truncated) == (0, 0)
+
+
+def test_merged_line_is_recovered_from_the_last_fields():
+    # The line end of the first record was lost, its beginning merged into the first field of the next record
+    merged = b'x\t1\t990\t24' + LINE
+
+    values, malformed, truncated, undecodable, recovered = ascii_protocol.parse_lines([merged])
+
+    assert values.tolist() == [VALUES]
+    assert (malformed, truncated, undecodable, recovered) == (0, 1, 0, 1)
+
+
+def test_undecodable_line_is_skipped():
+    values, malformed, truncated, undecodable, recovered = ascii_protocol.parse_lines([b'\xff\xfe\t1\t2', LINE])
+
+    assert values.tolist() == [VALUES]
+    assert (malformed, truncated, undecodable, recovered) == (0, 0, 1, 0)
+
+
+def test_invalid_values_are_malformed():
+    values, malformed, _, _, _ = ascii_protocol.parse_lines([b'x\t1\t1000\tabc\t25.5\t251.5\t0.5\t1\t0\t'])
+
+    assert len(values) == 0
+    assert malformed == 1
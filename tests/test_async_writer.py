@@ -0,0 +1,61 @@
+import time
+
+from lib import async_writer
+
+
+class MemoryRecorder:
+    """ Recorder keeping the appended rows in memory
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.flushed = 0
+        self.closed = False
+
+    def get_filename(self):
+        return "memory"
+
+    def has_stream(self, stream):
+        return stream == 'samples'
+
+    def append(self, rows, stream='samples'):
+        self.rows.extend(rows.tolist())
+
+    def flush(self):
+        self.flushed += 1
+
+    def close(self):
+        self.closed = True
+
+    def is_closed(self):
+        return self.closed
+
+
+def test_flush_waits_until_written():
+    writer = async_writer.AsyncWriter()
+    rec = MemoryRecorder()
+    q = writer.open(rec)
+    try:
+        q.append([1, 2, 3])
+        assert q.flush(timeout=5)
+        assert rec.rows == [1, 2, 3]
+        assert rec.flushed >= 1
+    finally:
+        writer.stop()
+
+
+def test_flush_after_close_returns_right_away():
+    writer = async_writer.AsyncWriter()
+    rec = MemoryRecorder()
+    q = writer.open(rec)
+    try:
+        q.append([1, 2])
+        q.close()
+
+        start = time.monotonic()
+        assert q.flush(timeout=5)
+        assert q.flush(timeout=5)
+        assert time.monotonic() - start < 1
+        assert rec.closed and rec.rows == [1, 2]
+    finally:
+        writer.stop()
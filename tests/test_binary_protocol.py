@@ -0,0 +1,69 @@
+import numpy as np
+
+from lib import binary_protocol
+
+
+def make_frames(count, first_time=0):
+    return b''.join(binary_protocol.encode_frame(1, first_time + i, 1000 + i, 25.0, 1000.5 + i, 0.5, 1, 0)
+                    for i in range(count))
+
+
+def test_frame_crcs_match_frame_crc():
+    payloads = np.random.default_rng(0).integers(0, 256, size=(50, 24), dtype=np.uint8)
+
+    crcs = binary_protocol.frame_crcs(payloads)
+
+    assert list(crcs) == [binary_protocol.frame_crc(row.tobytes()) for row in payloads]
+
+
+def test_decode_aligned_frames():
+    buffer = bytearray(make_frames(5))
+
+    frames, consumed, crc_errors, skipped = binary_protocol.decode_frames(buffer)
+
+    assert list(frames['in_time']) == [0, 1, 2, 3, 4]
+    assert consumed == len(buffer)
+    assert (crc_errors, skipped) == (0, 0)
+
+
+def test_resync_after_garbage():
+    garbage = b'\x00\x13\x5a\x37garbage'
+    buffer = bytearray(make_frames(2) + garbage + make_frames(3, first_time=2))
+
+    frames, consumed, crc_errors, skipped = binary_protocol.decode_frames(buffer)
+
+    assert list(frames['in_time']) == [0, 1, 2, 3, 4]
+    assert consumed == len(buffer)
+    assert skipped == len(garbage)
+    assert crc_errors == 0
+
+
+def test_crc_mismatch_is_rejected():
+    buffer = bytearray(make_frames(3))
+    # Corrupt the distance of the second frame
+    buffer[binary_protocol.FRAME_SIZE + 8] ^= 0xFF
+
+    frames, consumed, crc_errors, skipped = binary_protocol.decode_frames(buffer)
+
+    assert list(frames['in_time']) == [0, 2]
+    assert crc_errors == 1
+    assert skipped == binary_protocol.FRAME_SIZE
+    assert consumed == len(buffer)
+
+
+def test_partial_trailing_frame_is_kept():
+    frame = make_frames(1, first_time=3)
+    buffer = bytearray(make_frames(3) + frame[:10])
+
+    frames, consumed, crc_errors, skipped = binary_protocol.decode_frames(buffer)
+
+    assert list(frames['in_time']) == [0, 1, 2]
+    assert consumed == 3 * binary_protocol.FRAME_SIZE
+
+    # The rest of the frame arrives with the next read
+    del buffer[:consumed]
+    buffer += frame[10:]
+    frames, consumed, _, _ = binary_protocol.decode_frames(buffer)
+
+    assert list(frames['in_time']) == [3]
+    assert consumed == binary_protocol.FRAME_SIZE
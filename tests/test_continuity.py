@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+
+from lib import continuity
+from lib.continuity import ContinuityTracker
+
+PERIOD = 125.0
+
+
+def update(tracker, in_times, dev_id=1, first_time=0):
+    in_times = np.asarray(in_times, dtype=np.float64)
+    return tracker.update(np.full(len(in_times), dev_id), in_times, first_time + np.arange(len(in_times)) * 1000)
+
+
+def event_kinds(tracker):
+    return [continuity.get_event_name(kind) for kind in tracker.get_events()['kind']]
+
+
+def test_continuous_samples():
+    tracker = ContinuityTracker(PERIOD)
+    update(tracker, np.arange(10) * PERIOD)
+
+    assert tracker.is_complete()
+    assert len(tracker.get_events()) == 0
+    assert tracker.get_counts()["samples"] == 10
+
+
+def test_gap():
+    tracker = ContinuityTracker(PERIOD)
+    counts = update(tracker, [0, 125, 250, 750, 875])
+
+    assert counts["gaps"] == 1
+    assert counts["missing"] == 3
+    assert not tracker.is_complete()
+    assert event_kinds(tracker) == ['gap']
+    assert tracker.get_events()['in_time'].tolist() == [750.0]
+
+
+def test_gap_across_updates():
+    tracker = ContinuityTracker(PERIOD)
+    update(tracker, [0, 125])
+    counts = update(tracker, [500, 625])
+
+    assert (counts["gaps"], counts["missing"]) == (1, 2)
+
+
+def test_duplicate():
+    tracker = ContinuityTracker(PERIOD)
+    counts = update(tracker, [0, 125, 125, 250])
+
+    assert counts["duplicates"] == 1
+    assert tracker.is_complete()
+    assert event_kinds(tracker) == ['duplicate']
+
+
+def test_reorder():
+    tracker = ContinuityTracker(PERIOD)
+    counts = update(tracker, [0, 125, 375, 250, 500])
+
+    # The late sample fills the gap before it, nothing is lost
+    assert (counts["gaps"], counts["missing"], counts["reordered"]) == (0, 0, 1)
+    assert tracker.is_complete()
+    assert event_kinds(tracker) == ['reorder']
+
+
+def test_reorder_across_updates():
+    tracker = ContinuityTracker(PERIOD)
+    update(tracker, [0, 125, 500])
+    update(tracker, [250, 625], first_time=3000)
+
+    counts = tracker.get_counts()
+    assert (counts["gaps"], counts["missing"], counts["reordered"]) == (1, 1, 1)
+    assert not tracker.is_complete()
+
+    events = tracker.get_events()
+    assert event_kinds(tracker) == ['gap', 'reorder']
+    assert events['missing'].tolist() == [1, 0]
+
+
+def test_restart():
+    tracker = ContinuityTracker(PERIOD)
+    counts = update(tracker, [10000, 10125, 0, 125, 250])
+
+    assert counts["restarts"] == 1
+    assert tracker.is_complete()
+    assert event_kinds(tracker) == ['restart']
+
+
+def test_sensors_are_tracked_separately():
+    tracker = ContinuityTracker(PERIOD)
+    dev_ids = np.array([1, 2, 1, 2, 1, 2])
+    in_times = np.array([0, 0, 125, 125, 250, 500], dtype=np.float64)
+    counts = tracker.update(dev_ids, in_times, np.arange(6))
+
+    assert (counts["gaps"], counts["missing"]) == (1, 2)
+    assert tracker.get_events()['dev_id'].tolist() == [2]
+
+
+def test_write_index(tmp_path):
+    tracker = ContinuityTracker(PERIOD)
+    update(tracker, [0, 125, 500, 500, 625])
+    filename = tmp_path / "SENSOR_1.gaps.json"
+
+    tracker.write_index(str(filename))
+
+    with open(str(filename)) as fh:
+        index = json.load(fh)
+
+    assert index["columns"] == list(continuity.EVENT_DTYPE.names)
+    assert index["summary"]["missing"] == 2
+    assert index["summary"]["complete"] is False
+    assert index["summary"]["period"] == PERIOD
+    assert [event[0] for event in index["events"]] == ['gap', 'duplicate']
+    assert index["events"][0][1:5] == [1, 500.0, 375.0, 2]
@@ -0,0 +1,90 @@
+import numpy as np
+
+from lib import merge
+from lib import recorder
+
+
+def write_recording(filename, kind, rows, metadata=None, chunk_rows=4):
+    rec = recorder.ColumnarRecorder(str(filename), streams=dict({"samples": recorder.SAMPLE_DTYPES[kind]}),
+                                    metadata=dict({"kind": kind, "title": filename.stem}), chunk_rows=chunk_rows,
+                                    flush_interval=None)
+    rec.append(rows)
+    if metadata is not None:
+        rec.update_metadata(metadata)
+    rec.close()
+
+    return str(filename)
+
+
+def tmos_rows(times, dev_id):
+    rows = np.zeros(len(times), dtype=recorder.SAMPLE_DTYPES['tmos'])
+    rows['time'] = times
+    rows['dev_id'] = dev_id
+    rows['dist_filt'] = times
+
+    return rows
+
+
+def vicon_rows(times, x):
+    rows = np.zeros(len(times), dtype=recorder.SAMPLE_DTYPES['vicon'])
+    rows['time'] = times
+    rows['frame'] = np.arange(len(times))
+    rows['subject'] = b'Body'
+    rows['segment'] = b'Root'
+    rows['x'] = x
+
+    return rows
+
+
+def test_watermark_merge_is_ordered_and_complete(tmp_path):
+    a = write_recording(tmp_path / "A.rec", 'tmos', tmos_rows(np.arange(0, 300, 10), 1))
+    b = write_recording(tmp_path / "B.rec", 'tmos', tmos_rows(np.arange(5, 200, 15), 2))
+    out = str(tmp_path / "MERGED.rec")
+
+    total = merge.merge_experiment([a, b], None, out)
+
+    merged = recorder.load_recording(out)['samples']
+    assert total == len(merged) == 30 + 13
+    assert np.all(np.diff(merged['time']) >= 0)
+    assert sorted(merged['time'][merged['sensor'] == b'A'].tolist()) == list(range(0, 300, 10))
+    assert list(np.unique(merged['dev_id'][merged['sensor'] == b'B'])) == [2]
+
+
+def test_take_until_with_duplicate_times(tmp_path):
+    filename = write_recording(tmp_path / "A.rec", 'tmos', tmos_rows([0, 10, 10, 20, 30], 1), chunk_rows=8)
+    cursor = merge.ChunkCursor(filename)
+    cursor.load()
+
+    assert cursor.take_until(10)['time'].tolist() == [0, 10, 10]
+    assert cursor.buffered()['time'].tolist() == [20, 30]
+
+
+def test_linear_and_nearest_join_across_gap(tmp_path):
+    # Vicon gap between 20 and 100 ms, longer than max_gap
+    tmos = write_recording(tmp_path / "A.rec", 'tmos', tmos_rows([5, 20, 65, 105], 1))
+    vicon = write_recording(tmp_path / "V.rec", 'vicon', vicon_rows([0, 10, 20, 100, 110], [0., 1., 2., 10., 11.]),
+                            metadata=dict({"segments": ["Body/Root"]}))
+
+    linear = str(tmp_path / "LINEAR.rec")
+    merge.merge_experiment([tmos], vicon, linear, merge.JOIN_METHOD['linear'], max_gap=50)
+    x = recorder.load_recording(linear)['samples']['Body/Root.x']
+
+    assert x[0] == 0.5
+    assert x[1] == 2.0
+    assert np.isnan(x[2])
+    assert x[3] == 10.5
+
+    nearest = str(tmp_path / "NEAREST.rec")
+    merge.merge_experiment([tmos], vicon, nearest, merge.JOIN_METHOD['nearest'], max_gap=50)
+    x = recorder.load_recording(nearest)['samples']['Body/Root.x']
+
+    assert x.tolist() == [0.0, 2.0, 10.0, 10.0]
+
+
+def test_segments_from_metadata_or_scan(tmp_path):
+    rows = vicon_rows([0, 10], [0., 1.])
+    with_table = write_recording(tmp_path / "V1.rec", 'vicon', rows, metadata=dict({"segments": ["Body/Root"]}))
+    without_table = write_recording(tmp_path / "V2.rec", 'vicon', rows)
+
+    assert merge.scan_segments(with_table) == [b'Body/Root']
+    assert merge.scan_segments(without_table) == [b'Body/Root']
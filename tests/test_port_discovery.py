@@ -0,0 +1,51 @@
+import types
+
+from lib import port_discovery
+
+
+def fake_port(device, serial_number):
+    return types.SimpleNamespace(device=device, vid=0x0483, pid=0x5740, serial_number=serial_number, location=None)
+
+
+def test_held_ports_are_not_probed(monkeypatch):
+    ports = [fake_port("/dev/ttyACM0", "A"), fake_port("/dev/ttyACM1", "B")]
+    probed = []
+
+    def probe(device, timeout):
+        probed.append(device)
+        return True
+
+    monkeypatch.setattr(port_discovery.list_ports, "comports", lambda: ports)
+    monkeypatch.setattr(port_discovery, "probe_port", probe)
+
+    discovery = port_discovery.PortDiscovery()
+    discovery.acquire("/dev/ttyACM0")
+
+    assert discovery.scan() == ["/dev/ttyACM1"]
+    assert probed == ["/dev/ttyACM1"]
+
+    # Released: probed and offered again
+    changes = discovery.get_in_use_changes()
+    discovery.release("/dev/ttyACM0")
+
+    assert discovery.get_in_use_changes() > changes
+    assert discovery.scan() == ["/dev/ttyACM0", "/dev/ttyACM1"]
+    assert probed == ["/dev/ttyACM1", "/dev/ttyACM0"]
+
+
+def test_released_port_is_probed_again_after_cached(monkeypatch):
+    ports = [fake_port("/dev/ttyACM0", "A")]
+    probed = []
+
+    monkeypatch.setattr(port_discovery.list_ports, "comports", lambda: ports)
+    monkeypatch.setattr(port_discovery, "probe_port", lambda device, timeout: probed.append(device) or True)
+
+    discovery = port_discovery.PortDiscovery()
+    assert discovery.scan() == ["/dev/ttyACM0"]
+
+    discovery.acquire("/dev/ttyACM0")
+    assert discovery.scan() == []
+
+    discovery.release("/dev/ttyACM0")
+    assert discovery.scan() == ["/dev/ttyACM0"]
+    assert probed == ["/dev/ttyACM0", "/dev/ttyACM0"]
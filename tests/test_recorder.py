@@ -0,0 +1,32 @@
+import logging
+
+from lib import recorder
+
+TMOS = recorder.SAMPLE_DTYPES['tmos']
+
+
+def test_parse_rows():
+    rows = recorder.parse_rows(['1000,1,500,250.0,25.5,251.5,0.5,1,0,1001'], TMOS)
+
+    assert len(rows) == 1
+    assert rows['time'][0] == 1000
+    assert rows['dist_filt'][0] == 251.5
+    assert rows['rx_time'][0] == 1001
+
+
+def test_rows_without_rx_time_are_accepted():
+    rows = recorder.parse_rows(['1000,1,500,250.0,25.5,251.5,0.5,1,0'], TMOS)
+
+    assert len(rows) == 1
+    assert rows['bin_2'][0] == 0
+    assert rows['rx_time'][0] == 0
+
+
+def test_malformed_rows_are_skipped_with_warning(caplog):
+    with caplog.at_level(logging.WARNING, logger='PC.RECORDER'):
+        rows = recorder.parse_rows(['1000,1,500', '1000,1,500,250.0,25.5,251.5,0.5,1,0,1001',
+                                    '1000,1,abc,250.0,25.5,251.5,0.5,1,0,1001'], TMOS)
+
+    assert rows['time'].tolist() == [1000]
+    assert "Skipped 1 malformed rows" in caplog.text
+    assert "Skipped 1 rows with invalid values" in caplog.text